@@ -14,6 +14,7 @@ TODO:
 # Imports
 import sys
 import os
+import copy
 
 app_root = os.path.dirname(os.path.abspath(os.path.realpath(__file__)))
 libspath = os.path.join(app_root, 'libs')
@@ -35,7 +36,12 @@ if os.path.exists(includespath):
         else:
             os.environ['LD_LIBRARY_PATH'] = inc
 
+import time
 import warnings
+import weakref
+import threading
+import collections
+import multiprocessing
 import numpy as np
 import matplotlib
 matplotlib.rcParams['font.family'] = 'sans-serif'
@@ -46,14 +52,19 @@ matplotlib.use("TkAgg")
 import matplotlib.pyplot as plt
 import matplotlib.backends.tkagg as tkagg
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-from PIL import Image, ImageTk
+from matplotlib.collections import LineCollection
+from PIL import Image, ImageTk, ImageDraw
 if sys.version_info.major < 3:
     import Tkinter as tk
     # import ttk
     import tkFileDialog as filedialog
+    import Queue as queue
+    string_types = basestring
 elif sys.version_info.major == 3:
     import tkinter as tk
     import tkinter.filedialog as filedialog
+    import queue
+    string_types = str
     # import tkinter.ttk as ttk
 else:
     raise ImportError("Could not import Tkinter")
@@ -61,12 +72,30 @@ else:
 from glass.command import command
 
 
+MODEL_MAPPINGS = ['arrival time', 'mass', 'kappa(R)', 'kappa(<R)',
+                  'Hubble time', 'Hubble constant', 'time delays',
+                  'shear(R)', 'shear']
+from server import ZappServer
+import sidecar
+import store
+import render
+from render import RenderPool
+from similarity import SimilarityIndex, MiniBatchKMeans
+import scoring
+from widgets import PanelGrid, FeaturePanel, ModelTable
+from contours import ContourCache
+from ensemble import GridCube, SharedEnsemble
+import memory
+from sketch import ProfileSketch
+
+
 class Zapp(tk.Frame, object):
     """
     Model zapper for GLASS states
     """
     __version__ = "0.2.0"
-    def __init__(self, master, gls_states=[], selection=None, **kwargs):
+    def __init__(self, master, gls_states=[], selection=None, state_files=None, indices=None,
+                 **kwargs):
         """
         Initialize with reference to master Tk
 
@@ -76,6 +105,10 @@ class Zapp(tk.Frame, object):
         Kwargs:
             gls_states <list(glass.Environment objects)> - glass environments from state files
             selection <list(int)> - preload a model selection
+            state_files <list(str)> - file names of the states (for their sidecar indices)
+            indices <list(sidecar.ZIndex objects)> - sidecar indices of the states, if
+                                                     already loaded (see StateLoader)
+            services <dict> - running resources handed over by teardown (see setup)
             verbose <bool> -  verbose mode; print command line statements
 
         Return:
@@ -84,6 +117,7 @@ class Zapp(tk.Frame, object):
         # default naming convention
         name = kwargs.pop('name', self.__class__.__name__.lower())
         verbose = kwargs.pop('verbose', False)
+        self.setup(services=kwargs.pop('services', None))
         themecolor1 = 'white smoke'
         themecolor2 = 'SlateBlue1'
 
@@ -91,14 +125,29 @@ class Zapp(tk.Frame, object):
         self.gls = gls_states
         self.g_index = len(self.gls)-1  # latest addition
         for g in self.gls:
-            g.make_ensemble_average()
+            ensemble_average(g)
+        self.state_files = list(state_files) if state_files else [None]*len(self.gls)
+        self.zidx = list(indices) if indices else \
+            [sidecar.index(g, f) for g, f in zip(self.gls, self.state_files)]
+        self.similarity = {}
+        self.similar_k = 100
+        self.similar_threshold = None
+        self.clustering = {}
+        self.contours = {}
+        self.tasks = {}
+        self.grid_cubes = {}
+        self._rendered_state = None
+        self._action_renders = 0
+        self.render_stats = {'requests': 0, 'renders': 0, 'actions': 0, 'last': 0, 'max': 0}
+        self.n_clusters = 100
+        self.cluster_var = tk.BooleanVar()
+        self.worst_first_var = tk.BooleanVar()
+        self.status_var = tk.BooleanVar()
         if selection:
             self.model_selection = set(selection)
         else:
             self.model_selection = set([])
-        self.model_mappings = ['arrival time', 'mass', 'kappa(R)', 'kappa(<R)',
-                               'Hubble time', 'Hubble constant', 'time delays',
-                               'shear(R)', 'shear']
+        self.model_mappings = list(MODEL_MAPPINGS)
 
         # Tk initializations
         tk.Frame.__init__(self, master, name=name, **kwargs)
@@ -193,6 +242,7 @@ class Zapp(tk.Frame, object):
                                               borderwidth=0,
                                               activebackground=themecolor2,
                                               activeforeground='white')
+        self.labels['status'] = tk.Label(self, text='', anchor=tk.W, font=("Arial", 10))
 
         # add some more colors
         self.configure(background=themecolor1)
@@ -239,6 +289,7 @@ class Zapp(tk.Frame, object):
             o.grid(row=pos[0], column=pos[1], rowspan=pos[2], sticky=pos[3],
                    padx=10, pady=10)
         self.rowconfigure(max([g[0] for g in grid_placement]), weight=2)
+        self.labels['status'].grid(row=15, column=0, columnspan=3, sticky=tk.W, padx=10)
         self.columnconfigure(2, weight=1)
 
         # bind keys to the canvas
@@ -251,6 +302,13 @@ class Zapp(tk.Frame, object):
         self.master.bind("<Up>", self.back_property)
         self.master.bind("<Down>", self.next_property)
         self.master.bind("<space>", self.tag)
+        self.master.bind("<s>", self.tag_similar)
+        self.master.bind("<c>", self.toggle_clusters)
+        self.master.bind("<w>", self.toggle_worst_first)
+        self.master.bind("<p>", self.toggle_play)
+        self.master.bind("<l>", self.tile_lenses)
+        self.master.bind("<f>", self.show_features)
+        self.master.bind("<t>", self.show_table)
         self.master.bind("<Escape>", self._on_close)
         self.master.bind("<Control-s>", self.save)
         self.master.bind("<Control-w>", self.write)
@@ -272,11 +330,31 @@ class Zapp(tk.Frame, object):
         self.filemenu.add_command(label="Save selection as...", command=self.save_as)
         # self.filemenu.add_command(label="Write state", command=self.write)
         self.filemenu.add_command(label="Write state as...", command=self.write_as)
+        self.filemenu.add_command(label="Batch export...", command=self.batch_export_as)
+        self.filemenu.add_command(label="Export animation as...",
+                                  command=self.export_animation_as)
         self.filemenu.add_command(label="Clear", command=self.clear_selection)
         self.filemenu.add_command(label="Clear All", command=self.clear_all)
         self.filemenu.add_command(label="Exit", command=self._on_close)
         self.menubar.add_cascade(label="File", menu=self.filemenu)
 
+        self.toolsmenu = tk.Menu(self.menubar, tearoff=0, activeborderwidth=0)
+        self.toolsmenu.add_command(label="Tag similar ( S )", command=self.tag_similar)
+        self.toolsmenu.add_command(label="Tag duplicates", command=self.tag_duplicates)
+        self.toolsmenu.add_checkbutton(label="Cluster mode ( C )", variable=self.cluster_var,
+                                       command=self.toggle_clusters)
+        self.toolsmenu.add_checkbutton(label="Worst first ( W )",
+                                       variable=self.worst_first_var,
+                                       command=self.toggle_worst_first)
+        self.toolsmenu.add_command(label="Compare states", command=self.compare)
+        self.toolsmenu.add_command(label="Play/Pause ( P )", command=self.toggle_play)
+        self.toolsmenu.add_command(label="Tile lenses ( L )", command=self.tile_lenses)
+        self.toolsmenu.add_command(label="Feature panel ( F )", command=self.show_features)
+        self.toolsmenu.add_command(label="Model table ( T )", command=self.show_table)
+        self.toolsmenu.add_checkbutton(label="Memory status", variable=self.status_var,
+                                       command=self.toggle_status)
+        self.menubar.add_cascade(label="Tools", menu=self.toolsmenu)
+
         self.helpmenu = tk.Menu(self.menubar, tearoff=0, activeborderwidth=0)
         self.helpmenu.add_command(label="Help", command=self.help_link)
         self.helpmenu.add_command(label="About...", command=self.about)
@@ -290,7 +368,7 @@ class Zapp(tk.Frame, object):
             print(self.__v__)
 
     @classmethod
-    def init(cls, gls_states=[], verbose=False):
+    def init(cls, gls_states=[], state_files=None, indices=None, verbose=False):
         """
         From files initialize a Zapper instance together with it's tk root
 
@@ -299,6 +377,8 @@ class Zapp(tk.Frame, object):
 
         Kwargs:
             gls_states <list(glass.Environment objects)> - glass environments from state files
+            state_files <list(str)> - file names of the states
+            indices <list(sidecar.ZIndex objects)> - sidecar indices of the states
             verbose <bool> -  verbose mode; print command line statements
 
         Return:
@@ -306,9 +386,89 @@ class Zapp(tk.Frame, object):
             zapper <Zapper object> - the actual app frame
         """
         root = tk.Tk()
-        zapper = Zapp(root, gls_states=gls_states, verbose=verbose)
+        zapper = Zapp(root, gls_states=gls_states, state_files=state_files, indices=indices,
+                      verbose=verbose)
         return root, zapper
 
+    def setup(self, services=None):
+        """
+        Set up the long-lived resources (render pool, render coalescing, playback, auxiliary
+        windows, background computations and exports, state loader, and RPC server); see teardown
+
+        Args:
+            None
+
+        Kwargs:
+            services <dict> - running resources and settings handed over by teardown
+
+        Return:
+            None
+        """
+        self.render_pool = None
+        self.prefetch = 0
+        self.shared_ensembles = []
+        self._dirty = False
+        self._render_forced = False
+        self.progressive = True
+        self._refine_key = None
+        self._refine_polling = False
+        self.playing = False
+        self.fps = 10
+        self.comparison = None
+        self._compare_keys = []
+        self._compare_polling = False
+        self.lens_tiles = None
+        self._tile_keys = []
+        self._tiles_polling = False
+        self.feature_panel = None
+        self._feature_view = None
+        self.model_table = None
+        self._table_view = None
+        self._waiting = {}
+        self._tasks_polling = False
+        self.exports = []
+        self._queued_exports = []
+        self._exports_polling = False
+        self.loader = None
+        self.server = None
+        for name, value in (services or {}).items():
+            setattr(self, name, value)
+
+    def teardown(self, services=True):
+        """
+        Stop the long-lived resources (see setup)
+
+        Args:
+            None
+
+        Kwargs:
+            services <bool> - also stop the RPC server and the state loader
+
+        Return:
+            kept <dict> - the resources which keep running (background exports and, unless
+                          stopped, server and loader) and the settings, to be handed to setup
+        """
+        self.playing = False
+        self.stop_render_pool()
+        self.close_shared_ensembles()
+        self.close_comparison()
+        self.close_lens_tiles()
+        self.close_feature_panel()
+        self.close_model_table()
+        self.close_grid_cubes()
+        kept = {'exports': self.exports, '_queued_exports': self._queued_exports,
+                '_exports_polling': self._exports_polling, 'prefetch': self.prefetch, 'progressive': self.progressive, 'fps': self.fps}
+        if services:
+            if self.server is not None:
+                self.server.stop()
+                self.server = None
+            if self.loader is not None:
+                self.loader.close(terminate=True)
+                self.loader = None
+        else:
+            kept.update(server=self.server, loader=self.loader)
+        return kept
+
     def __str__(self):
         return "{0:}{1:}({2:}x{3:})".format(self.master, self.__class__.__name__,
                                             self.winfo_width(), self.winfo_height())
@@ -416,6 +576,20 @@ class Zapp(tk.Frame, object):
         """
         return os.path.basename(self.gls[0].global_opts['argv'][-1])
 
+    @property
+    def index(self):
+        """
+        The sidecar index of the current state
+
+        Args/Kwargs:
+            None
+
+        Return:
+            zidx <sidecar.ZIndex object> - the per-model summary columns of the current state
+        """
+        if self.gls:
+            return self.zidx[self.g_index]
+
     def models(self, selection=None):
         """
         The glass state's models
@@ -490,7 +664,6 @@ class Zapp(tk.Frame, object):
         cidx = self.model_mappings.index(self.model_map.get())
         nextidx = (cidx + 1) % len(self.model_mappings)
         self.model_map.set(self.model_mappings[nextidx])
-        self.load_image()
 
     def back_property(self, event=None):
         """
@@ -502,7 +675,6 @@ class Zapp(tk.Frame, object):
         cidx = self.model_mappings.index(self.model_map.get())
         nextidx = (cidx - 1) % len(self.model_mappings)
         self.model_map.set(self.model_mappings[nextidx])
-        self.load_image()
 
     @property
     def obj_index(self):
@@ -615,6 +787,8 @@ class Zapp(tk.Frame, object):
         Return:
             dist <list()> - distribution of the model's Hubble rate
         """
+        if self.index is not None:
+            return self.index.H0_dist(obj_index=self.obj_index, key=key).tolist()
         dist = [[], [], []]  # 0: not_accepted; 1: accepted; 2: notag
         for m in self.models():
             obj, data = m['obj,data'][self.obj_index]
@@ -630,6 +804,9 @@ class Zapp(tk.Frame, object):
         """
         Filter models lying within a certain range of Hubble rates
         """
+        if self.index is not None:
+            return self.index.H0filter(self.H0_min, self.H0_max,
+                                       obj_index=self.obj_index).tolist()
         filtered = []
         for i, m in enumerate(self.models()):
             obj, data = m['obj,data'][self.obj_index]
@@ -716,53 +893,351 @@ class Zapp(tk.Frame, object):
         self.limits['H0_min'].delete(0, tk.END)
         self.limits['H0_min'].insert(0, strv)
 
+    def navigation(self):
+        """
+        The sequence of model indices stepped through by next and back
+
+        Args/Kwargs:
+            None
+
+        Return:
+            sequence <np.ndarray> - the H0-filtered model indices within the subset selection
+                                    (only cluster medoids in cluster mode)
+        """
+        sequence = np.asarray(self.H0filter(), dtype=int)
+        sequence = sequence[(sequence >= self.model_min) & (sequence < self.model_max)]
+        if self.cluster_mode:
+            sequence = np.intersect1d(sequence, self.clusters().medoids)
+        scores = self.scores() if self.worst_first_var.get() else None
+        if scores is not None:  # index order while the models are scored
+            score = scores['score']
+            sequence = sequence[np.argsort(-score[sequence], kind='mergesort')]
+        return sequence
+
+    def _step(self, step):
+        """
+        Move the model index by a number of steps along the navigation sequence
+
+        Args:
+            step <int> - number of steps (negative steps go back)
+
+        Kwargs/Return:
+            None
+        """
+        sequence = self.navigation()
+        if len(sequence) == 0:
+            return
+        pos = np.flatnonzero(sequence == self.model_index)
+        if len(pos):
+            i = pos[0] + step
+        elif self.worst_first_var.get():
+            i = 0
+        else:
+            i = np.searchsorted(sequence, self.model_index, side='right' if step > 0 else 'left')
+            i = i if step > 0 else i - 1
+        self.model_index = sequence[min(max(i, 0), len(sequence)-1)]
+
     def next(self, event=None):
         """
         Increments the model index
         """
-        index = min(self.model_index + 1, self.model_max-1)
-        filtered = self.H0filter()
-        while index not in filtered:
-            index = (index + 1) % (self.model_max-1)
-        self.model_index = index
+        self._step(1)
 
     def back(self, event=None):
         """
         Decrements the model index
         """
-        index = max(self.model_index - 1, self.model_min)
-        filtered = self.H0filter()
-        while index not in filtered:
-            index = (index - 1) % (self.model_max-1)
-        self.model_index = index
+        self._step(-1)
+
+    def scores(self, then=None):
+        """
+        Plausibility scores of the models of the current lens (computed in the background
+        on first use and cached in the sidecar index)
+
+        Args:
+            None
+
+        Kwargs:
+            then <func> - callback once the scores are computed (if they are not yet)
+
+        Return:
+            scores <dict(np.ndarray)> - the metrics (see scoring.METRICS) and the combined 'score';
+                                        higher values are less plausible; None while the models
+                                        are scored (or if scoring failed)
+        """
+        k = self.obj_index
+        names = scoring.METRICS + ['score']
+        if 'score:{}'.format(k) not in self.index.columns:
+            g = self.gls[self.g_index]
+            task = self.background(('score', self.g_index, k), scoring.plausibility, args=(g,),
+                                   kwargs={'obj_index': k,
+                                           'delays': self.index.column('time delays', k),
+                                           'observed': scoring.observed_signs(g.objects[k])},
+                                   then=then, message="Scoring models...")
+            if not task.ready() or task.error is not None:
+                return None
+            scores = task.get()
+            self.index.update(**dict(('{}:{}'.format(m, k), scores[m]) for m in names))
+        return dict((m, self.index.column(m, k)) for m in names)
+
+    def toggle_worst_first(self, event=None):
+        """
+        Switch between index order and worst-first (plausibility score) order of navigation
+
+        Args/Kwargs/Return:
+            None
+        """
+        if event:
+            self.worst_first_var.set(not self.worst_first_var.get())
+        if self.gls and self.worst_first_var.get():
+            if self.scores(then=self.toggle_worst_first) is None:
+                return
+            sequence = self.navigation()
+            if len(sequence):
+                self.model_index = sequence[0]
+
+    def fingerprints(self, then=None):
+        """
+        Content fingerprints of the models of the current state (see sidecar.fingerprints;
+        computed in the background on first use and cached in the sidecar index)
+
+        Args:
+            None
+
+        Kwargs:
+            then <func> - callback once the fingerprints are computed (if they are not yet)
+
+        Return:
+            fingerprints <np.ndarray> - uint64 fingerprints; None while the models are
+                                        fingerprinted or if they lack kappa maps
+        """
+        if not self.gls:
+            return None
+        if 'fingerprint' not in self.index.columns:
+            task = self.background(('fingerprint', self.g_index), sidecar.fingerprints,
+                                   args=(self.gls[self.g_index],), then=then,
+                                   message="Fingerprinting models...")
+            if not task.ready() or task.error is not None:
+                return None
+            self.index.update(fingerprint=task.get())
+        return self.index.fingerprints()
+
+    def tag_duplicates(self, event=None):
+        """
+        Tag the duplicates of models (all but the first model of each group of models with
+        identical fingerprints; deferred until the models are fingerprinted)
+
+        Args/Kwargs/Return:
+            None
+        """
+        fingerprints = self.fingerprints(then=self.tag_duplicates)
+        if fingerprints is None:
+            return
+        groups = sidecar.duplicate_groups(fingerprints)
+        duplicates = [i for g in groups for i in g[1:].tolist()]
+        self.model_selection.update(duplicates)
+        print("Tagged {} duplicates in {} groups of identical models".format(
+            len(duplicates), len(groups)))
+        self.request_render(force=True)
 
     def tag(self, event=None):
         """
-        Tag the model index
+        Tag the model index (the entire cluster of the model in cluster mode)
         """
         selected = self.model_index
+        if self.cluster_mode:
+            members = self.clusters().members(self.clusters().cluster(selected)).tolist()
+        else:
+            members = [selected]
         if selected in self.model_selection:
-            self.model_selection.remove(selected)
+            self.model_selection.difference_update(members)
+        else:
+            self.model_selection.update(members)
+        self.request_render(force=True)
+
+    def clusters(self):
+        """
+        The k-means clustering of the current state and lens (fitted in the background on first use)
+
+        Args/Kwargs:
+            None
+
+        Return:
+            clusters <similarity.MiniBatchKMeans object> - the clustering
+        """
+        key = (self.g_index, self.obj_index)
+        if key not in self.clustering:
+            self.clustering[key] = MiniBatchKMeans(self.gls[self.g_index],
+                                                   obj_index=self.obj_index,
+                                                   n_clusters=self.n_clusters).start()
+        return self.clustering[key]
+
+    @property
+    def cluster_mode(self):
+        """
+        Cluster mode: step through cluster medoids and tag entire clusters
+
+        Args/Kwargs:
+            None
+
+        Return:
+            mode <bool> - True if cluster mode is switched on (and the clustering is ready)
+        """
+        return self.cluster_var.get() and self.clusters().ready
+
+    def toggle_clusters(self, event=None):
+        """
+        Switch the cluster mode on or off (waits for the clustering in the background)
+
+        Args/Kwargs/Return:
+            None
+        """
+        if event:
+            self.cluster_var.set(not self.cluster_var.get())
+        if not self.gls or not self.cluster_var.get():
+            self.request_render(force=True)
+            return
+        clusters = self.clusters()
+        if clusters.error is not None:
+            self.cluster_var.set(False)
+        elif not clusters.ready:
+            print("Clustering models ({:.0%})".format(clusters.progress))
+            self.after(500, self.toggle_clusters)
         else:
-            self.model_selection.update([selected])
-        self.load_image()
+            medoid = clusters.medoids[clusters.cluster(self.model_index)]
+            self.model_index = medoid
+
+    def similarity_index(self):
+        """
+        The similarity index of the current state and lens (built in the background on first use)
+
+        Args/Kwargs:
+            None
+
+        Return:
+            index <similarity.SimilarityIndex object> - the nearest-neighbour index
+        """
+        key = (self.g_index, self.obj_index)
+        if key not in self.similarity:
+            self.similarity[key] = SimilarityIndex(self.gls[self.g_index],
+                                                   obj_index=self.obj_index).start()
+        return self.similarity[key]
+
+    def find_similar(self, index=None, k=None, threshold=None):
+        """
+        Find the models whose kappa maps are most similar to a model
+
+        Args:
+            None
+
+        Kwargs:
+            index <int> - the reference model index; default model_index
+            k <int> - maximal number of similar models; default similar_k
+            threshold <float> - maximal distance (in the PCA-reduced kappa space);
+                                default similar_threshold
+
+        Return:
+            similar <list(int)> - indices of the similar models, closest first
+        """
+        index = self.model_index if index is None else index
+        k = self.similar_k if k is None else k
+        threshold = self.similar_threshold if threshold is None else threshold
+        sindex = self.similarity_index()
+        if not sindex.ready:
+            print("Similarity index in progress ({:.0%}); searching the models indexed so far"
+                  .format(sindex.progress))
+        similar, _ = sindex.query(index, k=k, threshold=threshold)
+        return similar.tolist()
+
+    def tag_similar(self, event=None):
+        """
+        Tag the model index together with its most similar models
+        """
+        if not self.gls:
+            return
+        similar = self.find_similar()
+        self.model_selection.update([self.model_index] + similar)
+        print("Tagged {} similar models".format(len(similar)))
+        self.request_render(force=True)
 
     def open(self, name='filtered.state'):
         """
         Open a state file for zapping
         """
         state_file = name
-        state = loadstate(state_file)
-        if state not in self.gls:
-            self.gls.append(state)
-        else:
-            self.gls.remove(state)
-            self.gls.append(state)
+        state = import_state(state_file)
+        if state in self.gls:
+            i = self.gls.index(state)
+            del self.gls[i]
+            del self.state_files[i]
+        self.gls.append(state)
+        self.state_files.append(state_file)
+        pool = self.render_pool
+        kept = self.teardown(services=False)
         self.grid_forget()
         self.clear_buffer(all_=True)
         self.clear_selection(all_=True)
-        self.__init__(self.master, gls_states=self.gls, selection=self.model_selection)
-        self.load_image()
+        self.__init__(self.master, gls_states=self.gls, selection=self.model_selection,
+                      state_files=self.state_files, services=kept)
+        if pool is not None:
+            self.start_render_pool(processes=pool.processes, prefetch=self.prefetch)
+        self.request_render(force=True)
+
+    def add_state(self, state, state_file=None, zidx=None):
+        """
+        Add a loaded state (e.g. for comparisons) without switching the zapped state
+
+        Args:
+            state <glass.Environment object> - the glass state
+
+        Kwargs:
+            state_file <str> - file name of the state (for its sidecar index)
+            zidx <sidecar.ZIndex object> - the sidecar index, if already loaded
+
+        Return:
+            None
+        """
+        ensemble_average(state)
+        self.gls.append(state)
+        self.state_files.append(state_file)
+        self.zidx.append(zidx if zidx is not None else sidecar.index(state, state_file))
+        print("Loaded {} ({} models)".format(state_file, len(state.models)))
+        if self.comparison is not None:  # reopen with a panel for the new state
+            self.compare()
+
+    def stream_states(self, loader):
+        """
+        Add the states of a loader as they become ready (see StateLoader)
+
+        Args:
+            loader <StateLoader object> - the loader of the remaining states
+
+        Kwargs/Return:
+            None
+        """
+        if not len(loader):
+            loader.close()
+            return
+        self.loader = loader
+        self._poll_states()
+
+    def _poll_states(self):
+        loader = self.loader
+        if loader is None:
+            return
+        for name in loader.ready():
+            try:
+                name, state, zidx = loader.get(name)
+            except Exception as e:
+                print("Loading {} failed: {}".format(name, e))
+                continue
+            self.add_state(state, state_file=name, zidx=zidx)
+        if len(loader):
+            self.after(200, self._poll_states)
+        else:
+            loader.close()
+            self.loader = None
+        self.show_status()
 
     def open_as(self):
         """
@@ -779,13 +1254,17 @@ class Zapp(tk.Frame, object):
 
     def load(self, event=None, name="model_selection.dat"):
         """
-        Load a text file containing the model selection
+        Load a text file containing the model selection (deferred until the models are
+        fingerprinted)
         """
+        fingerprints = self.fingerprints(then=lambda: self.load(name=name))
+        if fingerprints is None and self.computing(('fingerprint', self.g_index)):
+            print("Loading {} once the models are fingerprinted".format(name))
+            return
         print("Loading {}".format(name))
-        with open(name, "r") as f:
-            selection = [int(s.strip()) for s in f.readlines() if not s.startswith('#')]
+        selection = read_selection(name, fingerprints=fingerprints)
         self.model_selection = set(sorted(selection))
-        self.load_image()
+        self.request_render(force=True)
 
     def load_as(self):
         """
@@ -795,14 +1274,18 @@ class Zapp(tk.Frame, object):
         if fin:
             self.load(name=fin)
 
-    def save(self, event=None, name="model_selection.dat"):
+    def save(self, event=None, name="model_selection.dat", selection=None):
         """
-        Save a text file containing the model selection
+        Save a text file containing the model selection (deferred until the models are
+        fingerprinted)
         """
+        selection = set(self.model_selection) if selection is None else selection
+        fingerprints = self.fingerprints(then=lambda: self.save(name=name, selection=selection))
+        if fingerprints is None and self.computing(('fingerprint', self.g_index)):
+            print("Saving {} once the models are fingerprinted".format(name))
+            return
         print("Saving {}".format(name))
-        with open(name, "w") as f:
-            f.write("".join(["# ", self.state_filename, "\n"]))
-            f.write("\n".join([str(i) for i in sorted(self.model_selection)]))
+        write_selection(name, selection, fingerprints=fingerprints, header=self.state_filename)
 
     def save_as(self):
         """
@@ -813,11 +1296,129 @@ class Zapp(tk.Frame, object):
         if fout:
             self.save(name=fout)
 
-    def write(self, event=None, name="filtered.state"):
+    def write(self, event=None, name="filtered.state", background=True):
         """
         Write a new state file including only the selected models
+
+        Args:
+            None
+
+        Kwargs:
+            event <Tk event> - bound event (ignored)
+            name <str> - file name of the filtered state
+            background <bool> - write in a background process (see start_export)
+
+        Return:
+            None
+        """
+        if background:
+            self.start_export(name)
+        else:
+            export_state(self.gls[self.g_index], selection=self.model_selection, name=name)
+
+    def start_export(self, name="filtered.state", selection=None):
+        """
+        Export the selected models in a (forked) background process, while zapping continues;
+        the selection is snapshot at the start, and the progress is shown in the status bar
+
+        Args:
+            None
+
+        Kwargs:
+            name <str> - file name of the filtered state
+            selection <list(int)> - model indices; default the tagged models
+
+        Return:
+            None
         """
-        export_state(self.gls[self.g_index], selection=self.model_selection, name=name)
+        if not self.gls:
+            return
+        if any([e['name'] == name for e in self.exports]):
+            print("{} is already being exported".format(name))
+            return
+        selection = sorted(self.model_selection if selection is None else selection)
+        self._start_export_process(_export_worker, (self.gls[self.g_index], selection, name),
+                                   name, len(selection) or len(self.models()))
+
+    def _start_export_process(self, target, args, name, N):
+        """
+        Start a background export process and poll its progress messages (see _poll_exports)
+
+        Args:
+            target <func> - the export worker, called with args and a message queue
+            args <tuple> - the arguments of the export worker
+            name <str> - file name of the export
+            N <int> - number of exported models
+
+        Kwargs:
+            None
+
+        Return:
+            None
+        """
+        messages = multiprocessing.Queue()
+        p = multiprocessing.Process(target=target, args=tuple(args) + (messages,))
+        p.start()
+        self.exports.append({'process': p, 'queue': messages, 'name': name, 'N': N,
+                             'stage': 'starting', 'start': time.time()})
+        print("Exporting {} models to {} in the background".format(N, name))
+        if not self._exports_polling:
+            self._exports_polling = True
+            self._poll_exports()
+
+    def _poll_exports(self):
+        """
+        Collect the progress messages of the background exports and report finished ones
+        """
+        for export in list(self.exports):
+            done = False
+            try:
+                while True:
+                    stage, info = export['queue'].get_nowait()
+                    export['stage'] = stage
+                    if stage == 'done':
+                        print("Exported {} ({:.1f} s)".format(export['name'],
+                                                             time.time()-export['start']))
+                        done = True
+                    elif stage == 'error':
+                        print("Exporting {} failed: {}".format(export['name'], info))
+                        done = True
+            except queue.Empty:
+                pass
+            if not done and not export['process'].is_alive() \
+               and export['queue'].empty():
+                print("Exporting {} failed (exit code {})".format(
+                    export['name'], export['process'].exitcode))
+                done = True
+            if done:
+                export['process'].join()
+                self.exports.remove(export)
+        self._start_queued_exports()
+        self.show_status()
+        if self.exports:
+            self.after(200, self._poll_exports)
+        else:
+            self._exports_polling = False
+
+    def export_status(self):
+        """
+        Progress of the background exports
+
+        Args/Kwargs:
+            None
+
+        Return:
+            status <str> - stage, size written so far, and elapsed time of each export
+        """
+        status = []
+        for export in self.exports:
+            size = ''
+            if export['stage'] == 'writing' and os.path.exists(export['name']):
+                size = ' {}'.format(memory.format_size(os.path.getsize(export['name'])))
+            status.append("{} ({} models): {}{} [{:.0f} s]".format(
+                os.path.basename(export['name']), export['N'], export['stage'], size,
+                time.time()-export['start']))
+        return " | ".join(status)
 
     def write_as(self, event=None):
         """
@@ -828,6 +1429,115 @@ class Zapp(tk.Frame, object):
         if fout:
             self.write(name=fout)
 
+    def batch_export(self, specs, names, processes=None):
+        """
+        Write several filtered states of the current state in background processes (cf.
+        export_states), at most a number of them at once; the progress is shown in the
+        status bar
+
+        Args:
+            specs <list(str)> - selection files or filter expressions (see resolve_selection)
+            names <list(str)> - file names of the filtered states
+
+        Kwargs:
+            processes <int> - maximal number of concurrent writers; default number of CPUs
+
+        Return:
+            queued <list(str)> - file names of the states being written
+        """
+        if not self.gls:
+            return []
+        g = self.gls[self.g_index]
+        processes = processes or multiprocessing.cpu_count()
+        queued = []
+        for spec, name in zip(specs, names):
+            selection = resolve_selection(g, spec, index=self.index, obj_index=self.obj_index)
+            if not len(selection):
+                warnings.warn("Empty selection for {}; skipped".format(name))
+                continue
+            self._queued_exports.append((processes, (g, sorted(selection), name), name,
+                                         len(selection)))
+            queued.append(name)
+        self._start_queued_exports()
+        return queued
+
+    def _start_queued_exports(self):
+        """
+        Start queued batch exports while fewer than their number of concurrent writers run
+        """
+        while self._queued_exports and len(self.exports) < self._queued_exports[0][0]:
+            _, args, name, N = self._queued_exports.pop(0)
+            self._start_export_process(_export_worker, args, name, N)
+
+    def batch_export_as(self, event=None):
+        """
+        Dialog-write a filtered state for each of several selection files (<selection>.state)
+        """
+        fins = filedialog.askopenfilenames(parent=self.master, defaultextension=".dat",
+                                           title="Select model selections")
+        if fins:
+            fins = list(self.master.tk.splitlist(fins))
+            self.batch_export(fins, [os.path.splitext(f)[0]+'.state' for f in fins])
+
+    def export_animation(self, name="zapp.gif", duration=100, dpi=None, verbose=False):
+        """
+        Export the models of the navigation sequence (current mapping and lens) as animated
+        GIF or numbered PNG sequence in a background process (see render.export_frames), while
+        zapping continues; the progress is shown in the status bar
+
+        Args:
+            None
+
+        Kwargs:
+            name <str> - path of the GIF file (.gif) or the PNG sequence (.png)
+            duration <int> - display time of each GIF frame in ms
+            dpi <float> - resolution of the frames
+            verbose <bool> - verbose mode; print command line statements
+
+        Return:
+            n_frames <int> - number of frames to be exported
+        """
+        if not self.gls:
+            return 0
+        if any([e['name'] == name for e in self.exports]):
+            print("{} is already being exported".format(name))
+            return 0
+        g = self.gls[self.g_index]
+        keys = [(i, self.obj_index, self.model_property) for i in self.navigation()]
+        self._start_export_process(
+            _animation_worker, (g, keys, name, self.view_selection(), dpi, duration,
+                                self.shared_ensemble(g), verbose), name, len(keys))
+        return len(keys)
+
+    def export_animation_as(self, event=None):
+        """
+        Dialog-export the models of the navigation sequence as animation
+        """
+        fout = filedialog.asksaveasfilename(parent=self.master, defaultextension=".gif",
+                                            initialfile='zapp.gif',
+                                            filetypes=[('GIF', '*.gif'), ('PNG sequence', '*.png')])
+        if fout:
+            self.export_animation(name=fout, verbose=True)
+
+    def serve(self, port=8722, verbose=False):
+        """
+        Start a local JSON-RPC control server (see server.py) for remote-driven zapping
+
+        Args:
+            None
+
+        Kwargs:
+            port <int> - port number on the loopback interface
+            verbose <bool> - verbose mode; print command line statements
+
+        Return:
+            server <ZappServer object> - the running server
+        """
+        if self.server is None:
+            self.server = ZappServer(self, port=port, verbose=verbose)
+            self.server.start()
+        return self.server
+
     def display(self, term=True):
         """
         Display the main window (wrapper for tk.mainloop)
@@ -861,29 +1571,94 @@ class Zapp(tk.Frame, object):
             if verbose:
                 print("Quitting the app")
             self.master.quit()
+        elif user_input.split()[:1] == ['mem']:
+            self.memory_command(*user_input.split()[1:])
+            self.after(100, self._term_control)
+        elif user_input == 'renders':
+            print("{requests} render requests, {renders} renders in {actions} actions "
+                  "(last: {last}, max: {max} per action)".format(**self.render_stats))
+            self.after(100, self._term_control)
         else:
             # DEBUGGING
             print(self.__v__)
             self.after(100, self._term_control)
 
-    def _on_lens_switch(self, event=None):
-        """
-        Execute when lens selection is changed
+    def memory_command(self, *args):
         """
-        if event:
-            self.focus()
-        if self.obj_index < 0:
-            self.obj_index = 0
-        if self.obj_index > len(self.models()[0]['obj,data'])-1:
-            self.obj_index = len(self.models()[0]['obj,data'])-1
-        self.load_image()
+        Console memory instrumentation (see memory.py)
 
-    def _on_selection(self, event=None):
+        Args:
+            args <str> - none for the accounting report; 'trace' / 'untrace' to start / stop
+                         tracing allocations; 'top [N]' for the top N allocations; 'status'
+                         to toggle the status bar
+
+        Kwargs/Return:
+            None
         """
-        Execute when selection is changed
+        if not args:
+            print(memory.report(self))
+        elif args[0] == 'trace':
+            memory.start_tracing()
+        elif args[0] == 'untrace':
+            memory.stop_tracing()
+        elif args[0] == 'top':
+            print("\n".join(memory.top_allocations(int(args[1]) if len(args) > 1 else 10)))
+        elif args[0] == 'status':
+            self.status_var.set(not self.status_var.get())
+            self.toggle_status()
+        else:
+            print("Usage: mem [trace | untrace | top N | status]")
+
+    def toggle_status(self, event=None):
         """
-        self._on_subselection(event=event)
-        self.load_image()
+        Show or hide the memory summary in the status bar
+
+        Args/Kwargs/Return:
+            None
+        """
+        if self.status_var.get():
+            self._update_status()
+        else:
+            self.show_status()
+
+    def show_status(self):
+        """
+        Show the background exports and (if switched on) the memory summary in the status bar
+
+        Args/Kwargs/Return:
+            None
+        """
+        status = [self.export_status()]
+        if self.loader is not None:
+            status.append("loading {} states".format(len(self.loader)))
+        if self.status_var.get():
+            status.append(memory.status(self))
+        self.labels['status'].configure(text=" | ".join([s for s in status if s]))
+
+    def _update_status(self):
+        if not self.status_var.get():
+            return
+        self.show_status()
+        self.after(2000, self._update_status)
+
+    def _on_lens_switch(self, event=None):
+        """
+        Execute when lens selection is changed
+        """
+        if event:
+            self.focus()
+        if self.obj_index < 0:
+            self.obj_index = 0
+        if self.obj_index > len(self.models()[0]['obj,data'])-1:
+            self.obj_index = len(self.models()[0]['obj,data'])-1
+        self.request_render()
+
+    def _on_selection(self, event=None):
+        """
+        Execute when selection is changed
+        """
+        self._on_subselection(event=event)
+        self.request_render()
 
     def _on_subselection(self, event=None):
         """
@@ -919,7 +1694,7 @@ class Zapp(tk.Frame, object):
         self.labels['H0_filter'].configure(
             text='H0 filter (km/s/Mpc):\n[{}]'.format(len(filtered)))
         self.selection.configure(values=filtered)
-        while self.model_index not in filtered:
+        if self.model_index not in filtered:
             self.next()
 
     def _on_resize(self, event=None):
@@ -932,12 +1707,19 @@ class Zapp(tk.Frame, object):
         Kwargs/Return:
             None
         """
-        self.load_image()
+        self.request_render()
 
     def _on_close(self, event=None):
         """
         Execute when window is closed
         """
+        self.teardown()
+        if self.exports:
+            print("Waiting for {} background exports...".format(
+                len(self.exports) + len(self._queued_exports)))
+            while self.exports:
+                self.exports.pop(0)['process'].join()
+                self._start_queued_exports()
         self.master.quit()
         sys.exit(1)
 
@@ -1023,10 +1805,11 @@ class Zapp(tk.Frame, object):
         Args/Kwargs/Return:
             None
         """
+        kept = self.teardown()
         self.grid_forget()
         self.clear_buffer(all_=True)
         self.clear_selection(all_=True)
-        self.__init__(self.master)
+        self.__init__(self.master, services=kept)
 
     def model_function(self, g, model_property):
         """
@@ -1043,37 +1826,169 @@ class Zapp(tk.Frame, object):
             model_func <func> - the function selected by the current Zapp state
                                 (model_index, model_selection, obj_index, etc.)
         """
-        if len(self.model_selection) > 0:
-            models = [g.models[i] for i in self.model_selection]
+        # lazy: only the ensemble mappings fetch (and decompress) the selected models
+        selection = self.view_selection()
+        models = store.ModelView(g.models, selection)
+        if g is not self.gls[self.g_index]:
+            return mapping_function(g, model_property, models)
+        return mapping_function(g, model_property, models, index=self.model_index,
+                                selection=selection, caches=self,
+                                name='tagged' if self.model_selection else 'range')
+
+    def profile_sketch(self, key):
+        """
+        The quantile sketch of a profile of the current state and lens (see sketch.py;
+        computed in the background on first use)
+
+        Args:
+            key <str> - data key of the profile, e.g. 'kappa(R)'
+
+        Kwargs:
+            None
+
+        Return:
+            sketch <sketch.ProfileSketch object> - the sketch; None while it is computed
+                                                   or if the models lack kappa maps
+        """
+        task = self.background(('sketch', self.g_index, self.obj_index, key), ProfileSketch,
+                               args=(self.gls[self.g_index],),
+                               kwargs={'key': key, 'obj_index': self.obj_index},
+                               message="Sketching {} profiles...".format(key))
+        if not task.ready() or task.error is not None:
+            return None
+        return task.get()
+
+    def sketch_pending(self):
+        """
+        Test whether the current view waits for its profile sketch; such views are not
+        rendered in the app before the sketch is ready (see mapping_function)
+
+        Args/Kwargs:
+            None
+
+        Return:
+            pending <bool> - True if the sketch of the current profile mapping is computed
+        """
+        if self.model_property not in MODEL_MAPPINGS[2:4] or self.image_ready():
+            return False
+        self.profile_sketch(self.model_property)
+        return self.computing(('sketch', self.g_index, self.obj_index, self.model_property))
+
+    def background(self, key, func, args=(), kwargs=None, then=None, message=None):
+        """
+        Run a computation once in a background thread (see BackgroundTask); when it is
+        finished, its callbacks are run and the view is re-rendered on the Tk thread
+
+        Args:
+            key <tuple> - key of the computation in the task cache
+            func <func> - the computation
+
+        Kwargs:
+            args <tuple> - its arguments
+            kwargs <dict> - its keywords
+            then <func> - callback (without arguments) once it is finished successfully
+            message <str> - printed when the computation is started
+
+        Return:
+            task <BackgroundTask object> - the running or finished computation
+        """
+        if key not in self.tasks:
+            if message:
+                print(message)
+            self.tasks[key] = BackgroundTask(func, *args, **(kwargs or {}))
+            self._waiting[key] = []
+            if not self._tasks_polling:
+                self._tasks_polling = True
+                self.after(100, self._poll_tasks)
+        if then is not None and key in self._waiting:
+            self._waiting[key].append(then)
+        return self.tasks[key]
+
+    def computing(self, key):
+        """
+        Test whether a background computation is running (see background)
+        """
+        return key in self.tasks and not self.tasks[key].ready()
+
+    def _poll_tasks(self):
+        """
+        Hand the finished background computations over to the Tk thread
+        """
+        done = [key for key in self._waiting if self.tasks[key].ready()]
+        for key in done:
+            callbacks = self._waiting.pop(key)
+            error = self.tasks[key].error
+            if error is not None:
+                print("Computing {} failed: {}".format(key[0], error))
+                continue
+            for then in callbacks:
+                then()
+        if done:
+            self.request_render(force=True)
+        if self._waiting:
+            self.after(100, self._poll_tasks)
         else:
-            models = [g.models[i] for i in range(self.model_min, self.model_max)]
-        map_properties = {
-            '': (g.arrival_wsrc, {'only_contours': True,
-                                  'clevels': 75,
-                                  'colors': ['#603dd0']}),
-            self.model_mappings[0]: (g.arrival_wsrc, {'only_contours': True,
-                                                      'clevels': 75,
-                                                      'colors': ['#603dd0']}),
-            self.model_mappings[1]: (g.mass_plot, {'with_colorbar': True,
-                                                   'vmin': 0, 'vmax': 5}),
-            self.model_mappings[2]: (g.profile_plot, {'ptype': model_property,
-                                                      'xkeys': ['R', 'arcsec'],
-                                                      'models': models,
-                                                      'yscale': 'linear'}),
-            self.model_mappings[3]: (g.profile_plot, {'ptype': model_property,
-                                                      'xkeys': ['R', 'arcsec'],
-                                                      'models': models}),
-            self.model_mappings[4]: (g.Hubble_plot, {'ptype': 'H0inv',
-                                                     'models': models}),
-            self.model_mappings[5]: (g.Hubble_plot, {'ptype': 'H0',
-                                                     'models': models}),
-            self.model_mappings[6]: (g.td_plot, {'models': models}),
-            self.model_mappings[7]: (g.gamma_plot, {'ptype': 'shear',
-                                                    'models': models}),
-            self.model_mappings[8]: (g.gamma_plot, {'ptype': 'shear2d',
-                                                    'models': models})
-        }
-        return map_properties[model_property]
+            self._tasks_polling = False
+
+    def grid_cube(self):
+        """
+        The kappa grid cube of the current state and lens (see ensemble.GridCube)
+
+        Args/Kwargs:
+            None
+
+        Return:
+            cube <ensemble.GridCube object> - the cube; None if the basis has no plain
+                                              pixel-to-grid mapping
+        """
+        key = (self.g_index, self.obj_index)
+        if key not in self.grid_cubes:
+            try:
+                self.grid_cubes[key] = GridCube(self.gls[self.g_index], obj_index=self.obj_index)
+            except (KeyError, TypeError, ValueError):
+                self.grid_cubes[key] = None
+        return self.grid_cubes[key]
+
+    def close_grid_cubes(self):
+        """
+        Release the kappa grid cubes (and remove their temporary files)
+
+        Args/Kwargs/Return:
+            None
+        """
+        for cube in self.grid_cubes.values():
+            if cube is not None:
+                cube.close()
+        self.grid_cubes.clear()
+
+    def contour_cache(self):
+        """
+        The arrival-time contour cache of the current state and lens
+
+        Args/Kwargs:
+            None
+
+        Return:
+            contours <contours.ContourCache object> - the cached contour segments
+        """
+        key = (self.g_index, self.obj_index)
+        if key not in self.contours:
+            self.contours[key] = ContourCache(self.gls[self.g_index], obj_index=self.obj_index)
+        return self.contours[key]
+
+    def view_selection(self):
+        """
+        The model indices shown in the ensemble mappings (profiles, histograms, etc.)
+
+        Args/Kwargs:
+            None
+
+        Return:
+            selection <list(int)> - the model selection if any, otherwise the subset selection
+        """
+        if len(self.model_selection) > 0:
+            return sorted(self.model_selection)
+        return list(range(self.model_min, self.model_max))
 
     def model_image(self, image=None):
         """
@@ -1085,174 +2000,1095 @@ class Zapp(tk.Frame, object):
             img = Image.new('RGB', (650, 500))
         elif (self.model_index, self.obj_index, self.model_property) in self._img_copy:
             img = self._img_copy[(self.model_index, self.obj_index, self.model_property)]
+        elif self.render_pool is not None and self.render_pool.get(self.view_key) is not None:
+            img = self.render_pool.get(self.view_key)
         else:
             g = self.gls[self.g_index]
             model = self.models()[self.model_index]
             func, kwargs = self.model_function(g, self.model_property)
             func(model, obj_index=self.obj_index, **kwargs)
             plt.tight_layout(h_pad=1)
-            canvas = plt.get_current_fig_manager().canvas
-            canvas.draw()
-            img = Image.frombytes('RGB', canvas.get_width_height(),
-                                  canvas.tostring_rgb())
-            plt.clf()
+            img = figure_image()
         return img
 
-    def add_image(self, image, verbose=False):
+    @property
+    def view_key(self):
+        """
+        Key of the current view in the image caches
+
+        Args/Kwargs:
+            None
+
+        Return:
+            key <tuple> - (model_index, obj_index, model_property)
         """
-        Insert image at specified index in buffer and project onto canvas
+        return (self.model_index, self.obj_index, self.model_property)
+
+    def start_render_pool(self, processes=None, prefetch=4):
+        """
+        Render models in background worker processes which share the model arrays
+        of the current state through memory-mapped files (see render.py)
 
         Args:
-            image <PIL.Image object> - image to be added to buffer
-            index <int> - index of the image in the buffer
+            None
 
         Kwargs:
-            verbose <bool> - verbose mode; print command line statements
+            processes <int> - number of worker processes; default number of CPUs
+            prefetch <int> - number of models rendered ahead of the current one
 
         Return:
             None
-
-        Note:
-            - self._img_copy <dict(PIL.Image object)>
-            - self._img_buffer <dict(PIL.ImageTk.PhotoImage object)>
         """
-        # copy original
-        self._img_copy[(self.model_index, self.obj_index, self.model_property)] = image
-        # move image to buffer and show on canvas
-        if image is not None:
-            pos = (0, 0)
-            image = image.resize((self.canvas.winfo_width(), self.canvas.winfo_height()))
-            self.img_buffer = ImageTk.PhotoImage(master=self.canvas, image=image)
-            self.canvas.create_image(*pos, image=self.img_buffer, anchor=tk.NW)
-        # add tag indication
-        if self.model_index in self.model_selection:
-            OKAY = u'\u2713'
-            self.canvas.create_text(50, 50, text=OKAY, fill='SpringGreen4',
-                                    font=("Arial", 32), width=10)
+        self.stop_render_pool()
+        if self.gls:
+            g = self.gls[self.g_index]
+            self.render_pool = RenderPool(g, processes=processes,
+                                          shared=self.shared_ensemble(g))
+            self.prefetch = prefetch
 
-    def load_image(self, image=None):
+    def shared_ensemble(self, env):
         """
-        Create the image and add it to the canvas
-        """
-        img = self.model_image(image=image)
-        self.add_image(img)
+        The model arrays of a state shared with the render workers (see ensemble.SharedEnsemble);
+        written once and reused by restarted render pools, as long as the state is loaded
 
+        Args:
+            env <glass.Environment object> - the glass state
 
-@command
-def arrival_wsrc(env, model, **kwargs):
-    """
-    Wrapper for 'glass.plots.img_plot' and 'glass.plots.arrival_plot'
-    """
-    img_kwargs = {}
-    img_kwargs['obj_index'] = kwargs.get('obj_index', 0)
-    img_kwargs['src_index'] = kwargs.get('src_index', None)
-    img_kwargs['tight'] = kwargs.pop('tight', False)
-    img_kwargs['with_guide'] = kwargs.pop('with_guide', False)
-    img_kwargs['color'] = kwargs.pop('color', '#fe4365')
-    img_kwargs['with_maximum'] = kwargs.pop('with_maximum', True)
+        Kwargs:
+            None
 
-    env.img_plot(**img_kwargs)
-    env.arrival_plot(model, **kwargs)
+        Return:
+            shared <ensemble.SharedEnsemble object> - the shared arrays
+        """
+        for g, shared in self.shared_ensembles:
+            if g is env:
+                return shared
+        shared = SharedEnsemble.create(env)
+        self.shared_ensembles.append((env, shared))
+        return shared
 
+    def close_shared_ensembles(self):
+        """
+        Release the shared model arrays (and remove their files)
 
-@command
-def mass_plot(env, model, **kwargs):
-    """
-    Wrapper for 'glass.plots.kappa_plot'
-    """
-    obj_index = kwargs.pop('obj_index', 0)
-    obj, data = model['obj,data'][obj_index]
-    if not data:
-        return
+        Args/Kwargs/Return:
+            None
+        """
+        for _, shared in self.shared_ensembles:
+            shared.close()
+        self.shared_ensembles = []
 
-    # get keywords
-    subtract = kwargs.pop('subtract', 0)
-    xlabel = kwargs.pop('xlabel', '$\mathrm{arcsec}$')
-    ylabel = kwargs.pop('ylabel', '$\mathrm{arcsec}$')
-    with_colorbar = kwargs.pop('with_colorbar', False)
-    with_contours = kwargs.pop('with_contours', False)
+    def stop_render_pool(self):
+        """
+        Terminate the render workers and release the shared arrays
 
-    # data
-    grid = obj.basis._to_grid(data['kappa'] - subtract, 1)
-    R = obj.basis.mapextent
+        Args/Kwargs/Return:
+            None
+        """
+        if self.render_pool is not None:
+            self.render_pool.close()
+        self.render_pool = None
 
-    # keyword defaults
-    kwargs.setdefault('cmap', 'gnuplot2')
-    kwargs.setdefault('interpolation', 'nearest')
-    kwargs.setdefault('extent', [-R, R, -R, R])
-    kwargs.setdefault('aspect', 'equal')
-    kwargs.setdefault('origin', 'upper')
-    vmin = kwargs.get('vmin', None)
-    vmax = kwargs.get('vmax', None)
-    if vmin is None:
-        w = data['kappa'] != 0
-        if not np.any(w):
-            vmin = -15
-            grid += 10**vmin
-        else:
-            vmin = np.log10(np.amin(data['kappa'][w]))
-            kwargs.setdefault('vmin', vmin)
-    if vmax is not None:
-        kwargs.setdefault('vmax', vmax)
-    lvls = [0.25*k for k in range(-1, 5)]  # levels of log(kappa)
+    def prefetch_images(self):
+        """
+        Submit the neighbouring models of the current view to the render workers
 
-    # resample the grid
-    # grid_data = np.log10(grid)
-    grid_data = grid
+        Args/Kwargs/Return:
+            None
+        """
+        if self.render_pool is None or self.model_index is None:
+            return
+        selection = self.view_selection()
+        for step in range(1, self.prefetch+1):
+            for index in (self.model_index+step, self.model_index-step):
+                if self.model_min <= index < self.model_max:
+                    key = (index, self.obj_index, self.model_property)
+                    if key not in self._img_copy:
+                        self.render_pool.submit(key, selection=selection)
 
-    # actual plotting
-    plt.imshow(grid_data, **kwargs)
-    if with_contours:
-        plt.contour(grid_data, levels=lvls, color='black', **kwargs)
-    if with_colorbar:
-        plt.colorbar()
-    # labels
-    plt.xlabel(xlabel)
-    plt.ylabel(ylabel)
+    def toggle_play(self, event=None):
+        """
+        Start or pause the playback
 
+        Args/Kwargs/Return:
+            None
+        """
+        if self.playing:
+            self.pause()
+        else:
+            self.play()
 
-@command
-def profile_plot(env, model, **kwargs):
-    """
-    Wrapper for 'glass.plots.glerrorplot'
-    """
-    kwargs.pop('obj_index', 0)
-    ptype = kwargs.pop('ptype', 'kappa(R)')
-    xkeys = kwargs.pop('xkeys', ['R', 'arcsec'])
-    env.glerrorplot(ptype, xkeys, **kwargs)
+    def play(self, fps=None):
+        """
+        Advance through the navigation sequence at a target frame rate; frames which are not
+        rendered (by the render workers) in time are dropped instead of stalling the playback
 
+        Args:
+            None
 
-@command
-def Hubble_plot(env, model, **kwargs):
-    """
-    Wrapper for 'glass.plots.H0inv_plot' and 'glass.plots.H0_plots'
-    """
-    func = {'H0inv': env.H0inv_plot,
-            'H0': env.H0_plot}[kwargs.pop('ptype', 'H0inv')]
-    func(**kwargs)
+        Kwargs:
+            fps <float> - target frame rate; default self.fps
 
+        Return:
+            None
+        """
+        if not self.gls or self.playing:
+            return
+        if fps:
+            self.fps = fps
+        if self.render_pool is None:
+            self.start_render_pool()
+        sequence = self.navigation()
+        pos = np.flatnonzero(sequence == self.model_index)
+        self._play_pos = pos[0] if len(pos) else -1
+        self._play_times = collections.deque(maxlen=max(int(2*self.fps), 2))
+        self._play_stats = {'shown': 0, 'dropped': 0}
+        self._play_due = time.time()
+        self.playing = True
+        self._on_play()
+
+    def pause(self):
+        """
+        Pause the playback and report the achieved frame rate
 
-@command
-def td_plot(env, model, **kwargs):
-    """
-    Wrapper for 'glass.plots.time_delays_plot
-    """
-    env.time_delays_plot(**kwargs)
+        Args/Kwargs/Return:
+            None
+        """
+        if not self.playing:
+            return
+        self.playing = False
+        self.master.title('Zapp')
+        print("Playback: {:.1f} fps achieved ({} shown, {} dropped) at {} fps target".format(
+            self.achieved_fps, self._play_stats['shown'], self._play_stats['dropped'], self.fps))
 
+    @property
+    def achieved_fps(self):
+        """
+        The frame rate achieved during the last two (target) seconds of playback
 
-@command
-def gamma_plot(env, model, **kwargs):
-    """
-    Wrapper for 'glass.plots.shear_plot' and 'glass.plots.shear2d_plot'
-    """
-    func = {'shear': env.shear_plot,
-            'shear2d': env.shear_plot2d}[kwargs.pop('ptype', 'shear2d')]
-    func(**kwargs)
+        Args/Kwargs:
+            None
 
+        Return:
+            fps <float> - shown frames per second
+        """
+        times = getattr(self, '_play_times', [])
+        if len(times) < 2 or times[-1] == times[0]:
+            return 0.
+        return (len(times) - 1) / (times[-1] - times[0])
 
-def filter_env(env, selection):
-    """
-    Filter a GLASS environment according to a selection
+    def _on_play(self):
+        """
+        Show the next frame of the playback if it is ready, otherwise drop it
+
+        Args/Kwargs/Return:
+            None
+        """
+        if not self.playing:
+            return
+        sequence = self.navigation()
+        if len(sequence) == 0:
+            self.pause()
+            return
+        self._play_pos = (self._play_pos + 1) % len(sequence)
+        index = sequence[self._play_pos]
+        key = (index, self.obj_index, self.model_property)
+        # render ahead
+        selection = self.view_selection()
+        ahead = np.arange(1, int(2*self.fps)+1)
+        for i in sequence[(self._play_pos + ahead) % len(sequence)]:
+            k = (i, self.obj_index, self.model_property)
+            if k not in self._img_copy:
+                self.render_pool.submit(k, selection=selection)
+        if key in self._img_copy or self.render_pool.ready(key):
+            self.model_index = index
+            self._play_times.append(time.time())
+            self._play_stats['shown'] += 1
+        else:
+            self.render_pool.submit(key, selection=selection)
+            self._play_stats['dropped'] += 1
+        self.master.title('Zapp - {:.1f}/{} fps ({} dropped)'.format(
+            self.achieved_fps, self.fps, self._play_stats['dropped']))
+        # schedule the next frame on the target timeline
+        self._play_due += 1. / self.fps
+        now = time.time()
+        if self._play_due < now:
+            self._play_due = now
+        self.after(max(int(1000*(self._play_due - now)), 1), self._on_play)
+
+    def compare(self):
+        """
+        Open a window comparing the current view across all loaded states; the panels are
+        rendered concurrently by the render workers, which share all compared states
+
+        Args/Kwargs/Return:
+            None
+        """
+        if not self.gls:
+            return
+        if self.comparison is not None:  # reopened; the workers keep the shared states
+            self.comparison.on_close = None
+            self.comparison.close()
+        if self.render_pool is None:
+            self.start_render_pool()
+        titles = [os.path.basename(f) if f else 'state {}'.format(g)
+                  for g, f in enumerate(self.state_files)]
+        self.comparison = PanelGrid(self.master, titles, title='Zapp - comparison',
+                                    on_close=self._on_comparison_close)
+        self.update_comparison()
+
+    def close_comparison(self):
+        """
+        Close the comparison window and release the compared states of the render workers
+
+        Args/Kwargs/Return:
+            None
+        """
+        if self.comparison is not None:
+            self.comparison.close()
+
+    def _on_comparison_close(self):
+        if self.render_pool is not None:
+            for name in list(self.render_pool.states.keys()):
+                self.render_pool.remove_state(name)
+        self.comparison = None
+
+    def update_comparison(self):
+        """
+        Request the current view from all states in the comparison window
+
+        Args/Kwargs/Return:
+            None
+        """
+        if self.comparison is None or self.render_pool is None:
+            return
+        self._compare_keys = []
+        for g, state in enumerate(self.gls[:len(self.comparison)]):
+            name = None if g == self.g_index else g  # the zapped state is the pool's own
+            if name is not None:
+                self.render_pool.add_state(name, state, shared=self.shared_ensemble(state))
+            N = len(state.models)
+            key = (min(self.model_index, N-1), self.obj_index, self.model_property)
+            selection = [i for i in self.view_selection() if i < N] or list(range(N))
+            self.render_pool.submit(key, selection=selection, state=name)
+            self._compare_keys.append((name, key))
+        if not self._compare_polling:
+            self._poll_comparison()
+
+    def _poll_comparison(self):
+        self._compare_polling = False
+        if self.comparison is None or self.render_pool is None:
+            return
+        missing = False
+        for g, (name, key) in enumerate(self._compare_keys):
+            img = self.render_pool.get(key, state=name)
+            if img is None:
+                pending = self.render_pool.cache_key(key, name) in self.render_pool.pending
+                missing = missing or pending  # else failed
+            elif self.comparison._img_copy.get(g, (None,))[0] is not img:
+                self.comparison.set_image(g, img, text="model {}".format(key[0]))
+        if missing:
+            self._compare_polling = True
+            self.after(100, self._poll_comparison)
+
+    def tile_lenses(self, event=None):
+        """
+        Open a window showing all lens objects of the current model side by side; the
+        panels are rendered concurrently by the render workers and cached individually
+
+        Args/Kwargs/Return:
+            None
+        """
+        if not self.gls:
+            return
+        self.close_lens_tiles()
+        if self.render_pool is None:
+            self.start_render_pool()
+        N_obj = len(self.models()[0]['obj,data'])
+        self.lens_tiles = PanelGrid(self.master, ['lens {}'.format(k) for k in range(N_obj)],
+                                    title='Zapp - lenses', on_close=self._on_lens_tiles_close)
+        for k, canvas in enumerate(self.lens_tiles.canvases):
+            canvas.bind("<Button-1>", lambda event, k=k: self._on_tile_click(k))
+        self.update_lens_tiles()
+
+    def close_lens_tiles(self):
+        """
+        Close the lens tiles window
+
+        Args/Kwargs/Return:
+            None
+        """
+        if self.lens_tiles is not None:
+            self.lens_tiles.close()
+
+    def _on_lens_tiles_close(self):
+        self.lens_tiles = None
+
+    def _on_tile_click(self, k):
+        """
+        Switch the main view to the clicked lens
+        """
+        self.obj_index = k
+        self._on_lens_switch()
+
+    def update_lens_tiles(self):
+        """
+        Request all lenses of the current model for the lens tiles window
+
+        Args/Kwargs/Return:
+            None
+        """
+        if self.lens_tiles is None or self.render_pool is None:
+            return
+        selection = self.view_selection()
+        self._tile_keys = [(self.model_index, k, self.model_property)
+                           for k in range(len(self.lens_tiles))]
+        for k, key in enumerate(self._tile_keys):
+            if key not in self._img_copy:
+                self.render_pool.submit(key, selection=selection)
+            self.lens_tiles.set_title(k, 'lens {}{}'.format(
+                k, ' (current)' if k == self.obj_index else ''))
+        if not self._tiles_polling:
+            self._poll_lens_tiles()
+
+    def _poll_lens_tiles(self):
+        self._tiles_polling = False
+        if self.lens_tiles is None or self.render_pool is None:
+            return
+        missing = False
+        for k, key in enumerate(self._tile_keys):
+            img = self._img_copy.get(key)
+            if img is None:
+                img = self.render_pool.get(key)
+            if img is None:
+                missing = missing or key in self.render_pool.pending  # else failed
+            elif self.lens_tiles._img_copy.get(k, (None,))[0] is not img:
+                self.lens_tiles.set_image(k, img, text="model {}".format(key[0]))
+        if missing:
+            self._tiles_polling = True
+            self.after(100, self._poll_lens_tiles)
+
+    def feature_names(self):
+        """
+        Names of the per-model features of the current lens (multi-valued columns, e.g. the
+        time delays, are split into '<name>[<j>]')
+
+        Args/Kwargs:
+            None
+
+        Return:
+            names <list(str)> - the feature names
+        """
+        names = []
+        # identifiers and flags are no features
+        columns = [c for c in self.index.names(self.obj_index)
+                   if c not in ('fingerprint', 'accepted')]
+        if 'kappa_slope' not in columns:
+            columns.append('kappa_slope')  # fitted on first use
+        for name in columns:
+            column = self.index.columns.get('{}:{}'.format(name, self.obj_index),
+                                            self.index.columns.get(name))
+            if column is not None and column.ndim == 2:
+                names += ['{}[{}]'.format(name, j) for j in range(column.shape[1])]
+            else:
+                names.append(name)
+        return names
+
+    def feature(self, name):
+        """
+        Values of a per-model feature of the current lens (the kappa slopes are computed in
+        the background and added to the sidecar index if missing)
+
+        Args:
+            name <str> - feature name (see feature_names)
+
+        Kwargs:
+            None
+
+        Return:
+            values <np.ndarray> - the values of all models of shape (N_models,); NaNs while
+                                  the kappa slopes are fitted
+        """
+        k = self.obj_index
+        j = None
+        if name.endswith(']'):
+            name, j = name[:-1].split('[')
+            j = int(j)
+        if name == 'kappa_slope' and 'kappa_slope:{}'.format(k) not in self.index.columns:
+            task = self.background(('kappa_slope', self.g_index, k), sidecar.kappa_slope,
+                                   args=(self.gls[self.g_index], k), then=self.refresh_features,
+                                   message="Fitting kappa slopes...")
+            if not task.ready() or task.error is not None:
+                return np.full(len(self.models()), np.nan)
+            self.index.update(**{'kappa_slope:{}'.format(k): task.get()})
+        values = self.index.column(name, k)
+        if j is not None:
+            values = values[:, j]
+        return np.asarray(values, dtype=np.float64)
+
+    def show_features(self, event=None):
+        """
+        Open a panel plotting two per-model features of all models of the current lens, in
+        which models are tagged by rectangle or lasso selection
+
+        Args/Kwargs/Return:
+            None
+        """
+        if not self.gls:
+            return
+        self.close_feature_panel()
+        self.feature_panel = FeaturePanel(
+            self.master, self.feature_names(), self.feature, x='H0', y='einstein_radius',
+            on_select=self._on_feature_select, on_close=self._on_feature_panel_close)
+        self._feature_view = (self.g_index, self.obj_index, frozenset(self.model_selection))
+        self.feature_panel.set_selection(self.model_selection)
+        self.feature_panel.set_current(self.model_index)
+
+    def close_feature_panel(self):
+        """
+        Close the feature panel
+
+        Args/Kwargs/Return:
+            None
+        """
+        if self.feature_panel is not None:
+            self.feature_panel.close()
+
+    def _on_feature_panel_close(self):
+        self.feature_panel = None
+
+    def _on_feature_select(self, indices, mode='add'):
+        """
+        Tag (or untag) the models selected in the feature panel
+
+        Args:
+            indices <np.ndarray> - model indices
+            mode <str> - 'add', 'remove', or 'replace' the tag selection
+
+        Kwargs/Return:
+            None
+        """
+        indices = indices.tolist()
+        if mode == 'replace':
+            self.model_selection = set(indices)
+        elif mode == 'remove':
+            self.model_selection.difference_update(indices)
+        else:
+            self.model_selection.update(indices)
+        print("{} {} models ({} tagged)".format(
+            'Untagged' if mode == 'remove' else 'Tagged', len(indices),
+            len(self.model_selection)))
+        self.request_render(force=True)
+
+    def update_feature_panel(self):
+        """
+        Follow the current model, the tag selection, and the current lens in the feature panel
+
+        Args/Kwargs/Return:
+            None
+        """
+        if self.feature_panel is None:
+            return
+        view = (self.g_index, self.obj_index, frozenset(self.model_selection))
+        if view[:2] != self._feature_view[:2]:
+            self.feature_panel.selection = np.asarray(sorted(self.model_selection), dtype=int)
+            self.feature_panel.plot()
+        elif view[2] != self._feature_view[2]:
+            self.feature_panel.set_selection(self.model_selection)
+        self._feature_view = view
+        self.feature_panel.set_current(self.model_index)
+
+    def refresh_features(self):
+        """
+        Redraw the feature panel and the model table with newly computed features
+
+        Args/Kwargs/Return:
+            None
+        """
+        if self.feature_panel is not None:
+            self.feature_panel.plot()
+        if self.model_table is not None:
+            self.model_table.refresh(['kappa_slope'])
+
+    def table_column(self, name):
+        """
+        Values of a model table column of the current lens
+
+        Args:
+            name <str> - 'model', 'tagged', 'accepted', or a feature name (see feature_names)
+
+        Kwargs:
+            None
+
+        Return:
+            values <np.ndarray> - the values of all models of shape (N_models,)
+        """
+        N = len(self.models())
+        if name == 'model':
+            return np.arange(N)
+        if name == 'tagged':
+            tagged = np.zeros(N, dtype=bool)
+            selection = np.asarray(list(self.model_selection), dtype=int)
+            tagged[selection[(selection >= 0) & (selection < N)]] = True
+            return tagged
+        if name == 'accepted':  # flag (0 rejected, 1 accepted, 2 unknown)
+            return self.index.column(name) == 1
+        return self.feature(name)
+
+    def show_table(self, event=None):
+        """
+        Open a sortable table of the models of the current lens and their summary columns;
+        clicking a row shows the model
+
+        Args/Kwargs/Return:
+            None
+        """
+        if not self.gls:
+            return
+        self.close_model_table()
+        names = ['model', 'tagged', 'accepted', 'H0', 'einstein_radius', 'kappa_slope',
+                 'kappa_mean', 'kappa_max']
+        if 'score:{}'.format(self.obj_index) in self.index.columns:
+            names.append('score')
+        self.model_table = ModelTable(
+            self.master, names, self.table_column, len(self.models()),
+            on_click=self._on_table_click, on_close=self._on_model_table_close)
+        self._table_view = (self.g_index, self.obj_index, frozenset(self.model_selection))
+        self.model_table.set_current(self.model_index)
+
+    def close_model_table(self):
+        """
+        Close the model table
+
+        Args/Kwargs/Return:
+            None
+        """
+        if self.model_table is not None:
+            self.model_table.close()
+
+    def _on_model_table_close(self):
+        self.model_table = None
+
+    def _on_table_click(self, index):
+        """
+        Show the clicked model
+        """
+        self.model_index = index
+
+    def update_model_table(self):
+        """
+        Follow the current model, the tag selection, and the current lens in the model table
+
+        Args/Kwargs/Return:
+            None
+        """
+        if self.model_table is None:
+            return
+        view = (self.g_index, self.obj_index, frozenset(self.model_selection))
+        if view[0] != self._table_view[0]:  # another ensemble size
+            self.show_table()
+            return
+        elif view[1] != self._table_view[1]:
+            self.model_table.refresh()
+        elif view[2] != self._table_view[2]:
+            self.model_table.refresh(['tagged'])
+        self._table_view = view
+        self.model_table.set_current(self.model_index)
+
+    def image_ready(self, key=None):
+        """
+        Test whether the image of a view is available without rendering
+
+        Args:
+            None
+
+        Kwargs:
+            key <tuple> - (model_index, obj_index, model_property); default the current view
+
+        Return:
+            ready <bool> - the image is cached or finished by the render workers
+        """
+        key = self.view_key if key is None else key
+        return key in self._img_copy or (self.render_pool is not None
+                                         and self.render_pool.ready(key))
+
+    def _refine(self, key):
+        """
+        Schedule the full-quality render of a view which is currently shown as preview
+
+        Args:
+            key <tuple> - (model_index, obj_index, model_property)
+
+        Kwargs/Return:
+            None
+        """
+        self._refine_key = key
+        if self.render_pool is not None:
+            self.render_pool.submit(key, selection=self.view_selection())
+            if not self._refine_polling:
+                self._refine_polling = True
+                self.after(20, self._poll_refine)
+        else:
+            # idle callbacks only run once all pending (key) events are processed
+            self.after_idle(self._on_refine, key)
+
+    def _poll_refine(self):
+        """
+        Wait for the render workers to finish the pending refine
+        """
+        key = self._refine_key
+        if key is None:
+            self._refine_polling = False
+        elif self.render_pool is None or self.render_pool.ready(key):
+            self._refine_polling = False
+            self._on_refine(key)
+        else:
+            self.after(20, self._poll_refine)
+
+    def _on_refine(self, key):
+        """
+        Swap the full-quality image in, unless the user moved on to another view
+        """
+        if key != self._refine_key or key != self.view_key:
+            return
+        if self.sketch_pending():  # refined once the sketch is ready (see background)
+            return
+        self._refine_key = None
+        self.canvas.delete('preview')
+        self.add_image(self.model_image())
+
+    def add_image(self, image, cache=True, verbose=False):
+        """
+        Insert image at specified index in buffer and project onto canvas
+
+        Args:
+            image <PIL.Image object> - image to be added to buffer
+            index <int> - index of the image in the buffer
+
+        Kwargs:
+            cache <bool> - keep a copy of the image (previews are not kept)
+            verbose <bool> - verbose mode; print command line statements
+
+        Return:
+            None
+
+        Note:
+            - self._img_copy <dict(PIL.Image object)>
+            - self._img_buffer <dict(PIL.ImageTk.PhotoImage object)>
+        """
+        # copy original
+        if cache:
+            self._img_copy[(self.model_index, self.obj_index, self.model_property)] = image
+        # move image to buffer and show on canvas
+        if image is not None:
+            pos = (0, 0)
+            image = image.resize((self.canvas.winfo_width(), self.canvas.winfo_height()))
+            self.img_buffer = ImageTk.PhotoImage(master=self.canvas, image=image)
+            self.canvas.create_image(*pos, image=self.img_buffer, anchor=tk.NW)
+        # add cluster indication
+        if self.cluster_mode:
+            clusters = self.clusters()
+            c = clusters.cluster(self.model_index)
+            self.canvas.create_text(self.canvas.winfo_width()-20, 20, anchor=tk.NE,
+                                    text="cluster {}: {} models".format(
+                                        c, clusters.sizes()[c]),
+                                    fill='SlateBlue4', font=("Arial", 14))
+        # add tag indication
+        if self.model_index in self.model_selection:
+            OKAY = u'\u2713'
+            self.canvas.create_text(50, 50, text=OKAY, fill='SpringGreen4',
+                                    font=("Arial", 32), width=10)
+
+    @property
+    def view_state(self):
+        """
+        The view state which determines the rendered image: state, model, lens, property,
+        limits and filter entries, tag and cluster state, and canvas size
+
+        Args/Kwargs:
+            None
+
+        Return:
+            state <tuple> - the view state
+        """
+        return (self.g_index, self.model_index, self.obj_index, self.model_property,
+                tuple(self.limits[l].get() for l in sorted(self.limits)),
+                frozenset(self.model_selection),
+                self.cluster_var.get(), self.canvas.winfo_width(), self.canvas.winfo_height())
+
+    def request_render(self, event=None, force=False):
+        """
+        Mark the view dirty; it is rendered once, after all pending events of the current
+        event-loop turn are processed, and only if the view state changed
+
+        Args:
+            None
+
+        Kwargs:
+            event <Tk event> - bound event (ignored)
+            force <bool> - render even if the view state is unchanged (e.g. after tagging)
+
+        Return:
+            None
+        """
+        self.render_stats['requests'] += 1
+        self._render_forced = self._render_forced or force
+        if not self._dirty:
+            self._dirty = True
+            self.after_idle(self._on_render)
+
+    def _on_render(self):
+        """
+        Render the dirty view and close the render count of the user action
+        """
+        if not self._dirty:
+            return
+        self._dirty = False
+        forced, self._render_forced = self._render_forced, False
+        if forced or self.view_state != self._rendered_state:
+            self.load_image()
+        stats = self.render_stats
+        stats['actions'] += 1
+        stats['last'] = self._action_renders
+        stats['max'] = max(stats['max'], self._action_renders)
+        self._action_renders = 0
+
+    def load_image(self, image=None):
+        """
+        Create the image and add it to the canvas (use request_render to coalesce renders)
+        """
+        self.render_stats['renders'] += 1
+        self._action_renders += 1
+        self._rendered_state = self.view_state
+        if image is None and self.gls and not self.image_ready() \
+           and (self.progressive or self.sketch_pending()):
+            # instant preview, refined when the full render is ready
+            # (only for mappings with a cheap version of the same quantity)
+            preview = None
+            if self.model_property in ('', MODEL_MAPPINGS[0]):
+                contours = self.contour_cache()
+                if self.model_index in contours:
+                    obj, _ = self.models()[self.model_index]['obj,data'][self.obj_index]
+                    preview = contour_preview(contours.segments(self.model_index),
+                                              obj.basis.mapextent)
+            elif self.model_property == MODEL_MAPPINGS[1]:
+                cube = self.grid_cube()
+                preview = preview_image(self.models()[self.model_index], self.obj_index,
+                                        grid=None if cube is None else cube[self.model_index])
+            self.canvas.delete('preview')
+            self.add_image(preview, cache=False)
+            self.canvas.create_text(self.canvas.winfo_width()-20,
+                                    self.canvas.winfo_height()-20, anchor=tk.SE,
+                                    text="rendering...", fill='SlateBlue4',
+                                    font=("Arial", 14), tags='preview')
+            self._refine(self.view_key)
+        else:
+            self._refine_key = None
+            self.canvas.delete('preview')
+            img = self.model_image(image=image)
+            self.add_image(img)
+        self.prefetch_images()
+        self.update_comparison()
+        self.update_lens_tiles()
+        self.update_feature_panel()
+        self.update_model_table()
+
+
+def mapping_function(g, model_property, models, index=None, selection=None, caches=None,
+                     name='selection'):
+    """
+    The plotting function of a model mapping
+
+    Args:
+        g <glass.Environment object> - the glass environment
+        model_property <str> - the desired mapping/transformation of the model (MODEL_MAPPINGS)
+        models <list(dict)> - the models used for ensemble mappings (profiles, histograms, etc.);
+                              a lazy sequence (see store.ModelView) is only iterated by those
+
+    Kwargs:
+        index <int> - index of the rendered model (to look up cached render data)
+        selection <list(int)> - model indices of the ensemble mappings
+        caches <object> - render caches of the lens providing contour_cache(), grid_cube(),
+                          and profile_sketch(key) (see Zapp or render.RenderCaches);
+                          the app and the render workers thus draw identical images
+        name <str> - name of the tracked selection of the profile sketches
+
+    Return:
+        func <func> - the plotting command
+        kwargs <dict> - the keywords of the plotting command
+    """
+    map_properties = {
+        '': (g.arrival_wsrc, {'only_contours': True,
+                              'clevels': 75,
+                              'colors': ['#603dd0']}),
+        MODEL_MAPPINGS[0]: (g.arrival_wsrc, {'only_contours': True,
+                                             'clevels': 75,
+                                             'colors': ['#603dd0']}),
+        MODEL_MAPPINGS[1]: (g.mass_plot, {'with_colorbar': True,
+                                          'vmin': 0, 'vmax': 5}),
+        MODEL_MAPPINGS[2]: (g.profile_plot, {'ptype': model_property,
+                                             'xkeys': ['R', 'arcsec'],
+                                             'models': models,
+                                             'yscale': 'linear'}),
+        MODEL_MAPPINGS[3]: (g.profile_plot, {'ptype': model_property,
+                                             'xkeys': ['R', 'arcsec'],
+                                             'models': models}),
+        MODEL_MAPPINGS[4]: (g.Hubble_plot, {'ptype': 'H0inv',
+                                            'models': models}),
+        MODEL_MAPPINGS[5]: (g.Hubble_plot, {'ptype': 'H0',
+                                            'models': models}),
+        MODEL_MAPPINGS[6]: (g.td_plot, {'models': models}),
+        MODEL_MAPPINGS[7]: (g.gamma_plot, {'ptype': 'shear',
+                                           'models': models}),
+        MODEL_MAPPINGS[8]: (g.gamma_plot, {'ptype': 'shear2d',
+                                           'models': models})
+    }
+    func, kwargs = map_properties[model_property]
+    if caches is None or index is None:
+        return func, kwargs
+    if model_property in ('', MODEL_MAPPINGS[0]):
+        kwargs = dict(kwargs, segments=caches.contour_cache().segments(index))
+    elif model_property == MODEL_MAPPINGS[1]:
+        cube = caches.grid_cube()
+        if cube is not None:
+            kwargs = dict(kwargs, grid=cube[index])
+    elif model_property in MODEL_MAPPINGS[2:4]:
+        sketch = caches.profile_sketch(model_property)
+        if sketch is not None:
+            func = g.band_plot
+            kwargs = {'ptype': model_property, 'R': sketch.R,
+                      'bands': sketch.bands(selection, name=name),
+                      'profile': sketch.profiles.stack(model_property, [index])[0]}
+    return func, kwargs
+
+
+def figure_image(dpi=None):
+    """
+    Draw the current pyplot figure into an image and clear it
+
+    Args:
+        None
+
+    Kwargs:
+        dpi <float> - resolution of the image; default the figure's dpi
+
+    Return:
+        img <PIL.Image object> - the rendered figure
+    """
+    fig = plt.gcf()
+    if dpi is not None:
+        fig.set_dpi(dpi)
+    canvas = fig.canvas
+    canvas.draw()
+    img = Image.frombytes('RGB', canvas.get_width_height(),
+                          canvas.tostring_rgb())
+    plt.clf()
+    return img
+
+
+def preview_image(model, obj_index=0, cmap='gnuplot2', vmin=0, vmax=5, grid=None):
+    """
+    Direct raster of a model's kappa map (without matplotlib layout), used as instant
+    preview while the full mapping is rendered
+
+    Args:
+        model <dict> - the glass model
+
+    Kwargs:
+        obj_index <int> - index of the lens object
+        cmap <str> - name of the colormap
+        vmin <float> - kappa value of the lower colormap end
+        vmax <float> - kappa value of the upper colormap end
+        grid <np.ndarray> - the precomputed kappa grid (see ensemble.GridCube)
+
+    Return:
+        img <PIL.Image object> - the raster image; None if the lens has no data
+    """
+    obj, data = model['obj,data'][obj_index]
+    if not data:
+        return None
+    if grid is None:
+        grid = obj.basis._to_grid(data['kappa'], 1)
+    rgba = plt.get_cmap(cmap)(np.clip((grid - vmin) / float(vmax - vmin), 0, 1), bytes=True)
+    return Image.fromarray(np.ascontiguousarray(rgba[..., :3]))
+
+
+def contour_preview(segments, R, size=500, color='#603dd0'):
+    """
+    Direct line drawing of cached arrival-time contours (without matplotlib layout), used
+    as instant preview while the full mapping is rendered
+
+    Args:
+        segments <np.ndarray> - segment end points (x, y) of shape (N_segments, 2, 2)
+                                (see contours.ContourCache)
+        R <float> - map extent of the lens
+
+    Kwargs:
+        size <int> - width and height of the image
+        color <str> - color of the contour lines
+
+    Return:
+        img <PIL.Image object> - the line image
+    """
+    img = Image.new('RGB', (size, size), 'white')
+    draw = ImageDraw.Draw(img)
+    px = (np.asarray(segments, dtype=np.float64) * [1, -1] + R) * (size-1) / (2.*R)
+    for (x0, y0), (x1, y1) in px:
+        draw.line([(x0, y0), (x1, y1)], fill=color)
+    return img
+
+
+@command
+def arrival_wsrc(env, model, **kwargs):
+    """
+    Wrapper for 'glass.plots.img_plot' and 'glass.plots.arrival_plot'
+    """
+    img_kwargs = {}
+    img_kwargs['obj_index'] = kwargs.get('obj_index', 0)
+    img_kwargs['src_index'] = kwargs.get('src_index', None)
+    img_kwargs['tight'] = kwargs.pop('tight', False)
+    img_kwargs['with_guide'] = kwargs.pop('with_guide', False)
+    img_kwargs['color'] = kwargs.pop('color', '#fe4365')
+    img_kwargs['with_maximum'] = kwargs.pop('with_maximum', True)
+    segments = kwargs.pop('segments', None)
+
+    env.img_plot(**img_kwargs)
+    if segments is None:
+        env.arrival_plot(model, **kwargs)
+    else:  # precomputed contours (see contours.ContourCache)
+        obj, data = model['obj,data'][img_kwargs['obj_index']]
+        R = obj.basis.mapextent
+        ax = plt.gca()
+        ax.add_collection(LineCollection(segments, colors=kwargs.get('colors', 'k'),
+                                         linewidths=kwargs.get('linewidths', 1)))
+        ax.set_xlim(-R, R)
+        ax.set_ylim(-R, R)
+        ax.set_aspect('equal')
+
+
+@command
+def mass_plot(env, model, **kwargs):
+    """
+    Wrapper for 'glass.plots.kappa_plot'
+    """
+    obj_index = kwargs.pop('obj_index', 0)
+    obj, data = model['obj,data'][obj_index]
+    if not data:
+        return
+
+    # get keywords
+    subtract = kwargs.pop('subtract', 0)
+    xlabel = kwargs.pop('xlabel', '$\mathrm{arcsec}$')
+    ylabel = kwargs.pop('ylabel', '$\mathrm{arcsec}$')
+    with_colorbar = kwargs.pop('with_colorbar', False)
+    with_contours = kwargs.pop('with_contours', False)
+    grid = kwargs.pop('grid', None)  # precomputed kappa grid (see ensemble.GridCube)
+
+    # data
+    if grid is None or np.any(subtract):
+        grid = obj.basis._to_grid(data['kappa'] - subtract, 1)
+    else:
+        grid = np.array(grid, dtype=np.float64)
+    R = obj.basis.mapextent
+
+    # keyword defaults
+    kwargs.setdefault('cmap', 'gnuplot2')
+    kwargs.setdefault('interpolation', 'nearest')
+    kwargs.setdefault('extent', [-R, R, -R, R])
+    kwargs.setdefault('aspect', 'equal')
+    kwargs.setdefault('origin', 'upper')
+    vmin = kwargs.get('vmin', None)
+    vmax = kwargs.get('vmax', None)
+    if vmin is None:
+        w = data['kappa'] != 0
+        if not np.any(w):
+            vmin = -15
+            grid += 10**vmin
+        else:
+            vmin = np.log10(np.amin(data['kappa'][w]))
+            kwargs.setdefault('vmin', vmin)
+    if vmax is not None:
+        kwargs.setdefault('vmax', vmax)
+    lvls = [0.25*k for k in range(-1, 5)]  # levels of log(kappa)
+
+    # resample the grid
+    # grid_data = np.log10(grid)
+    grid_data = grid
+
+    # actual plotting
+    plt.imshow(grid_data, **kwargs)
+    if with_contours:
+        plt.contour(grid_data, levels=lvls, color='black', **kwargs)
+    if with_colorbar:
+        plt.colorbar()
+    # labels
+    plt.xlabel(xlabel)
+    plt.ylabel(ylabel)
+
+
+@command
+def profile_plot(env, model, **kwargs):
+    """
+    Wrapper for 'glass.plots.glerrorplot'
+    """
+    kwargs.pop('obj_index', 0)
+    ptype = kwargs.pop('ptype', 'kappa(R)')
+    xkeys = kwargs.pop('xkeys', ['R', 'arcsec'])
+    env.glerrorplot(ptype, xkeys, **kwargs)
+
+
+@command
+def band_plot(env, model, **kwargs):
+    """
+    Error bands of a profile from precomputed quantiles (see sketch.ProfileSketch),
+    with the profile of the current model
+    """
+    kwargs.pop('obj_index', 0)
+    ptype = kwargs.pop('ptype', 'kappa(R)')
+    R = kwargs.pop('R')
+    bands = kwargs.pop('bands')
+    profile = kwargs.pop('profile', None)
+    color = kwargs.pop('color', '#603dd0')
+    plt.fill_between(R, bands[0], bands[4], color=color, alpha=0.2, lw=0)
+    plt.fill_between(R, bands[1], bands[3], color=color, alpha=0.4, lw=0)
+    plt.plot(R, bands[2], color=color, lw=1.5)
+    if profile is not None:
+        plt.plot(R, profile, color='#fe4365', lw=1)
+    plt.xlabel('$\mathrm{R}$ [$\mathrm{arcsec}$]')
+    plt.ylabel('$\kappa$' + ptype[len('kappa'):])
+
+
+@command
+def Hubble_plot(env, model, **kwargs):
+    """
+    Wrapper for 'glass.plots.H0inv_plot' and 'glass.plots.H0_plots'
+    """
+    func = {'H0inv': env.H0inv_plot,
+            'H0': env.H0_plot}[kwargs.pop('ptype', 'H0inv')]
+    func(**kwargs)
+
+
+@command
+def td_plot(env, model, **kwargs):
+    """
+    Wrapper for 'glass.plots.time_delays_plot
+    """
+    env.time_delays_plot(**kwargs)
+
+
+@command
+def gamma_plot(env, model, **kwargs):
+    """
+    Wrapper for 'glass.plots.shear_plot' and 'glass.plots.shear2d_plot'
+    """
+    func = {'shear': env.shear_plot,
+            'shear2d': env.shear_plot2d}[kwargs.pop('ptype', 'shear2d')]
+    func(**kwargs)
+
+
+def filter_env(env, selection):
+    """
+    Filter a GLASS environment according to a selection
 
     Args:
         env <glass.environment object> - the glass state to be filtered
@@ -1262,22 +3098,273 @@ def filter_env(env, selection):
         None
 
     Return:
-        envcpy <glass.environment object> - the filtered glass state
+        envcpy <glass.environment object> - the filtered glass state (sharing the models)
     """
-    import copy
-    envcpy = copy.deepcopy(env)
-    for i in range(len(envcpy.models)-1, -1, -1):
-        if i in selection:
-            continue
-        del envcpy.models[i]
-        del envcpy.accepted_models[i]
-        del envcpy.solutions[i]
+    zs = store.get_store(env)
+    if zs is not None:
+        envcpy = zs.to_env(selection=selection)
+    else:
+        envcpy = view_env(env, selection)
     envcpy.meta_info['filtered'] = (os.path.basename(env.global_opts['argv'][-1]),
                                     len(env.models), len(envcpy.models))
     return envcpy
 
 
-def export_state(env, selection=None, name="filtered.state"):
+def view_env(env, selection):
+    """
+    Shallow view of a GLASS environment including only selected models; the models and all
+    other (unmodified) structure are shared with the original, only the lists are new
+
+    Args:
+        env <glass.environment object> - the glass state to be filtered
+        selection <list(int)> - list of model indices
+
+    Kwargs:
+        None
+
+    Return:
+        view <glass.environment object> - the filtered glass state
+    """
+    selection = sorted(selection)
+    view = copy.copy(env)
+    view.models = [env.models[i] for i in selection]
+    view.accepted_models = [env.accepted_models[i] for i in selection]
+    view.solutions = [env.solutions[i] for i in selection] if len(env.solutions) else []
+    view.meta_info = dict(env.meta_info)
+    return view
+
+
+def read_selection(name, fingerprints=None):
+    """
+    Read a model selection file; selections saved with fingerprints are mapped onto the models
+    with the same fingerprints if their indices do not match (e.g. in another state)
+
+    Args:
+        name <str> - path to the selection file (one model index, optionally followed by its
+                     hex fingerprint, per line)
+
+    Kwargs:
+        fingerprints <np.ndarray> - fingerprints of the models of the target state
+                                    (see sidecar.fingerprints)
+
+    Return:
+        selection <list(int)> - the model indices
+    """
+    with open(name, "r") as f:
+        entries = [s.split() for s in f.readlines() if s.strip() and not s.startswith('#')]
+    selection = [int(e[0]) for e in entries]
+    if fingerprints is None or not entries or any([len(e) < 2 for e in entries]):
+        return selection
+    stored = np.array([int(e[1], 16) for e in entries], dtype=np.uint64)
+    fingerprints = np.asarray(fingerprints)
+    indices = np.asarray(selection, dtype=int)
+    if np.all(indices < len(fingerprints)) and np.all(fingerprints[indices] == stored):
+        return selection
+    found = np.in1d(stored, fingerprints)
+    if not np.all(found):
+        warnings.warn("{} of {} selected models not found in the state".format(
+            np.sum(~found), len(stored)))
+    print("Mapped the selection of {} by fingerprint".format(name))
+    return np.flatnonzero(np.in1d(fingerprints, stored)).tolist()
+
+
+def write_selection(name, selection, fingerprints=None, header=None):
+    """
+    Write a model selection file
+
+    Args:
+        name <str> - path to the selection file
+        selection <list(int)> - the model indices
+
+    Kwargs:
+        fingerprints <np.ndarray> - fingerprints of all models, written next to the indices
+        header <str> - comment line, e.g. the state file name
+
+    Return:
+        None
+    """
+    selection = sorted(selection)
+    with open(name, "w") as f:
+        if header is not None:
+            f.write("".join(["# ", header, "\n"]))
+        if fingerprints is None:
+            f.write("\n".join([str(i) for i in selection]))
+        else:
+            f.write("\n".join(["{}\t{:016x}".format(i, fingerprints[i]) for i in selection]))
+
+
+def resolve_selection(env, spec, index=None, obj_index=0):
+    """
+    Model selection from a selection file or a filter expression (see sidecar.ZIndex.select)
+
+    Args:
+        env <glass.environment object> - the glass state
+        spec <str> - path to a selection file or a filter expression, e.g. '(H0 > 60) & accepted'
+
+    Kwargs:
+        index <sidecar.ZIndex object> - the index of the state; default built from env
+        obj_index <int> - lens object index for per-lens columns
+
+    Return:
+        selection <list(int)> - the model indices
+    """
+    if index is None:
+        index = sidecar.index(env)
+    if os.path.isfile(spec):
+        try:
+            fingerprints = index.fingerprints(env)
+        except (KeyError, TypeError, ValueError):
+            fingerprints = None
+        return read_selection(spec, fingerprints=fingerprints)
+    return [int(i) for i in index.select(spec, obj_index=obj_index)]
+
+
+def export_states(env, selections, names, processes=None, verbose=False):
+    """
+    Write several filtered states of a single loaded state, each in its own (forked) process
+
+    Args:
+        env <glass.environment object> - state to be exported
+        selections <list(list(int))> - model selections of the filtered states
+        names <list(str)> - file names of the filtered states
+
+    Kwargs:
+        processes <int> - maximal number of concurrent writers; default number of CPUs
+        verbose <bool> - verbose mode; print command line statements
+
+    Return:
+        written <list(str)> - file names of the successfully written states
+    """
+    processes = processes or multiprocessing.cpu_count()
+    writers = []
+    for selection, name in zip(selections, names):
+        if not len(selection):
+            warnings.warn("Empty selection for {}; skipped".format(name))
+            continue
+        for p, _ in writers[:len(writers)-processes+1]:
+            p.join()
+        p = multiprocessing.Process(target=export_state, args=(env, selection, name))
+        p.start()
+        writers.append((p, name))
+        if verbose:
+            print("Writing {} models to {}".format(len(selection), name))
+    written = []
+    for p, name in writers:
+        p.join()
+        if p.exitcode == 0:
+            written.append(name)
+        else:
+            warnings.warn("Writing {} failed".format(name))
+    return written
+
+
+def check_compatible(env, other):
+    """
+    Validate that two GLASS states were modelled with identical lens and basis setups
+
+    Args:
+        env <glass.environment object> - the reference state
+        other <glass.environment object> - the state to be compared
+
+    Kwargs:
+        None
+
+    Return:
+        None
+
+    Raises:
+        ValueError - if the setups differ
+    """
+    if len(env.objects) != len(other.objects):
+        raise ValueError("Different number of lens objects: {} != {}".format(
+            len(env.objects), len(other.objects)))
+    for k, (obj, obj2) in enumerate(zip(env.objects, other.objects)):
+        for attr in ['pixrad', 'maprad', 'mapextent', 'top_level_cell_size']:
+            a, b = getattr(obj.basis, attr, None), getattr(obj2.basis, attr, None)
+            if a is None and b is None:
+                continue
+            if a is None or b is None or not np.allclose(a, b):
+                raise ValueError("Lens {}: different basis {} ({} != {})".format(
+                    k, attr, a, b))
+        if len(getattr(obj, 'sources', [])) != len(getattr(obj2, 'sources', [])):
+            raise ValueError("Lens {}: different number of sources".format(k))
+        ploc, ploc2 = getattr(obj.basis, 'ploc', None), getattr(obj2.basis, 'ploc', None)
+        if ploc is not None and ploc2 is not None and \
+           (len(ploc) != len(ploc2) or not np.allclose(ploc, ploc2)):
+            raise ValueError("Lens {}: different pixel positions".format(k))
+
+
+def _relink(model, objects):
+    """
+    Shallow copy of a model whose data is linked to other lens objects
+    """
+    if model is None:
+        return None
+    model = dict(model)
+    model['obj,data'] = [(objects[k], data) for k, (obj, data) in enumerate(model['obj,data'])]
+    return model
+
+
+def merge_states(states, name=None, verbose=False):
+    """
+    Concatenate the models, accepted models, and solutions of compatible GLASS states and
+    recompute the ensemble average of the merged models; states given as file names are
+    loaded one at a time and released after appending
+
+    Args:
+        states <list(str | glass.environment object)> - state files, stores, or loaded states
+
+    Kwargs:
+        name <str> - file name of the merged state; default not saved
+        verbose <bool> - verbose mode; print command line statements
+
+    Return:
+        merged <glass.environment object> - the merged glass state
+
+    Raises:
+        ValueError - if the setups differ, or only some of the states have solutions
+    """
+    merged = None
+    provenance = []
+    for state in states:
+        label = os.path.basename(state) if isinstance(state, string_types) else \
+            os.path.basename(state.global_opts['argv'][-1])
+        env = import_state(state) if isinstance(state, string_types) else state
+        if store.get_store(env) is not None:
+            env = store.get_store(env).to_env()
+        has_solutions = len(env.solutions) == len(env.models)
+        if merged is None:
+            merged = view_env(env, range(len(env.models)))
+            with_solutions = has_solutions
+            if not has_solutions:
+                merged.solutions = []
+        else:
+            check_compatible(merged, env)
+            if has_solutions != with_solutions:
+                raise ValueError("{} {} solutions, unlike the previous states".format(
+                    label, 'has' if has_solutions else 'lacks'))
+            for m, a in zip(env.models, env.accepted_models):
+                # shallow copies linked to the lens objects of the merged state
+                relinked = _relink(m, merged.objects)
+                merged.models.append(relinked)
+                merged.accepted_models.append(relinked if a is m else _relink(a, merged.objects))
+            if has_solutions:
+                merged.solutions.extend(list(env.solutions))
+        provenance.append((label, len(env.models)))
+        if verbose:
+            print("Merged {} models from {} ({} total)".format(
+                len(env.models), label, len(merged.models)))
+        del env
+    merged.meta_info['merged'] = provenance
+    # the average copied along with the first state only covers its models
+    merged.ensemble_average = None
+    ensemble_average(merged)
+    if name is not None:
+        merged.savestate(name)
+    return merged
+
+
+def export_state(env, selection=None, name="filtered.state", progress=None):
     """
     Save a filtered state in a new state file
 
@@ -1286,17 +3373,273 @@ def export_state(env, selection=None, name="filtered.state"):
 
     Kwargs:
         selection <list(int)> - list of indices used to filter out models
+        progress <func> - called with the stage ('filtering', 'writing')
 
     Return:
         None
     """
+    if progress is not None:
+        progress('filtering')
     if selection:
         state = filter_env(env, selection)
+    elif store.get_store(env) is not None:
+        state = store.get_store(env).to_env()
     else:
         state = env
+    if progress is not None:
+        progress('writing')
     state.savestate(name)
 
 
+def _export_worker(env, selection, name, messages):
+    """
+    Background export (see Zapp.start_export); reports ('<stage>', info) tuples to a queue
+    """
+    try:
+        export_state(env, selection=selection, name=name,
+                     progress=lambda stage: messages.put((stage, None)))
+        messages.put(('done', name))
+    except Exception as e:
+        messages.put(('error', "{}: {}".format(e.__class__.__name__, e)))
+
+
+def _animation_worker(env, keys, name, selection, dpi, duration, shared, verbose, messages):
+    """
+    Background animation export (see Zapp.export_animation); reports ('<stage>', info) tuples
+    to a queue
+    """
+    try:
+        N = len(keys)
+        render.export_frames(env, keys, name, selection=selection, dpi=dpi, duration=duration,
+                             shared=shared, verbose=verbose,
+                             progress=lambda n: messages.put(('frame {}/{}'.format(n, N), None)))
+        messages.put(('done', name))
+    except Exception as e:
+        messages.put(('error', "{}: {}".format(e.__class__.__name__, e)))
+
+
+# states whose ensemble average is computed
+_averaged = weakref.WeakSet()
+
+
+def ensemble_average(env):
+    """
+    Compute the ensemble average of a state, unless it was computed already; columnar stores
+    carry the average in their skeleton (it is computed once and persisted for older stores)
+
+    Args:
+        env <glass.environment object> - the glass state
+
+    Kwargs:
+        None
+
+    Return:
+        None
+    """
+    try:
+        if env in _averaged:
+            return
+    except TypeError:  # not weakly referenceable
+        env.make_ensemble_average()
+        return
+    zs = store.get_store(env)
+    if zs is None:
+        env.make_ensemble_average()
+    elif not zs.has_average:
+        env.make_ensemble_average()
+        try:
+            store.save_skeleton(env, zs.name)
+        except (IOError, OSError) as e:
+            warnings.warn("Could not persist the ensemble average in {}: {}".format(zs.name, e))
+    _averaged.add(env)
+
+
+def load_state(name):
+    """
+    Load and average a state and read (or build and write) its sidecar index (in a loader
+    process or thread, see StateLoader)
+
+    Args:
+        name <str> - path to the .state file or .zstore directory
+
+    Kwargs:
+        None
+
+    Return:
+        env <glass.environment object> - the averaged glass state
+        zidx <sidecar.ZIndex object> - its sidecar index
+    """
+    env = import_state(name)
+    ensemble_average(env)
+    return env, sidecar.index(env, name)
+
+
+class BackgroundTask(object):
+    """
+    A function call in a daemon thread, with the ready/get interface of the results of
+    multiprocessing pools (cf. the threads of similarity.SimilarityIndex)
+    """
+    def __init__(self, func, *args, **kwargs):
+        """
+        Start the call
+
+        Args:
+            func <func> - the function
+            *args - its arguments
+
+        Kwargs:
+            **kwargs - its keywords
+
+        Return:
+            <BackgroundTask object> - standard initializer
+        """
+        self.result = None
+        self.error = None
+        self._done = threading.Event()
+        self.thread = threading.Thread(target=self._run, args=(func, args, kwargs))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self, func, args, kwargs):
+        try:
+            self.result = func(*args, **kwargs)
+        except Exception as e:
+            self.error = e
+        finally:
+            self._done.set()
+
+    def ready(self):
+        """
+        Test whether the call has finished
+        """
+        return self._done.is_set()
+
+    def get(self):
+        """
+        The result of the call (waits for it if necessary; re-raises its exception)
+        """
+        self._done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class StateLoader(object):
+    """
+    Loads and ensemble averages several state files concurrently in a (forked) process pool,
+    together with their sidecar indices; the states are handed out (pickled) as they
+    become ready. Columnar stores (and a single state file) are loaded in background threads,
+    so that handing out the states never blocks (the Tk thread)
+    """
+    def __init__(self, names, processes=None):
+        """
+        Start loading the states
+
+        Args:
+            names <list(str)> - state files or columnar stores, in order of priority
+
+        Kwargs:
+            processes <int> - number of loader processes; default number of CPUs
+
+        Return:
+            <StateLoader object> - standard initializer
+        """
+        self.pending = collections.OrderedDict()
+        self.pool = None
+        pooled = [n for n in names if not store.is_store(n)]
+        processes = min(processes or multiprocessing.cpu_count(), len(pooled))
+        if processes > 1:
+            self.pool = multiprocessing.Pool(processes)
+        for name in names:
+            if self.pool is not None and not store.is_store(name):
+                self.pending[name] = self.pool.apply_async(load_state, (name,))
+            else:  # loaded in this process (columnar stores are memory-mapped)
+                self.pending[name] = BackgroundTask(load_state, name)
+
+    def __str__(self):
+        return "{}({} pending)".format(self.__class__.__name__, len(self))
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __len__(self):
+        return len(self.pending)
+
+    def ready(self):
+        """
+        Names of the pending states which are ready to be handed out
+        """
+        return [n for n, r in self.pending.items() if r.ready()]
+
+    def get(self, name=None):
+        """
+        A loaded state (waits for it if necessary)
+
+        Args:
+            None
+
+        Kwargs:
+            name <str> - the state file; default the first ready (or first pending) state
+
+        Return:
+            name <str> - the state file
+            env <glass.environment object> - the averaged glass state
+            zidx <sidecar.ZIndex object> - its sidecar index
+        """
+        if name is None:
+            ready = self.ready()
+            name = ready[0] if ready else next(iter(self.pending))
+        result = self.pending.pop(name)
+        env, zidx = result.get()
+        try:
+            _averaged.add(env)
+        except TypeError:
+            pass
+        return name, env, zidx
+
+    def close(self, terminate=False):
+        """
+        Shut the loader processes down (loader threads are daemons and left to finish)
+
+        Args:
+            None
+
+        Kwargs:
+            terminate <bool> - abort pending loads
+
+        Return:
+            None
+        """
+        if self.pool is None:
+            self.pending.clear()
+            return
+        if terminate:
+            self.pool.terminate()
+        else:
+            self.pool.close()
+        self.pool.join()
+        self.pool = None
+        self.pending.clear()
+
+
+def import_state(name):
+    """
+    Load a state file or a columnar store (see store.py)
+
+    Args:
+        name <str> - path to the .state file or .zstore directory
+
+    Kwargs:
+        None
+
+    Return:
+        env <glass.environment object> - the loaded glass state
+    """
+    if store.is_store(name):
+        return store.load(name)
+    return loadstate(name)
+
+
 if __name__ == "__main__":
     root, zapper = Zapp.init(gls_states=[], verbose=1)
     zapper.display()
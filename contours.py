@@ -0,0 +1,227 @@
+"""
+@author: phdenzel
+
+Precomputed contour geometry of the arrival-time surfaces of a GLASS ensemble
+
+The arrival surfaces of a chunk of models are stacked into an (N x H x W) array and contoured
+at all levels with a vectorized marching-squares pass. The contour segments of each
+(model, source) are cached as compact float32 vertex arrays, which are drawn as a single
+LineCollection instead of recomputing the contours for every render.
+"""
+import collections
+import numpy as np
+
+
+# corner offsets (row, col) of the cell edges: top, right, bottom, left
+EDGES = np.array([[[0, 0], [0, 1]],
+                  [[0, 1], [1, 1]],
+                  [[1, 0], [1, 1]],
+                  [[0, 0], [1, 0]]])
+
+# edge pairs of the (up to two) segments for each marching-squares case
+# case bits: 1 top-left, 2 top-right, 4 bottom-right, 8 bottom-left corner above the level
+SEGMENTS = np.array([[[-1, -1], [-1, -1]],
+                     [[3, 0], [-1, -1]],
+                     [[0, 1], [-1, -1]],
+                     [[3, 1], [-1, -1]],
+                     [[1, 2], [-1, -1]],
+                     [[3, 0], [1, 2]],
+                     [[0, 2], [-1, -1]],
+                     [[3, 2], [-1, -1]],
+                     [[2, 3], [-1, -1]],
+                     [[0, 2], [-1, -1]],
+                     [[0, 1], [2, 3]],
+                     [[1, 2], [-1, -1]],
+                     [[3, 1], [-1, -1]],
+                     [[0, 1], [-1, -1]],
+                     [[3, 0], [-1, -1]],
+                     [[-1, -1], [-1, -1]]])
+
+
+def _edge_points(G, m, r, c, edges, levels):
+    """
+    Linearly interpolated level crossings on cell edges
+
+    Args:
+        G <np.ndarray> - stacked surfaces of shape (N, H, W)
+        m, r, c <np.ndarray> - surface, row, and column indices of the cells
+        edges <np.ndarray> - edge index of each cell
+        levels <np.ndarray> - level of each cell
+
+    Kwargs:
+        None
+
+    Return:
+        rows, cols <np.ndarray> - fractional grid coordinates of the crossings
+    """
+    r0, c0 = r + EDGES[edges, 0, 0], c + EDGES[edges, 0, 1]
+    r1, c1 = r + EDGES[edges, 1, 0], c + EDGES[edges, 1, 1]
+    a, b = G[m, r0, c0], G[m, r1, c1]
+    t = (levels - a) / (b - a)
+    return r0 + t*(r1 - r0), c0 + t*(c1 - c0)
+
+
+def marching_squares(G, levels):
+    """
+    Contour segments of stacked surfaces at several levels in one vectorized pass per level
+
+    Args:
+        G <np.ndarray> - stacked surfaces of shape (N, H, W)
+        levels <np.ndarray> - contour levels of each surface of shape (N, N_levels)
+
+    Kwargs:
+        None
+
+    Return:
+        segments <np.ndarray> - segment end points (row, col) of shape (N_segments, 2, 2)
+        owner <np.ndarray> - surface index of each segment of shape (N_segments,)
+    """
+    G = np.asarray(G, dtype=np.float64)
+    levels = np.atleast_2d(levels)
+    segments, owner = [], []
+    for j in range(levels.shape[1]):
+        lev = levels[:, j, None, None]
+        above = (G > lev).astype(np.int8)
+        case = above[:, :-1, :-1] + 2*above[:, :-1, 1:] \
+            + 4*above[:, 1:, 1:] + 8*above[:, 1:, :-1]
+        for s in range(2):
+            ea = SEGMENTS[case, s, 0]
+            m, r, c = np.nonzero(ea >= 0)
+            if len(m) == 0:
+                continue
+            ea, eb = ea[m, r, c], SEGMENTS[case[m, r, c], s, 1]
+            ra, ca = _edge_points(G, m, r, c, ea, levels[m, j])
+            rb, cb = _edge_points(G, m, r, c, eb, levels[m, j])
+            segments.append(np.stack([np.stack([ra, ca], axis=-1),
+                                      np.stack([rb, cb], axis=-1)], axis=1))
+            owner.append(m)
+    if not segments:
+        return np.empty((0, 2, 2)), np.empty(0, dtype=int)
+    return np.concatenate(segments), np.concatenate(owner)
+
+
+def linear_levels(G, clevels=75):
+    """
+    Equidistant levels between the minimum and maximum of each surface
+
+    Args:
+        G <np.ndarray> - stacked surfaces of shape (N, H, W)
+
+    Kwargs:
+        clevels <int> - number of levels
+
+    Return:
+        levels <np.ndarray> - levels of shape (N, clevels)
+    """
+    lo = G.reshape(len(G), -1).min(axis=1)
+    hi = G.reshape(len(G), -1).max(axis=1)
+    return lo[:, None] + (hi - lo)[:, None] * np.linspace(0, 1, clevels)[None, :]
+
+
+class ContourCache(object):
+    """
+    LRU cache of the arrival-time contour segments of the models of a lens; on a miss, the
+    whole chunk of models around the requested one is contoured in a single batch
+    """
+    def __init__(self, env, obj_index=0, clevels=75, chunk_size=64, cache_size=4096):
+        """
+        Initialize the (empty) cache
+
+        Args:
+            env <glass.Environment object> - the glass state
+
+        Kwargs:
+            obj_index <int> - index of the lens object
+            clevels <int> - number of contour levels of each surface
+            chunk_size <int> - number of models contoured at once
+            cache_size <int> - number of models whose segments are kept
+
+        Return:
+            <ContourCache object> - standard initializer
+        """
+        self.env = env
+        self.obj_index = obj_index
+        self.clevels = clevels
+        self.chunk_size = chunk_size
+        self.cache_size = cache_size
+        self.N = len(env.models)
+        self.cache = collections.OrderedDict()
+
+    def __str__(self):
+        return "{}(lens {}, {}/{} models, {:.1f} MB)".format(
+            self.__class__.__name__, self.obj_index, len(self.cache), self.N,
+            self.nbytes/1024.**2)
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __contains__(self, index):
+        return index in self.cache
+
+    @property
+    def nbytes(self):
+        return sum([sum([s.nbytes for s in segs]) for segs in self.cache.values()])
+
+    def contour(self, selection):
+        """
+        Contour the arrival surfaces of a batch of models and cache the segments
+
+        Args:
+            selection <list(int)> - model indices
+
+        Kwargs:
+            None
+
+        Return:
+            None
+        """
+        selection = [i for i in selection if i not in self.cache]
+        if not selection:
+            return
+        obj = None
+        grids = []
+        for i in selection:
+            obj, data = self.env.models[i]['obj,data'][self.obj_index]
+            grids.append(obj.basis.arrival_grid(data))
+        R = obj.basis.mapextent
+        segs = collections.OrderedDict((i, []) for i in selection)
+        for src in range(len(grids[0])):
+            G = np.stack([np.asarray(g[src]) for g in grids])
+            H, W = G.shape[1:]
+            segments, owner = marching_squares(G, linear_levels(G, self.clevels))
+            # grid (row, col) -> (x, y) of the pixel centers (origin upper)
+            xy = np.empty_like(segments, dtype=np.float32)
+            xy[..., 0] = -R + (segments[..., 1] + 0.5) * 2*R/W
+            xy[..., 1] = R - (segments[..., 0] + 0.5) * 2*R/H
+            order = np.argsort(owner, kind='mergesort')
+            bounds = np.searchsorted(owner[order], np.arange(len(selection)+1))
+            for k, i in enumerate(selection):
+                segs[i].append(xy[order[bounds[k]:bounds[k+1]]])
+        self.cache.update(segs)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def segments(self, index, src_index=None):
+        """
+        Contour segments of a model (contouring its chunk on a cache miss)
+
+        Args:
+            index <int> - model index
+
+        Kwargs:
+            src_index <int | list(int)> - source indices; default all sources
+
+        Return:
+            segments <np.ndarray> - segment end points (x, y) of shape (N_segments, 2, 2)
+        """
+        if index not in self.cache:
+            start = (index // self.chunk_size) * self.chunk_size
+            self.contour(range(start, min(start+self.chunk_size, self.N)))
+        segs = self.cache.pop(index)
+        self.cache[index] = segs  # move to end
+        if src_index is not None:
+            src_index = np.atleast_1d(src_index)
+            segs = [s for i, s in enumerate(segs) if i in src_index]
+        if not segs:
+            return np.empty((0, 2, 2), dtype=np.float32)
+        return np.concatenate(segs)
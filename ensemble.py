@@ -0,0 +1,595 @@
+"""
+@author: phdenzel
+
+Batch access to the per-model arrays of a GLASS ensemble
+
+Stacks per-model arrays (kappa, ...) of a lens into (N_models x N_pixels) arrays, chunk by
+chunk, and places them in memory-mapped files which worker processes attach to zero-copy.
+"""
+import sys
+import os
+import shutil
+import weakref
+import tempfile
+import numpy as np
+if sys.version_info.major < 3:
+    import cPickle as pickle
+else:
+    import pickle
+
+import store
+
+
+def iter_stack(env, key='kappa', obj_index=0, chunk_size=1024, selection=None):
+    """
+    Iterate over a per-model quantity of an ensemble in stacked chunks
+
+    Args:
+        env <glass.Environment object> - the glass state
+
+    Kwargs:
+        key <str> - data key of the per-model array
+        obj_index <int> - index of the lens object
+        chunk_size <int> - number of models per chunk
+        selection <list(int)> - model indices; default all
+
+    Return:
+        iterator <(np.ndarray, np.ndarray)> - model indices and stacked (N_chunk x ...) arrays
+    """
+    rows = np.arange(len(env.models)) if selection is None else np.asarray(selection, dtype=int)
+    zs = store.get_store(env)
+    for start in range(0, len(rows), chunk_size):
+        idcs = rows[start:start+chunk_size]
+        if zs is not None and key in zs.keys[obj_index]:
+            yield idcs, zs.stack(key, obj_index, selection=idcs)
+        else:
+            yield idcs, np.stack([np.asarray(env.models[i]['obj,data'][obj_index][1][key])
+                                  for i in idcs])
+
+
+def stack(env, key='kappa', obj_index=0, selection=None):
+    """
+    Stacked (N_models x ...) array of a per-model quantity of an ensemble
+
+    Args:
+        env <glass.Environment object> - the glass state
+
+    Kwargs:
+        key <str> - data key of the per-model array
+        obj_index <int> - index of the lens object
+        selection <list(int)> - model indices; default all
+
+    Return:
+        stack <np.ndarray> - the stacked array
+    """
+    chunks = [c for _, c in iter_stack(env, key, obj_index, selection=selection)]
+    return np.concatenate(chunks) if chunks else np.empty((0,))
+
+
+class SharedEnsemble(object):
+    """
+    Per-lens model arrays of an ensemble in memory-mapped .npy files
+
+    The arrays are written once by the parent process; workers attach to the files
+    (read-only, zero-copy), so N workers share one copy of the ensemble through the page cache.
+    Everything else of a model (scalars, small dicts) is kept in a small pickle.
+    """
+    def __init__(self, path, keys, arrays, rest, objects=None):
+        """
+        Initialize with attached arrays (use create or attach)
+
+        Args:
+            path <str> - directory of the memory-mapped files
+            keys <list(list(str))> - stacked data keys for each lens object
+            arrays <dict(np.memmap)> - the stacked arrays keyed (obj_index, key)
+            rest <list(dict)> - the stripped models (see store._strip)
+
+        Kwargs:
+            objects <list(glass.LensModel objects)> - lens objects to link the models to
+
+        Return:
+            <SharedEnsemble object> - standard initializer
+        """
+        self.path = path
+        self.keys = keys
+        self.arrays = arrays
+        self.rest = rest
+        self.objects = objects if objects is not None else [None]*len(keys)
+
+    def __str__(self):
+        return "{}({}, {} models, {:.1f} MB)".format(
+            self.__class__.__name__, self.path, len(self), self.nbytes/1024.**2)
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __len__(self):
+        return len(self.rest)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.model(j) for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        return self.model(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.model(i)
+
+    @property
+    def nbytes(self):
+        return sum([a.nbytes for a in self.arrays.values()])
+
+    @staticmethod
+    def _filename(path, obj_index, j):
+        return os.path.join(path, '{}.{}.npy'.format(obj_index, j))
+
+    @classmethod
+    def create(cls, env, path=None, chunk_size=1024):
+        """
+        Write the stacked arrays of a state into memory-mapped files
+
+        Args:
+            env <glass.Environment object> - the glass state
+
+        Kwargs:
+            path <str> - directory for the files; default a new temporary directory
+            chunk_size <int> - number of models copied at once
+
+        Return:
+            shared <SharedEnsemble object> - the shared arrays attached in this process
+        """
+        if path is None:
+            path = tempfile.mkdtemp(prefix='zapp-')
+        models = env.models
+        N = len(models)
+        N_obj = len(models[0]['obj,data']) if N else 0
+        zs = store.get_store(env)
+        if zs is not None:
+            keys = zs.keys
+        else:
+            keys = [store.stacked_keys(models, k) for k in range(N_obj)]
+        for k in range(N_obj):
+            for j, key in enumerate(keys[k]):
+                mm = None
+                for idcs, chunk in iter_stack(env, key, k, chunk_size=chunk_size):
+                    if mm is None:
+                        mm = np.lib.format.open_memmap(
+                            cls._filename(path, k, j), mode='w+', dtype=chunk.dtype,
+                            shape=(N,)+chunk.shape[1:])
+                    mm[idcs] = chunk
+                if mm is not None:  # no models, no file (see attach)
+                    mm.flush()
+                    del mm
+        rest = [store._strip(m, keys) for m in models]
+        with open(os.path.join(path, 'rest.pkl'), 'wb') as f:
+            pickle.dump((keys, rest), f, pickle.HIGHEST_PROTOCOL)
+        return cls.attach(path, objects=getattr(env, 'objects', None))
+
+    @classmethod
+    def attach(cls, path, objects=None):
+        """
+        Attach to the memory-mapped files of a shared ensemble (read-only)
+
+        Args:
+            path <str> - directory of the memory-mapped files
+
+        Kwargs:
+            objects <list(glass.LensModel objects)> - lens objects to link the models to
+
+        Return:
+            shared <SharedEnsemble object> - the shared arrays
+        """
+        with open(os.path.join(path, 'rest.pkl'), 'rb') as f:
+            keys, rest = pickle.load(f)
+        arrays = {}
+        for k, obj_keys in enumerate(keys):
+            for j, key in enumerate(obj_keys):
+                if os.path.exists(cls._filename(path, k, j)):
+                    arrays[(k, key)] = np.load(cls._filename(path, k, j), mmap_mode='r')
+        return cls(path, keys, arrays, rest, objects=objects)
+
+    def array(self, key='kappa', obj_index=0):
+        """
+        The shared (N_models x ...) array of a per-model quantity
+        """
+        return self.arrays[(obj_index, key)]
+
+    def model(self, i):
+        """
+        Assemble a glass model whose arrays are views into the shared files
+
+        Args:
+            i <int> - model index
+
+        Kwargs:
+            None
+
+        Return:
+            model <dict> - the glass model dictionary
+        """
+        rest = self.rest[i]
+        model = dict((k, v) for k, v in rest.items() if k != 'obj,data')
+        obj_data = []
+        for k, data in enumerate(rest['obj,data']):
+            if data:
+                data = dict(data)
+                for key in self.keys[k]:
+                    data[key] = self.arrays[(k, key)][i]
+            obj_data.append((self.objects[k], data))
+        model['obj,data'] = obj_data
+        return model
+
+    def models(self, selection):
+        """
+        Assemble a list of glass models (see model)
+        """
+        return [self.model(i) for i in selection]
+
+    def close(self, remove=True):
+        """
+        Detach from the files and optionally remove them
+
+        Args:
+            None
+
+        Kwargs:
+            remove <bool> - delete the memory-mapped files
+
+        Return:
+            None
+        """
+        self.arrays = {}
+        if remove and os.path.exists(self.path):
+            shutil.rmtree(self.path, ignore_errors=True)
+
+
+def lens_object(env, obj_index=0):
+    """
+    The glass lens object of a state
+    """
+    return env.models[0]['obj,data'][obj_index][0]
+
+
+def pixel_positions(obj):
+    """
+    Positions of the basis pixels of a lens object
+
+    Args:
+        obj <glass.LensModel object> - the lens object
+
+    Kwargs:
+        None
+
+    Return:
+        ploc <np.ndarray> - complex pixel positions (arcsec) of shape (N_pixels,)
+    """
+    return np.asarray(obj.basis.ploc)
+
+
+def ring_index(obj):
+    """
+    Ring (radial bin) index of each basis pixel of a lens object
+
+    Args:
+        obj <glass.LensModel object> - the lens object
+
+    Kwargs:
+        None
+
+    Return:
+        rings <np.ndarray> - integer ring indices of shape (N_pixels,)
+    """
+    ploc = pixel_positions(obj)
+    rings = getattr(obj.basis, 'rings', None)
+    if rings is not None:
+        idx = np.zeros(len(ploc), dtype=int)
+        for r, ring in enumerate(rings):
+            idx[np.asarray(ring, dtype=int)] = r
+        return idx
+    R = np.abs(ploc)
+    cell = getattr(obj.basis, 'top_level_cell_size', None) or np.min(R[R > 0])
+    return np.round(R / cell).astype(int)
+
+
+def pixel_areas(obj):
+    """
+    Areas of the basis pixels of a lens object (unit areas if the cell sizes are unknown)
+
+    Args:
+        obj <glass.LensModel object> - the lens object
+
+    Kwargs:
+        None
+
+    Return:
+        areas <np.ndarray> - pixel areas (arcsec^2) of shape (N_pixels,)
+    """
+    cell_size = getattr(obj.basis, 'cell_size', None)
+    if cell_size is None:
+        return np.ones(len(pixel_positions(obj)))
+    return np.asarray(cell_size, dtype=np.float64)**2 * np.ones(len(pixel_positions(obj)))
+
+
+class RadialProfiles(object):
+    """
+    Radial profiles kappa(R) and kappa(<R) of all models of a lens, computed from the stacked
+    (N_models x N_pixels) kappa maps with precomputed pixel-to-ring averaging matrices
+    """
+    KEYS = ['kappa(R)', 'kappa(<R)']
+
+    def __init__(self, env, obj_index=0, chunk_size=1024):
+        """
+        Precompute the averaging matrices of a lens
+
+        Args:
+            env <glass.Environment object> - the glass state
+
+        Kwargs:
+            obj_index <int> - index of the lens object
+            chunk_size <int> - number of models computed at once
+
+        Return:
+            <RadialProfiles object> - standard initializer
+        """
+        self.env = env
+        self.obj_index = obj_index
+        self.chunk_size = chunk_size
+        obj = lens_object(env, obj_index)
+        self.rings = ring_index(obj)
+        self.ploc = pixel_positions(obj)
+        area = pixel_areas(obj)
+        n_rings = self.rings.max() + 1
+        ring_area = np.bincount(self.rings, weights=area, minlength=n_rings)
+        A = np.zeros((len(self.rings), n_rings))
+        A[np.arange(len(self.rings)), self.rings] = area
+        # kappa(R): area-weighted ring means; kappa(<R): enclosed mass over enclosed area
+        self.matrices = {'kappa(R)': A / np.maximum(ring_area, 1e-300),
+                         'kappa(<R)': np.cumsum(A, axis=1) / np.maximum(np.cumsum(ring_area),
+                                                                        1e-300)}
+        counts = np.bincount(self.rings, minlength=n_rings)
+        self.R = np.bincount(self.rings, weights=np.abs(self.ploc),
+                             minlength=n_rings) / np.maximum(counts, 1)
+        data = env.models[0]['obj,data'][obj_index][1] if len(env.models) else None
+        if data and 'R' in data and len(data['R']['arcsec']) == n_rings:
+            self.R = np.asarray(data['R']['arcsec'], dtype=np.float64)
+        self.cache = {}
+
+    def __str__(self):
+        return "{}(lens {}, {} rings, cached {})".format(
+            self.__class__.__name__, self.obj_index, len(self.R), sorted(self.cache))
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __getitem__(self, key):
+        return self.stack(key)
+
+    def profile(self, K, key='kappa(R)'):
+        """
+        Radial profiles of stacked kappa maps
+
+        Args:
+            K <np.ndarray> - kappa maps of shape (N, N_pixels)
+
+        Kwargs:
+            key <str> - 'kappa(R)' or 'kappa(<R)'
+
+        Return:
+            profiles <np.ndarray> - profiles of shape (N, N_rings)
+        """
+        return np.asarray(K, dtype=np.float64).dot(self.matrices[key])
+
+    def stack(self, key='kappa(R)', selection=None):
+        """
+        Radial profiles of all (or selected) models; the profiles of all models are computed
+        in a single pass over the ensemble on first use and cached
+
+        Args:
+            None
+
+        Kwargs:
+            key <str> - 'kappa(R)' or 'kappa(<R)'
+            selection <list(int)> - model indices; default all
+
+        Return:
+            profiles <np.ndarray> - profiles of shape (N_models, N_rings)
+        """
+        if key not in self.cache:  # both keys in the same pass
+            N = len(self.env.models)
+            out = dict((k, np.empty((N, len(self.R)))) for k in self.KEYS)
+            for idcs, K in iter_stack(self.env, 'kappa', self.obj_index,
+                                      chunk_size=self.chunk_size):
+                for k in self.KEYS:
+                    out[k][idcs] = self.profile(K, k)
+            self.cache.update(out)
+        if selection is None:
+            return self.cache[key]
+        return self.cache[key][np.asarray(selection, dtype=int)]
+
+
+_profiles = weakref.WeakKeyDictionary()
+
+
+def radial_profiles(env, obj_index=0):
+    """
+    The (per state cached) radial profile engine of a lens
+
+    Args:
+        env <glass.Environment object> - the glass state
+
+    Kwargs:
+        obj_index <int> - index of the lens object
+
+    Return:
+        profiles <RadialProfiles object> - the profile engine
+    """
+    try:
+        engines = _profiles.setdefault(env, {})
+    except TypeError:  # not weakly referenceable
+        return RadialProfiles(env, obj_index)
+    if obj_index not in engines:
+        engines[obj_index] = RadialProfiles(env, obj_index)
+    return engines[obj_index]
+
+
+class GridIndex(object):
+    """
+    Scatter index of the basis pixels of a lens object onto its regular grid
+    (cf. obj.basis._to_grid with subdivision 1), found once by probing the basis
+    """
+    def __init__(self, obj):
+        """
+        Probe the pixel-to-grid mapping of a lens object
+
+        Args:
+            obj <glass.LensModel object> - the lens object
+
+        Kwargs:
+            None
+
+        Return:
+            <GridIndex object> - standard initializer
+
+        Raises:
+            ValueError - if the basis does not map pixels onto the grid by plain assignment
+        """
+        N = len(pixel_positions(obj))
+        probe = np.asarray(obj.basis._to_grid(np.arange(1, N+1, dtype=np.float64), 1))
+        ids = np.rint(probe).astype(int)
+        if not np.allclose(probe, ids) or ids.min() < 0 or ids.max() > N:
+            raise ValueError("The basis does not scatter pixels onto the grid")
+        self.shape = probe.shape
+        self.N_pixels = N
+        self.take = ids.ravel() - 1
+        self.take[self.take < 0] = N  # empty cells read a padded zero
+        test = np.random.RandomState(0).normal(size=N)
+        if not np.allclose(self.grid(test), obj.basis._to_grid(test, 1)):
+            raise ValueError("The basis does not scatter pixels onto the grid")
+
+    def __str__(self):
+        return "{}({} pixels -> {}x{} grid)".format(
+            self.__class__.__name__, self.N_pixels, *self.shape)
+
+    def __repr__(self):
+        return self.__str__()
+
+    def grid(self, kappa):
+        """
+        Grid of a single pixel vector
+        """
+        return self.cube(np.atleast_2d(kappa))[0]
+
+    def cube(self, K, out=None):
+        """
+        Grids of stacked pixel vectors in one fancy-indexing operation
+
+        Args:
+            K <np.ndarray> - pixel vectors of shape (N, N_pixels)
+
+        Kwargs:
+            out <np.ndarray> - output array of shape (N, H, W)
+
+        Return:
+            cube <np.ndarray> - the grids of shape (N, H, W)
+        """
+        K = np.asarray(K)
+        padded = np.concatenate([K, np.zeros((len(K), 1), dtype=K.dtype)], axis=1)
+        if out is None:
+            return padded[:, self.take].reshape((len(K),)+self.shape)
+        out[...] = padded[:, self.take].reshape((len(K),)+self.shape)
+        return out
+
+
+class GridCube(object):
+    """
+    Contiguous (N_models x H x W) cube of the kappa grids of all models of a lens (optionally
+    memory-mapped), filled chunk by chunk on first access
+    """
+    def __init__(self, env, obj_index=0, path=None, chunk_size=1024, max_memory=2**28):
+        """
+        Allocate the cube
+
+        Args:
+            env <glass.Environment object> - the glass state
+
+        Kwargs:
+            obj_index <int> - index of the lens object
+            path <str> - .npy file of a memory-mapped cube; default in memory, or a temporary
+                         file if the cube exceeds max_memory
+            chunk_size <int> - number of models converted at once
+            max_memory <int> - size in bytes above which the cube is memory-mapped
+
+        Return:
+            <GridCube object> - standard initializer
+        """
+        self.env = env
+        self.obj_index = obj_index
+        self.chunk_size = chunk_size
+        self.index = GridIndex(lens_object(env, obj_index))
+        self.N = len(env.models)
+        shape = (self.N,) + self.index.shape
+        if path is None and 8 * np.prod(shape) > max_memory:
+            fd, path = tempfile.mkstemp(prefix='zapp_grids_', suffix='.npy')
+            os.close(fd)
+        self.path = path
+        if path is None:
+            self.cube = np.empty(shape)
+        else:
+            self.cube = np.lib.format.open_memmap(path, mode='w+', dtype=np.float64, shape=shape)
+        self.filled = np.zeros((self.N + chunk_size - 1) // chunk_size, dtype=bool)
+
+    def __str__(self):
+        return "{}(lens {}, {} grids of {}x{}, {}/{} chunks)".format(
+            self.__class__.__name__, self.obj_index, self.N, self.index.shape[0],
+            self.index.shape[1], np.sum(self.filled), len(self.filled))
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __len__(self):
+        return self.N
+
+    def __getitem__(self, i):
+        """
+        Kappa grid of a model (a read-only view into the cube)
+        """
+        self.fill(i // self.chunk_size)
+        view = self.cube[i]
+        view.flags.writeable = False
+        return view
+
+    def fill(self, c=None):
+        """
+        Convert a chunk (default all chunks) of kappa vectors into the cube
+
+        Args:
+            None
+
+        Kwargs:
+            c <int> - chunk index
+
+        Return:
+            cube <np.ndarray> - the cube
+        """
+        chunks = range(len(self.filled)) if c is None else [c]
+        for c in chunks:
+            if self.filled[c]:
+                continue
+            start = c * self.chunk_size
+            selection = np.arange(start, min(start+self.chunk_size, self.N))
+            for idcs, K in iter_stack(self.env, 'kappa', self.obj_index,
+                                      chunk_size=self.chunk_size, selection=selection):
+                self.index.cube(K, out=self.cube[idcs[0]:idcs[-1]+1])
+            self.filled[c] = True
+        return self.cube
+
+    def close(self, remove=True):
+        """
+        Release the cube and optionally remove its file
+        """
+        self.cube = None
+        self.filled[:] = False
+        if remove and self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
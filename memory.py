@@ -0,0 +1,254 @@
+"""
+@author: phdenzel
+
+Memory accounting of the Zapp: explicit sizes of the loaded states and caches (NumPy arrays,
+PIL images, Tk photo images, matplotlib figures) and tracemalloc snapshots (Python 3 only)
+
+Usage (Zapp console):
+    >>> mem             # accounting of states and caches
+    >>> mem trace       # start tracing allocations
+    >>> mem top 20      # top allocations (growth since the previous snapshot)
+    >>> mem status      # toggle the status bar
+"""
+import sys
+import os
+import types
+import numpy as np
+try:
+    import tracemalloc
+except ImportError:  # python 2
+    tracemalloc = None
+
+
+# skipped during the traversal (shared code objects, not data)
+_SKIP = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType,
+         types.MethodType)
+
+# snapshot for growth reports
+_last_snapshot = []
+
+
+def format_size(n):
+    """
+    Human readable size of a number of bytes
+    """
+    for unit in ['B', 'kB', 'MB', 'GB']:
+        if abs(n) < 1024.:
+            return "{:.1f} {}".format(n, unit)
+        n /= 1024.
+    return "{:.1f} TB".format(n)
+
+
+def image_nbytes(img):
+    """
+    Size of the pixel buffer of a PIL image or a Tk photo image
+
+    Args:
+        img <PIL.Image object | PIL.ImageTk.PhotoImage object> - the image
+
+    Kwargs:
+        None
+
+    Return:
+        nbytes <int> - the buffer size in bytes
+    """
+    if img is None:
+        return 0
+    if hasattr(img, 'getbands'):
+        return img.size[0] * img.size[1] * len(img.getbands())
+    if hasattr(img, 'width') and hasattr(img, 'height'):
+        return img.width() * img.height() * 4  # Tk photo images hold 32-bit pixels
+    return 0
+
+
+def nbytes(obj, seen=None):
+    """
+    Deep size of an object; NumPy arrays count with their data buffer (views and memory-mapped
+    arrays are not counted), images with their pixel buffer, and Tk widgets are skipped
+
+    Args:
+        obj <object> - the object
+
+    Kwargs:
+        seen <set> - ids of the objects already accounted for (shared between calls)
+
+    Return:
+        nbytes <int> - the size in bytes
+    """
+    seen = set() if seen is None else seen
+    total = 0
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        if id(o) in seen or isinstance(o, _SKIP) or hasattr(o, 'tk'):
+            continue
+        seen.add(id(o))
+        if isinstance(o, np.ndarray):
+            base = o
+            while isinstance(base.base, np.ndarray):
+                base = base.base
+            if isinstance(base, np.memmap) or (base is not o and id(base) in seen):
+                continue
+            seen.add(id(base))
+            total += base.nbytes
+            if o.dtype == object:
+                stack.extend(o.ravel())
+            continue
+        if hasattr(o, 'getbands'):
+            total += image_nbytes(o)
+            continue
+        total += sys.getsizeof(o, 0)
+        if isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            stack.extend(o)
+        elif hasattr(o, '__dict__'):
+            stack.append(o.__dict__)
+    return total
+
+
+def rss():
+    """
+    Resident set size of the process (peak size where the current one is not available)
+    """
+    statm = '/proc/self/statm'
+    if os.path.exists(statm):
+        with open(statm) as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    try:
+        import resource
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == 'darwin' else maxrss * 1024
+    except ImportError:
+        return 0
+
+
+def accounting(zapper):
+    """
+    Explicit size accounting of the loaded states and caches of a Zapp
+
+    Args:
+        zapper <Zapp object> - the app
+
+    Kwargs:
+        None
+
+    Return:
+        entries <list(tuple)> - (name, size in bytes) of states and caches, largest first
+    """
+    import matplotlib.pyplot as plt
+    seen = set()
+    entries = []
+    for g, env in enumerate(zapper.gls):
+        f = zapper.state_files[g] if g < len(zapper.state_files) else None
+        entries.append(("state {} ({})".format(g, os.path.basename(f) if f else '-'),
+                        nbytes(env, seen)))
+    img_copy = getattr(zapper, '_img_copy', {})
+    entries.append(("_img_copy ({} images)".format(len(img_copy)),
+                    sum([image_nbytes(i) for i in img_copy.values()])))
+    img_buffer = getattr(zapper, '_img_buffer', {})
+    entries.append(("_img_buffer ({} photo images)".format(len(img_buffer)),
+                    sum([image_nbytes(i) for i in img_buffer.values()])))
+    if zapper.render_pool is not None:
+        entries.append(("render cache ({} images)".format(len(zapper.render_pool.cache)),
+                        sum([image_nbytes(i) for i in zapper.render_pool.cache.values()])))
+    for name in ['zidx', 'contours', 'grid_cubes', 'similarity', 'clustering']:
+        entries.append((name, nbytes(getattr(zapper, name, None), seen)))
+    for name in ['comparison', 'lens_tiles']:
+        panels = getattr(zapper, name, None)
+        if panels is not None:
+            entries.append(("{} panels".format(name), sum(
+                [image_nbytes(i) for i, _ in panels._img_copy.values()]
+                + [image_nbytes(i) for i in panels._img_buffer.values()])))
+    figures = [plt.figure(n) for n in plt.get_fignums()]
+    entries.append(("matplotlib ({} figures)".format(len(figures)), sum(
+        [4 * np.prod(fig.canvas.get_width_height()) for fig in figures])))
+    return sorted(entries, key=lambda e: -e[1])
+
+
+def start_tracing(frames=1):
+    """
+    Start tracing Python allocations (Python 3 only)
+    """
+    if tracemalloc is None:
+        print("tracemalloc is not available (Python 3 only)")
+    elif not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+
+
+def stop_tracing():
+    """
+    Stop tracing Python allocations
+    """
+    if tracemalloc is not None and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    del _last_snapshot[:]
+
+
+def top_allocations(top=10):
+    """
+    Largest allocations by source line, and their growth since the previous snapshot
+
+    Args:
+        None
+
+    Kwargs:
+        top <int> - number of reported source lines
+
+    Return:
+        lines <list(str)> - the report lines
+    """
+    if tracemalloc is None or not tracemalloc.is_tracing():
+        return ["Not tracing; start with 'mem trace'"]
+    snapshot = tracemalloc.take_snapshot().filter_traces(
+        [tracemalloc.Filter(False, tracemalloc.__file__)])
+    if _last_snapshot:
+        stats = snapshot.compare_to(_last_snapshot[0], 'lineno')
+        lines = ["{}  {} ({:+d} B)".format(s.traceback, format_size(s.size), s.size_diff)
+                 for s in stats[:top]]
+    else:
+        stats = snapshot.statistics('lineno')
+        lines = ["{}  {}".format(s.traceback, format_size(s.size)) for s in stats[:top]]
+    del _last_snapshot[:]
+    _last_snapshot.append(snapshot)
+    return lines
+
+
+def report(zapper, top=10):
+    """
+    Memory report of a Zapp: process size, accounting of states and caches, and (if tracing)
+    the top allocations
+
+    Args:
+        zapper <Zapp object> - the app
+
+    Kwargs:
+        top <int> - number of reported allocation sites
+
+    Return:
+        report <str> - the report
+    """
+    lines = ["RSS".ljust(40) + format_size(rss())]
+    lines += [name.ljust(40) + format_size(size) for name, size in accounting(zapper)]
+    if zapper.render_pool is not None:
+        pool = zapper.render_pool
+        lines.append("shared ensembles (memory-mapped)".ljust(40)
+                     + format_size(pool.shared.nbytes
+                                   + sum([sh.nbytes for sh in pool.states.values()])))
+    if tracemalloc is not None and tracemalloc.is_tracing():
+        lines.append("Top allocations:")
+        lines += top_allocations(top)
+    return "\n".join(lines)
+
+
+def status(zapper):
+    """
+    Short (cheap) memory summary for the status bar
+    """
+    img_copy = getattr(zapper, '_img_copy', {})
+    return "RSS {} | {} cached images ({}) | {} figures".format(
+        format_size(rss()), len(img_copy),
+        format_size(sum([image_nbytes(i) for i in img_copy.values()])),
+        len(sys.modules['matplotlib.pyplot'].get_fignums())
+        if 'matplotlib.pyplot' in sys.modules else 0)
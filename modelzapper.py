@@ -4,7 +4,20 @@
 Use glass to read glass .state and zap through the models
 
 Usage:
-    python modelzapper.py [gls.state]
+    python modelzapper.py [-s port] [-j workers] [-i] [-c] [-e out:selection] [-m out]
+                          [gls.state | gls.zstore]
+
+Options:
+    -s, --serve <port>  serve a local JSON-RPC control server (see server.py)
+    -j, --workers <n>   render models ahead in n background processes (see render.py)
+    -i, --index         only write the sidecar indices (<gls.state>.zidx) and exit
+    -c, --convert       only convert the states into columnar stores (<gls>.zstore) and exit
+    -e, --export <out.state>:<selection>
+                        only write a filtered state of the (last) state and exit; the selection
+                        is a selection file or a filter expression over the sidecar columns,
+                        e.g. -e low.state:'H0 < 70' -e high.state:'H0 >= 70' (repeatable)
+    -m, --merge <out.state>
+                        only merge (concatenate) the states into a single state and exit
 """
 import sys
 import os
@@ -29,7 +42,10 @@ if os.path.exists(includespath):
         else:
             os.environ['LD_LIBRARY_PATH'] = inc
 
-from app import Zapp
+from app import Zapp, StateLoader, load_state, import_state, resolve_selection, export_states, \
+    merge_states
+import sidecar
+import store
 import getopt
 import traceback
 
@@ -42,7 +58,7 @@ _omp_opts = None
 
 
 def help():
-    print >>sys.stderr, "Usage: modelzapper.py <input>"
+    print >>sys.stderr, "Usage: modelzapper.py [-s port] [-j workers] [-i] [-c] [-e out:selection] [-m out] <input>"
     sys.exit(2)
 
 
@@ -117,10 +133,71 @@ if __name__ == "__main__":
     glass_basis('glass.basis.pixels', solver=None)
     exclude_all_priors()
 
-    Environment.global_opts['argv'] = [app]+sys.argv[1:]
+    try:
+        optlist, args = getopt.getopt(sys.argv[1:], 'hs:j:ice:m:',
+                                      ['help', 'serve=', 'workers=', 'index', 'convert',
+                                       'export=', 'merge='])
+    except getopt.GetoptError:
+        help()
+    port = None
+    workers = None
+    index_only = False
+    convert_only = False
+    exports = []
+    merge_name = None
+    for o, a in optlist:
+        if o in ('-h', '--help'):
+            help()
+        elif o in ('-s', '--serve'):
+            port = int(a)
+        elif o in ('-j', '--workers'):
+            workers = int(a)
+        elif o in ('-i', '--index'):
+            index_only = True
+        elif o in ('-c', '--convert'):
+            convert_only = True
+        elif o in ('-e', '--export'):
+            if ':' not in a:  # out:selection
+                help()
+            exports.append(a.split(':', 1))
+        elif o in ('-m', '--merge'):
+            merge_name = a
+
+    Environment.global_opts['argv'] = [app]+args
     opts = Environment.global_opts['argv']
-    states = [loadstate(f) for f in opts[1:]]
-
-    root, zapper = Zapp.init(gls_states=states, verbose=1)
+    if index_only:
+        for f in opts[1:]:
+            print(sidecar.index(import_state(f), f))
+        sys.exit(0)
+    if convert_only:
+        for f in opts[1:]:
+            print(store.convert(loadstate(f), state_file=f, verbose=True))
+        sys.exit(0)
+    if merge_name:
+        merge_states(opts[1:], name=merge_name, verbose=True)
+        print(merge_name)
+        sys.exit(0)
+    if exports:
+        state = import_state(opts[-1])
+        zidx = sidecar.index(state, opts[-1])
+        selections = [resolve_selection(state, spec, index=zidx) for _, spec in exports]
+        export_states(state, selections, [name for name, _ in exports], processes=workers,
+                      verbose=True)
+        sys.exit(0)
+    # the zapped (last) state is loaded first, the others stream in (see StateLoader)
+    files = opts[1:]
+    states, state_files, indices = [], [], []
+    if files:
+        state, zidx = load_state(files[-1])
+        states, state_files, indices = [state], [files[-1]], [zidx]
+    loader = StateLoader(files[:-1])
+
+    root, zapper = Zapp.init(gls_states=states, state_files=state_files, indices=indices,
+                             verbose=1)
+    zapper.stream_states(loader)
+    if port is not None:
+        zapper.serve(port=port, verbose=True)
+    if workers:
+        zapper.start_render_pool(processes=workers)
     os.system('''/usr/bin/osascript -e 'tell app "Finder" to set frontmost of process "ModelZapper" to true' ''')
     zapper.display()
@@ -0,0 +1,553 @@
+"""
+@author: phdenzel
+
+Background rendering of model images in a pool of worker processes
+
+The workers only hold the model-less GLASS skeleton of a state; the per-model arrays
+are attached zero-copy from memory-mapped files (see ensemble.SharedEnsemble), so a pool
+of N workers costs a single copy of the ensemble. Further states (e.g. for comparisons) are
+shared the same way and attached by the workers on demand. Each worker keeps its own render caches
+(contour segments, profile sketches), so its images match the ones rendered by the app.
+
+Rendered frames can also be streamed into an animated GIF or a numbered PNG sequence
+(see export_frames); only a small window of frames is in flight at any time.
+"""
+import sys
+import os
+import copy
+import struct
+import warnings
+import collections
+import multiprocessing
+from PIL import Image, GifImagePlugin
+if sys.version_info.major < 3:
+    import cPickle as pickle
+else:
+    import pickle
+
+import store
+from ensemble import SharedEnsemble, GridCube
+from contours import ContourCache
+from sketch import ProfileSketch
+
+
+# per-process state of a render worker
+_worker = {}
+
+SKELETON = 'skeleton.pkl'
+
+
+def skeleton(env):
+    """
+    Shallow copy of a GLASS state without its models
+    """
+    skel = copy.copy(env)
+    skel.models = []
+    skel.accepted_models = []
+    skel.solutions = []
+    return skel
+
+
+class RenderCaches(object):
+    """
+    Lazily built render caches of a lens (cf. Zapp.contour_cache, Zapp.grid_cube,
+    Zapp.profile_sketch), used by app.mapping_function
+    """
+    def __init__(self, env, obj_index=0, grid_cubes=False):
+        """
+        Initialize the (empty) caches
+
+        Args:
+            env <glass.Environment object> - the glass state
+
+        Kwargs:
+            obj_index <int> - index of the lens object
+            grid_cubes <bool> - build a kappa grid cube; it only speeds up the kappa maps
+                                (with identical results), so workers skip it to save memory
+
+        Return:
+            <RenderCaches object> - standard initializer
+        """
+        self.env = env
+        self.obj_index = obj_index
+        self.grid_cubes = grid_cubes
+        self.contours = None
+        self.cube = None
+        self.sketches = {}
+
+    def contour_cache(self):
+        """
+        The arrival-time contour cache of the lens
+        """
+        if self.contours is None:
+            self.contours = ContourCache(self.env, obj_index=self.obj_index)
+        return self.contours
+
+    def grid_cube(self):
+        """
+        The kappa grid cube of the lens; None if disabled or not available
+        """
+        if self.grid_cubes and self.cube is None:
+            try:
+                self.cube = GridCube(self.env, obj_index=self.obj_index)
+            except (KeyError, TypeError, ValueError):
+                self.grid_cubes = False
+        return self.cube
+
+    def profile_sketch(self, key):
+        """
+        The quantile sketch of a profile of the lens; None if the models lack kappa maps
+        """
+        if key not in self.sketches:
+            try:
+                self.sketches[key] = ProfileSketch(self.env, key=key, obj_index=self.obj_index)
+            except (KeyError, TypeError, ValueError):
+                self.sketches[key] = None
+        return self.sketches[key]
+
+    def close(self):
+        """
+        Release the caches
+
+        Args/Kwargs/Return:
+            None
+        """
+        if self.cube is not None:
+            self.cube.close()
+        self.contours = None
+        self.cube = None
+        self.sketches = {}
+
+
+def render_model(env, model, model_property, obj_index=0, models=None, dpi=None,
+                 index=None, selection=None, caches=None):
+    """
+    Render a model mapping into an image (cf. Zapp.model_image)
+
+    Args:
+        env <glass.Environment object> - the glass state (or its skeleton)
+        model <dict> - the glass model
+        model_property <str> - the model mapping (see app.MODEL_MAPPINGS)
+
+    Kwargs:
+        obj_index <int> - index of the lens object
+        models <list(dict)> - the models used for ensemble mappings
+        dpi <float> - resolution of the image
+        index <int> - index of the model (to look up cached render data)
+        selection <list(int)> - model indices of the ensemble mappings
+        caches <RenderCaches object> - render caches of the lens
+
+    Return:
+        img <PIL.Image object> - the rendered image
+    """
+    import app  # registers the glass plotting commands
+    func, kwargs = app.mapping_function(env, model_property, models or [model],
+                                        index=index, selection=selection, caches=caches)
+    func(model, obj_index=obj_index, **kwargs)
+    app.plt.tight_layout(h_pad=1)
+    return app.figure_image(dpi=dpi)
+
+
+def _attach(skel, path):
+    shared = SharedEnsemble.attach(path, objects=skel.objects)
+    skel.models = shared  # lazy models for the render caches
+    return {'env': skel, 'shared': shared, 'caches': {}}
+
+
+def _init_worker(skel, path):
+    import matplotlib.pyplot as plt
+    plt.switch_backend('Agg')
+    _worker[None] = _attach(skel, path)
+
+
+def _render(task):
+    import app
+    key, selection, dpi, path = task
+    index, obj_index, model_property = key
+    if path not in _worker:  # a further state (see RenderPool.add_state)
+        with open(os.path.join(path, SKELETON), 'rb') as f:
+            _worker[path] = _attach(pickle.load(f), path)
+    state = _worker[path]
+    shared = state['shared']
+    models = None
+    if selection is not None and model_property not in app.MODEL_MAPPINGS[:2]:
+        models = store.ModelView(shared, selection)  # lazy, as in the app
+    if obj_index not in state['caches']:
+        state['caches'][obj_index] = RenderCaches(state['env'], obj_index)
+    img = render_model(state['env'], shared.model(index), model_property,
+                       obj_index=obj_index, models=models, dpi=dpi, index=index,
+                       selection=selection, caches=state['caches'][obj_index])
+    return key, img.mode, img.size, img.tobytes()
+
+
+class RenderPool(object):
+    """
+    Pool of render workers for a GLASS state (and optionally further states) with an LRU
+    cache of finished images
+    """
+    def __init__(self, env, processes=None, cache_size=256, shared=None):
+        """
+        Share the model arrays of a state and start the workers
+
+        Args:
+            env <glass.Environment object> - the glass state
+
+        Kwargs:
+            processes <int> - number of worker processes; default number of CPUs
+            cache_size <int> - number of finished images kept
+            shared <ensemble.SharedEnsemble object> - already shared arrays of the state to be
+                                                      reused (and kept open by close)
+
+        Return:
+            <RenderPool object> - standard initializer
+        """
+        self.processes = processes or multiprocessing.cpu_count()
+        self.cache_size = cache_size
+        self.owned = set()
+        if shared is None:
+            shared = SharedEnsemble.create(env)
+            self.owned.add(None)
+        self.shared = shared
+        self.pool = multiprocessing.Pool(self.processes, _init_worker,
+                                         (skeleton(env), self.shared.path))
+        self.states = {}
+        self.pending = {}
+        self.cache = collections.OrderedDict()
+
+    def __str__(self):
+        return "{}({} workers, {} states, {} pending, {} cached)".format(
+            self.__class__.__name__, self.processes, 1+len(self.states), len(self.pending),
+            len(self.cache))
+
+    def __repr__(self):
+        return self.__str__()
+
+    def add_state(self, name, env, shared=None):
+        """
+        Share the model arrays of a further state with the workers, which render it on demand
+
+        Args:
+            name <hashable> - name of the state in the keys of submit, get, etc.
+            env <glass.Environment object> - the glass state
+
+        Kwargs:
+            shared <ensemble.SharedEnsemble object> - already shared arrays of the state to be
+                                                      reused (and kept open by remove_state)
+
+        Return:
+            None
+        """
+        if name in self.states:
+            return
+        if shared is None:
+            shared = SharedEnsemble.create(env)
+            self.owned.add(name)
+        if not os.path.exists(os.path.join(shared.path, SKELETON)):
+            with open(os.path.join(shared.path, SKELETON), 'wb') as f:
+                pickle.dump(skeleton(env), f, pickle.HIGHEST_PROTOCOL)
+        self.states[name] = shared
+
+    def remove_state(self, name):
+        """
+        Forget a further state and its images, and release its shared arrays
+        """
+        shared = self.states.pop(name, None)
+        if shared is None:
+            return
+        for key in [k for k in list(self.pending.keys()) + list(self.cache.keys())
+                    if len(k) == 4 and k[0] == name]:
+            self.pending.pop(key, None)
+            self.cache.pop(key, None)
+        if name in self.owned:
+            self.owned.discard(name)
+            shared.close()
+
+    @staticmethod
+    def cache_key(key, state=None):
+        """
+        Key of an image in the pending jobs and the cache; keys of further states are
+        prefixed with the state's name
+        """
+        return key if state is None else (state,) + tuple(key)
+
+    def submit(self, key, selection=None, dpi=None, state=None):
+        """
+        Queue a render job unless the image is cached or already queued
+
+        Args:
+            key <tuple> - (model_index, obj_index, model_property)
+
+        Kwargs:
+            selection <list(int)> - model indices for ensemble mappings
+            dpi <float> - resolution of the image
+            state <hashable> - name of a further state (see add_state); default the pool's state
+
+        Return:
+            None
+        """
+        ckey = self.cache_key(key, state)
+        if ckey in self.cache or ckey in self.pending:
+            return
+        path = None if state is None else self.states[state].path
+        self.pending[ckey] = self.pool.apply_async(_render, ((key, selection, dpi, path),))
+
+    def ready(self, key, state=None):
+        """
+        Test whether the image of a key is finished
+        """
+        key = self.cache_key(key, state)
+        return key in self.cache or (key in self.pending and self.pending[key].ready())
+
+    def get(self, key, wait=False, state=None):
+        """
+        Get a finished image
+
+        Args:
+            key <tuple> - (model_index, obj_index, model_property)
+
+        Kwargs:
+            wait <bool> - block until a queued job is finished
+            state <hashable> - name of a further state (see add_state)
+
+        Return:
+            img <PIL.Image object> - the image; None if not (yet) available
+        """
+        key = self.cache_key(key, state)
+        if key in self.cache:
+            self.cache[key] = self.cache.pop(key)  # move to end
+            return self.cache[key]
+        result = self.pending.get(key)
+        if result is None or not (wait or result.ready()):
+            return None
+        del self.pending[key]
+        try:
+            _, mode, size, data = result.get()
+        except Exception as e:
+            warnings.warn("Rendering {} failed: {}".format(key, e))
+            return None
+        img = Image.frombytes(mode, size, data)
+        self.cache[key] = img
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return img
+
+    def collect(self):
+        """
+        Move all finished jobs into the cache
+
+        Args/Kwargs:
+            None
+
+        Return:
+            keys <list(tuple)> - keys of the newly finished images
+        """
+        keys = [k for k, r in list(self.pending.items()) if r.ready()]
+        return [k for k in keys if self.get(k) is not None]
+
+    def discard(self, keep=()):
+        """
+        Forget queued jobs (finished results are dropped when they arrive)
+
+        Args:
+            None
+
+        Kwargs:
+            keep <list(tuple)> - keys of jobs which are still of interest
+
+        Return:
+            None
+        """
+        for k in list(self.pending.keys()):
+            if k not in keep and not self.pending[k].ready():
+                del self.pending[k]
+
+    def close(self):
+        """
+        Terminate the workers and release the shared arrays (unless they were passed in)
+
+        Args/Kwargs/Return:
+            None
+        """
+        self.pool.terminate()
+        self.pool.join()
+        if None in self.owned:
+            self.shared.close()
+        for name, shared in self.states.items():
+            if name in self.owned:
+                shared.close()
+        self.states = {}
+        self.owned = set()
+
+
+def _frame(result):
+    key, mode, size, data = result
+    return Image.frombytes(mode, size, data)
+
+
+class GifWriter(object):
+    """
+    Animated GIF written frame by frame (each frame with its own adaptive color table)
+    """
+    def __init__(self, name, duration=100, loop=0):
+        """
+        Initialize the (not yet opened) file
+
+        Args:
+            name <str> - path of the GIF file
+
+        Kwargs:
+            duration <int> - display time of each frame in ms
+            loop <int> - number of loops; 0 loops forever
+
+        Return:
+            <GifWriter object> - standard initializer
+        """
+        self.name = name
+        self.duration = duration
+        self.loop = loop
+        self.size = None
+        self.fp = None
+        self.n_frames = 0
+
+    def write(self, img):
+        """
+        Append a frame
+
+        Args:
+            img <PIL.Image object> - the frame
+
+        Kwargs:
+            None
+
+        Return:
+            None
+        """
+        img = img.convert('RGB')
+        if self.size is not None and img.size != self.size:
+            img = img.resize(self.size)
+        frame = img.quantize()
+        if self.fp is None:
+            self.size = img.size
+            self.fp = open(self.name, 'wb')
+            header, _ = GifImagePlugin.getheader(
+                frame, info={'duration': self.duration, 'optimize': False})
+            for block in header:
+                self.fp.write(block)
+            # NETSCAPE2.0 application extension (looping)
+            self.fp.write(b'!\xff\x0bNETSCAPE2.0\x03\x01' + struct.pack('<H', self.loop)
+                          + b'\x00')
+        for block in GifImagePlugin.getdata(frame, duration=self.duration,
+                                            include_color_table=True):
+            self.fp.write(block)
+        self.n_frames += 1
+
+    def close(self):
+        """
+        Terminate and close the file
+
+        Args/Kwargs/Return:
+            None
+        """
+        if self.fp is not None:
+            self.fp.write(b';')
+            self.fp.close()
+            self.fp = None
+
+
+class PNGSequenceWriter(object):
+    """
+    Numbered sequence of PNG files (<root>_00000.png, <root>_00001.png, ...)
+    """
+    def __init__(self, name):
+        """
+        Initialize the sequence
+
+        Args:
+            name <str> - path of the sequence; the frame number is inserted before the extension
+
+        Kwargs:
+            None
+
+        Return:
+            <PNGSequenceWriter object> - standard initializer
+        """
+        self.root = os.path.splitext(name)[0]
+        self.n_frames = 0
+
+    def write(self, img):
+        """
+        Write the next frame
+        """
+        img.save('{}_{:05d}.png'.format(self.root, self.n_frames))
+        self.n_frames += 1
+
+    def close(self):
+        pass
+
+
+def export_frames(env, keys, name, selection=None, dpi=None, duration=100, loop=0,
+                  processes=None, window=None, render_pool=None, shared=None, progress=None,
+                  verbose=False):
+    """
+    Render a sequence of model images in worker processes and stream them into an animated
+    GIF (name ends with .gif) or a numbered PNG sequence; frames are written in order as they
+    complete, with at most a window of frames in flight
+
+    Args:
+        env <glass.Environment object> - the glass state
+        keys <list(tuple)> - (model_index, obj_index, model_property) of the frames
+        name <str> - path of the GIF file or the PNG sequence
+
+    Kwargs:
+        selection <list(int)> - model indices for ensemble mappings
+        dpi <float> - resolution of the frames
+        duration <int> - display time of each GIF frame in ms
+        loop <int> - number of GIF loops; 0 loops forever
+        processes <int> - number of worker processes; default number of CPUs
+        window <int> - maximal number of frames in flight; default twice the processes
+        render_pool <RenderPool object> - running pool of the same state to be used instead
+        shared <ensemble.SharedEnsemble object> - shared model arrays of the state to be used
+                                                  by the workers (left open); default new ones
+        progress <func> - called with the number of written frames after each frame
+        verbose <bool> - verbose mode; print command line statements
+
+    Return:
+        n_frames <int> - number of written frames
+    """
+    if name.lower().endswith('.gif'):
+        writer = GifWriter(name, duration=duration, loop=loop)
+    else:
+        writer = PNGSequenceWriter(name)
+    owned = None
+    if render_pool is not None:
+        pool, processes = render_pool.pool, render_pool.processes
+    else:
+        processes = processes or multiprocessing.cpu_count()
+        if shared is None:
+            shared = owned = SharedEnsemble.create(env)
+        pool = multiprocessing.Pool(processes, _init_worker, (skeleton(env), shared.path))
+    window = window or 2*processes
+    in_flight = collections.deque()
+
+    def write(result):
+        writer.write(_frame(result))
+        if progress is not None:
+            progress(writer.n_frames)
+        if verbose:
+            print("Exported frame {} to {}".format(writer.n_frames, name))
+
+    try:
+        for key in keys:
+            in_flight.append(pool.apply_async(_render, ((key, selection, dpi, None),)))
+            if len(in_flight) >= window:
+                write(in_flight.popleft().get())
+        while in_flight:
+            write(in_flight.popleft().get())
+    finally:
+        writer.close()
+        if render_pool is None:
+            pool.terminate()
+            pool.join()
+        if owned is not None:
+            owned.close()
+    return writer.n_frames
@@ -0,0 +1,180 @@
+"""
+@author: phdenzel
+
+Vectorized physical-plausibility scoring of the models in a GLASS ensemble
+
+All metrics are computed in one pass over the stacked kappa maps (chunk by chunk);
+larger values are less plausible. The combined score sums the robust z-scores of the metrics,
+so that navigating by descending score shows the worst models first.
+"""
+import numpy as np
+
+import ensemble
+
+
+METRICS = ['negative', 'spikes', 'non-monotonic', 'ellipticity', 'time delays']
+
+
+def kappa_metrics(K, profiles):
+    """
+    Plausibility metrics of stacked kappa maps
+
+    Args:
+        K <np.ndarray> - kappa maps of shape (N_models, N_pixels)
+        profiles <ensemble.RadialProfiles object> - the radial profile engine of the lens
+
+    Kwargs:
+        None
+
+    Return:
+        metrics <dict(np.ndarray)> - 'negative' (fraction of negative pixels),
+                                     'spikes' (maximal pixel over its ring mean),
+                                     'non-monotonic' (rising ring means, relative to the center;
+                                                      NaN for a vanishing center),
+                                     'ellipticity' (from the second moments of the map)
+    """
+    K = np.asarray(K, dtype=np.float64)
+    rings, ploc = profiles.rings, profiles.ploc
+    metrics = {}
+    metrics['negative'] = np.mean(K < 0, axis=1)
+    profile = profiles.profile(K, 'kappa(R)')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = K / profile[:, rings]
+    outer = rings > 0
+    metrics['spikes'] = np.nanmax(np.where(np.isfinite(ratio[:, outer]), ratio[:, outer], 0),
+                                  axis=1) if np.any(outer) else np.zeros(len(K))
+    rise = np.maximum(np.diff(profile, axis=1), 0)
+    center = np.abs(profile[:, 0])
+    center[center == 0] = np.nan  # undefined rather than infinite (see robust_z)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        metrics['non-monotonic'] = np.sum(rise, axis=1) / center
+    W = np.maximum(K, 0)
+    x, y = ploc.real, ploc.imag
+    w = np.maximum(np.sum(W, axis=1), 1e-12)
+    Qxx = W.dot(x*x) / w
+    Qyy = W.dot(y*y) / w
+    Qxy = W.dot(x*y) / w
+    with np.errstate(divide='ignore', invalid='ignore'):
+        metrics['ellipticity'] = np.nan_to_num(
+            np.sqrt((Qxx - Qyy)**2 + 4*Qxy**2) / (Qxx + Qyy))
+    return metrics
+
+
+def _delay_sign(delay):
+    """
+    Sign of an observed time delay (a value, a (min, max) range, or None for ordering only)
+    """
+    if delay is None:
+        return 1
+    if isinstance(delay, (list, tuple)):
+        lo, hi = (list(delay) + [None, None])[:2]
+        if lo is not None and lo >= 0 and (hi is None or hi > 0):
+            return 1
+        if hi is not None and hi <= 0 and (lo is None or lo < 0):
+            return -1
+        return 0
+    return int(np.sign(delay))
+
+
+def observed_signs(obj):
+    """
+    Observed ordering of the time delays of a lens object, aligned with the model delays
+    (between consecutive images of each source, see the sidecar 'time delays' column)
+
+    Args:
+        obj <glass.LensModel object> - the lens object
+
+    Kwargs:
+        None
+
+    Return:
+        observed <np.ndarray> - signs of the delays (0 if not constrained); None if the
+                                lens has no time delay constraints
+    """
+    signs = []
+    for src in getattr(obj, 'sources', []):
+        images = list(getattr(src, 'images', []))
+        constraints = list(getattr(src, 'time_delays', []))
+        for A, B in zip(images[:-1], images[1:]):
+            sign = 0
+            for a, b, delay in constraints:
+                if a is A and b is B:
+                    sign = _delay_sign(delay)
+                elif a is B and b is A:
+                    sign = -_delay_sign(delay)
+            signs.append(sign)
+    if not np.any(signs):
+        return None
+    return np.array(signs, dtype=np.float64)
+
+
+def delay_metric(delays, observed=None):
+    """
+    Fraction of time delays whose sign disagrees with the observed ordering
+
+    Args:
+        delays <np.ndarray> - time delays of shape (N_models, N_delays), NaN padded
+
+    Kwargs:
+        observed <np.ndarray> - observed signs of the delays (see observed_signs);
+                                default ensemble consensus
+
+    Return:
+        metric <np.ndarray> - the fraction of wrongly ordered delays of shape (N_models,)
+    """
+    if delays.size == 0:
+        return np.zeros(len(delays))
+    if observed is None:
+        observed = np.sign(np.nanmedian(delays, axis=0))
+    else:  # align with the (padded) delay columns
+        n = delays.shape[1]
+        observed = np.concatenate([observed, np.zeros(n)])[:n]
+    wrong = (np.sign(delays) != observed) & np.isfinite(delays) & (observed != 0)
+    n = np.maximum(np.sum(np.isfinite(delays), axis=1), 1)
+    return np.sum(wrong, axis=1) / n.astype(np.float64)
+
+
+def robust_z(x):
+    """
+    Robust z-score (median and median absolute deviation), clipped to positive values;
+    undefined (NaN) values are ignored and score 0
+    """
+    x = np.asarray(x, dtype=np.float64)
+    finite = np.isfinite(x)
+    if not np.any(finite):
+        return np.zeros(len(x))
+    med = np.median(x[finite])
+    mad = 1.4826 * np.median(np.abs(x[finite] - med))
+    if mad == 0:
+        mad = np.std(x[finite]) or 1.
+    z = np.zeros(len(x))
+    z[finite] = np.maximum((x[finite] - med) / mad, 0)
+    return z
+
+
+def plausibility(env, obj_index=0, delays=None, observed=None, chunk_size=1024):
+    """
+    Score all models of a lens in one pass over the stacked kappa maps
+
+    Args:
+        env <glass.Environment object> - the glass state
+
+    Kwargs:
+        obj_index <int> - index of the lens object
+        delays <np.ndarray> - time delays of shape (N_models, N_delays), e.g. from the sidecar index
+        observed <np.ndarray> - observed signs of the time delays
+        chunk_size <int> - number of models scored at once
+
+    Return:
+        scores <dict(np.ndarray)> - the metrics (see METRICS) and the combined 'score'
+    """
+    profiles = ensemble.radial_profiles(env, obj_index)
+    N = len(env.models)
+    scores = dict((m, np.zeros(N)) for m in METRICS)
+    for idcs, K in ensemble.iter_stack(env, 'kappa', obj_index, chunk_size=chunk_size):
+        for m, v in kappa_metrics(K, profiles).items():
+            scores[m][idcs] = v
+    if delays is not None:
+        scores['time delays'] = delay_metric(np.asarray(delays, dtype=np.float64), observed)
+    scores['score'] = np.sum([robust_z(scores[m]) for m in METRICS], axis=0)
+    return scores
@@ -0,0 +1,600 @@
+"""
+@author: phdenzel
+
+Local JSON-RPC control server to drive a running Zapp from scripts and notebooks
+
+Usage:
+    python modelzapper.py --serve 8722 [gls.state]   # prints the session token
+
+    from server import ZappClient
+    zc = ZappClient(port=8722, token='<session token>')  # or $ZAPP_TOKEN
+    zc.set_model_index(42)
+    zc.tag([3, 5, 8, 13])
+    zc.batch([('set_obj_index', [1]), ('set_model_property', ['mass'])])
+"""
+import sys
+import os
+import io
+import hmac
+import json
+import base64
+import binascii
+import threading
+if sys.version_info.major < 3:
+    import Queue as queue
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    import urllib2 as urlrequest
+    from urlparse import urlparse, parse_qs
+else:
+    import queue
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    import urllib.request as urlrequest
+    from urllib.parse import urlparse, parse_qs
+
+
+# JSON-RPC 2.0 error codes
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+SERVER_ERROR = -32000
+
+
+class RPCError(Exception):
+    """
+    Error which is reported back to the client as JSON-RPC error object
+    """
+    def __init__(self, code, message):
+        super(RPCError, self).__init__(message)
+        self.code = code
+        self.message = message
+
+
+class _ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class ZappRequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP handler forwarding requests to the ZappServer (which runs them in the Tk thread)
+
+    Routes:
+        POST /            - JSON-RPC 2.0 request or batch (list of requests)
+        GET  /state       - JSON dump of the current view state
+        GET  /image.png   - the currently rendered image
+
+    Every request has to carry the session token (X-Zapp-Token header or ?token= query), must
+    not come from a foreign Origin, and POST bodies must be application/json; this keeps web
+    pages in the user's browser from driving the server (e.g. writing files)
+    """
+    def _authorized(self):
+        """
+        Check the origin and the session token of a request (replies with 403 if not)
+        """
+        zs = self.server.zapp_server
+        origin = self.headers.get('Origin')
+        if origin is not None and origin not in zs.origins:
+            self.send_error(403, "Foreign origin")
+            return False
+        token = self.headers.get('X-Zapp-Token')
+        if token is None:
+            token = parse_qs(urlparse(self.path).query).get('token', [''])[0]
+        if not hmac.compare_digest(str(token), str(zs.token)):
+            self.send_error(403, "Invalid token")
+            return False
+        return True
+
+    def do_POST(self):
+        if not self._authorized():
+            return
+        content_type = self.headers.get('Content-Type', '').split(';')[0].strip().lower()
+        if content_type != 'application/json':
+            self.send_error(415, "Content-Type must be application/json")
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        try:
+            payload = json.loads(body.decode('utf-8'))
+        except ValueError:
+            response = self.server.zapp_server.error(None, PARSE_ERROR, "Parse error")
+        else:
+            response = self.server.zapp_server.handle(payload)
+        if response is None:
+            self.send_response(204)
+            self.end_headers()
+            return
+        self._reply(json.dumps(response).encode('utf-8'), 'application/json')
+
+    def do_GET(self):
+        if not self._authorized():
+            return
+        zs = self.server.zapp_server
+        path = self.path.split('?')[0].rstrip('/')
+        if path in ('', '/state'):
+            response = zs.handle({'jsonrpc': '2.0', 'method': 'state', 'id': 0})
+            self._reply(json.dumps(response['result'] if 'result' in response else response)
+                        .encode('utf-8'), 'application/json')
+        elif path == '/image.png':
+            response = zs.handle({'jsonrpc': '2.0', 'method': 'image', 'id': 0})
+            if 'result' in response:
+                self._reply(base64.b64decode(response['result']), 'image/png')
+            else:
+                self.send_error(500, response['error']['message'])
+        else:
+            self.send_error(404)
+
+    def _reply(self, data, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if self.server.zapp_server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class ZappServer(object):
+    """
+    Loopback JSON-RPC server exposing Zapp operations
+
+    Requests are received in a background thread, but executed in the Tk thread
+    (polled with Zapp.after), since Tk widgets must not be touched from other threads.
+    A JSON-RPC batch is executed as a whole in a single poll and triggers at most one render.
+    Files are only read and written within the working directory.
+    """
+    poll_interval = 50  # ms
+    timeout = 3600      # s
+
+    def __init__(self, zapper, host='127.0.0.1', port=8722, token=None, root=None,
+                 verbose=False):
+        """
+        Initialize the server with a reference to the app frame
+
+        Args:
+            zapper <Zapp object> - the app to be controlled
+
+        Kwargs:
+            host <str> - the host address; loopback by default
+            port <int> - the port number to listen to
+            token <str> - the session token; default random
+            root <str> - directory within which files are read and written; default the
+                         working directory
+            verbose <bool> - verbose mode; print command line statements
+
+        Return:
+            <ZappServer object> - standard initializer
+        """
+        self.zapper = zapper
+        self.host = host
+        self.port = port
+        self.token = token or binascii.hexlify(os.urandom(16)).decode('ascii')
+        self.root = os.path.realpath(root or os.getcwd())
+        self.verbose = verbose
+        self.jobs = queue.Queue()
+        self._dirty = False
+        self.httpd = None
+        self.thread = None
+        self.methods = {
+            'state': self.state,
+            'set_model_index': self.set_model_index,
+            'set_obj_index': self.set_obj_index,
+            'set_model_property': self.set_model_property,
+            'tag': self.tag,
+            'untag': self.untag,
+            'selection': self.selection,
+            'set_selection': self.set_selection,
+            'clear_selection': self.clear_selection,
+            'find_similar': self.find_similar,
+            'H0filter': self.H0filter,
+            'set_H0_range': self.set_H0_range,
+            'image': self.image,
+            'save_selection': self.save_selection,
+            'load_selection': self.load_selection,
+            'export_state': self.export_state,
+        }
+
+    def __str__(self):
+        return "{}(http://{}:{})".format(self.__class__.__name__, self.host, self.port)
+
+    def __repr__(self):
+        return self.__str__()
+
+    def start(self):
+        """
+        Start listening in a daemon thread and start polling in the Tk loop
+
+        Args/Kwargs/Return:
+            None
+        """
+        self.httpd = _ThreadedHTTPServer((self.host, self.port), ZappRequestHandler)
+        self.httpd.zapp_server = self
+        self.port = self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.zapper.after(self.poll_interval, self.poll)
+        print("Serving on {} (token {})".format(self, self.token))
+
+    @property
+    def origins(self):
+        """
+        Origins of requests accepted from browsers (the server itself)
+        """
+        return ["http://{}:{}".format(h, self.port) for h in [self.host, 'localhost', '127.0.0.1']]
+
+    def path(self, name):
+        """
+        Resolve a file name of a request within the root directory
+
+        Args:
+            name <str> - the file name
+
+        Kwargs:
+            None
+
+        Return:
+            path <str> - the resolved path
+
+        Raises:
+            RPCError - if the file lies outside the root directory
+        """
+        path = os.path.realpath(os.path.join(self.root, str(name)))
+        if os.path.commonprefix([path, self.root + os.sep]) != self.root + os.sep:
+            raise RPCError(INVALID_PARAMS, "Path outside {}: {}".format(self.root, name))
+        return path
+
+    def stop(self):
+        """
+        Shut down the server
+
+        Args/Kwargs/Return:
+            None
+        """
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
+
+    def handle(self, payload):
+        """
+        Queue a JSON-RPC request (or batch) for the Tk thread and wait for the response
+
+        Args:
+            payload <dict/list(dict)> - a decoded JSON-RPC request or batch
+
+        Kwargs:
+            None
+
+        Return:
+            response <dict/list(dict)> - the JSON-RPC response(s); None for notifications only
+        """
+        batch = isinstance(payload, list)
+        if batch and not payload:
+            return self.error(None, INVALID_REQUEST, "Empty batch")
+        requests = payload if batch else [payload]
+        job = {'requests': requests, 'responses': None, 'done': threading.Event()}
+        self.jobs.put(job)
+        if not job['done'].wait(self.timeout):
+            return self.error(None, SERVER_ERROR, "Timeout")
+        responses = [r for r in job['responses'] if r is not None]
+        if not responses:
+            return None
+        return responses if batch else responses[0]
+
+    def poll(self):
+        """
+        Execute queued jobs in the Tk thread (reschedules itself)
+
+        Args/Kwargs/Return:
+            None
+        """
+        while True:
+            try:
+                job = self.jobs.get_nowait()
+            except queue.Empty:
+                break
+            self._dirty = False
+            try:
+                job['responses'] = [self.execute(r) for r in job['requests']]
+                if self._dirty:
+                    self.zapper.request_render(force=True)
+            finally:
+                job['done'].set()
+        if self.httpd is not None:
+            self.zapper.after(self.poll_interval, self.poll)
+
+    def execute(self, request):
+        """
+        Execute a single JSON-RPC request
+
+        Args:
+            request <dict> - the decoded request
+
+        Kwargs:
+            None
+
+        Return:
+            response <dict> - result or error object; None for notifications
+        """
+        if not isinstance(request, dict) or 'method' not in request:
+            return self.error(None, INVALID_REQUEST, "Invalid Request")
+        rid = request.get('id')
+        params = request.get('params', [])
+        method = self.methods.get(request['method'])
+        try:
+            if method is None:
+                raise RPCError(METHOD_NOT_FOUND, "Method not found: {}".format(request['method']))
+            try:
+                if isinstance(params, dict):
+                    result = method(**params)
+                else:
+                    result = method(*params)
+            except TypeError as e:
+                raise RPCError(INVALID_PARAMS, str(e))
+        except RPCError as e:
+            response = self.error(rid, e.code, e.message)
+        except Exception as e:
+            response = self.error(rid, SERVER_ERROR, "{}: {}".format(e.__class__.__name__, e))
+        else:
+            response = {'jsonrpc': '2.0', 'result': result, 'id': rid}
+        if 'id' not in request:
+            return None
+        return response
+
+    @staticmethod
+    def error(rid, code, message):
+        return {'jsonrpc': '2.0', 'error': {'code': code, 'message': message}, 'id': rid}
+
+    def _indices(self, indices):
+        """
+        Model indices of a request
+
+        Args:
+            indices <int/list(int)> - a model index or a list of model indices
+
+        Kwargs:
+            None
+
+        Return:
+            indices <list(int)> - the model indices; None if none were given
+
+        Raises:
+            RPCError - if an index is no integer or lies outside [0, N_models)
+        """
+        if indices is None:
+            return None
+        if not isinstance(indices, (list, tuple)):
+            indices = [indices]
+        try:
+            indices = [int(i) for i in indices]
+        except (TypeError, ValueError):
+            raise RPCError(INVALID_PARAMS, "Invalid model indices: {}".format(indices))
+        N = len(self.zapper.models()) if self.zapper.gls else 0
+        outside = [i for i in indices if not 0 <= i < N]
+        if outside:
+            raise RPCError(INVALID_PARAMS, "Model indices outside [0, {}): {}".format(
+                N, outside[:10]))
+        return indices
+
+    # Exposed methods #########################################################
+    def state(self):
+        """
+        The current view state of the app
+        """
+        z = self.zapper
+        return {'model_index': z.model_index,
+                'obj_index': z.obj_index,
+                'model_property': z.model_property,
+                'model_mappings': z.model_mappings,
+                'model_min': z.model_min,
+                'model_max': z.model_max,
+                'H0_min': z.H0_min,
+                'H0_max': z.H0_max,
+                'N_models': len(z.models()) if z.gls else 0,
+                'N_objects': len(z.models()[0]['obj,data']) if z.gls else None,
+                'N_selected': len(z.model_selection)}
+
+    def set_model_index(self, index):
+        """
+        Jump to a model index
+        """
+        self.zapper.model_index = int(index)
+        return self.zapper.model_index
+
+    def set_obj_index(self, index):
+        """
+        Switch to a lens object index
+        """
+        self.zapper.obj_index = int(index)
+        self.zapper._on_lens_switch()
+        return self.zapper.obj_index
+
+    def set_model_property(self, name):
+        """
+        Switch to a model mapping (one of model_mappings)
+        """
+        if name not in self.zapper.model_mappings:
+            raise RPCError(INVALID_PARAMS, "Unknown model property: {}".format(name))
+        self.zapper.model_map.set(name)
+        return self.zapper.model_property
+
+    def tag(self, indices=None):
+        """
+        Add models to the selection (default: the current model; an empty list adds none)
+        """
+        indices = self._indices(self.zapper.model_index if indices is None else indices)
+        if indices:
+            self.zapper.model_selection.update(indices)
+            self._dirty = True
+        return len(self.zapper.model_selection)
+
+    def untag(self, indices=None):
+        """
+        Remove models from the selection (default: the current model; an empty list removes
+        none)
+        """
+        indices = self._indices(self.zapper.model_index if indices is None else indices)
+        if indices:
+            self.zapper.model_selection.difference_update(indices)
+            self._dirty = True
+        return len(self.zapper.model_selection)
+
+    def selection(self):
+        """
+        The sorted model selection
+        """
+        return sorted(self.zapper.model_selection)
+
+    def set_selection(self, indices):
+        """
+        Replace the model selection
+        """
+        self.zapper.model_selection = set(self._indices(indices))
+        self._dirty = True
+        return len(self.zapper.model_selection)
+
+    def clear_selection(self):
+        """
+        Clear the model selection
+        """
+        self.zapper.model_selection = set([])
+        self._dirty = True
+        return 0
+
+    def find_similar(self, index=None, k=None, threshold=None):
+        """
+        Indices of the models most similar to a model (default: the current model)
+        """
+        return self.zapper.find_similar(index=index, k=k, threshold=threshold)
+
+    def H0filter(self):
+        """
+        Indices of the models within the current H0 range
+        """
+        return self.zapper.H0filter()
+
+    def set_H0_range(self, H0_min, H0_max):
+        """
+        Apply an H0 range to the model filter
+        """
+        try:
+            H0_min, H0_max = float(H0_min), float(H0_max)
+        except (TypeError, ValueError):
+            raise RPCError(INVALID_PARAMS, "Invalid H0 range: {}, {}".format(H0_min, H0_max))
+        if not H0_min <= H0_max:
+            raise RPCError(INVALID_PARAMS, "Empty H0 range: {} > {}".format(H0_min, H0_max))
+        self.zapper.H0_min = H0_min
+        self.zapper.H0_max = H0_max
+        self.zapper._on_H0filter()
+        return len(self.zapper.H0filter())
+
+    def image(self):
+        """
+        The currently rendered image as base64-encoded PNG
+        """
+        z = self.zapper
+        key = (z.model_index, z.obj_index, z.model_property)
+        img = z._img_copy.get(key) if hasattr(z, '_img_copy') else None
+        if img is None:
+            img = z.model_image()
+        buf = io.BytesIO()
+        img.save(buf, format='PNG')
+        return base64.b64encode(buf.getvalue()).decode('ascii')
+
+    def save_selection(self, name="model_selection.dat"):
+        """
+        Save the model selection to a text file
+        """
+        self.zapper.save(name=self.path(name))
+        return name
+
+    def load_selection(self, name="model_selection.dat"):
+        """
+        Load the model selection from a text file
+        """
+        self.zapper.load(name=self.path(name))
+        return len(self.zapper.model_selection)
+
+    def export_state(self, name="filtered.state", selection=None):
+        """
+        Write a new state file including only the selected models (in the background; see
+        Zapp.start_export)
+        """
+        self.zapper.start_export(self.path(name), selection=self._indices(selection))
+        return name
+
+
+class ZappClient(object):
+    """
+    Minimal client for a ZappServer; any attribute is a remote method call
+    """
+    def __init__(self, host='127.0.0.1', port=8722, token=None):
+        self.url = "http://{}:{}/".format(host, port)
+        self.token = token or os.environ.get('ZAPP_TOKEN', '')
+        self._id = 0
+
+    def _post(self, payload):
+        data = json.dumps(payload).encode('utf-8')
+        req = urlrequest.Request(self.url, data, {'Content-Type': 'application/json',
+                                                  'X-Zapp-Token': self.token})
+        body = urlrequest.urlopen(req).read()
+        return json.loads(body.decode('utf-8')) if body else None
+
+    def _request(self, method, params):
+        self._id += 1
+        return {'jsonrpc': '2.0', 'method': method, 'params': params, 'id': self._id}
+
+    @staticmethod
+    def _result(response):
+        if 'error' in response:
+            raise RPCError(response['error']['code'], response['error']['message'])
+        return response['result']
+
+    def call(self, method, *args, **kwargs):
+        """
+        Call a remote method
+
+        Args:
+            method <str> - name of the remote method
+            *args - positional parameters
+
+        Kwargs:
+            **kwargs - named parameters (cannot be mixed with positional parameters)
+
+        Return:
+            result - the result of the remote call
+        """
+        return self._result(self._post(self._request(method, kwargs or list(args))))
+
+    def batch(self, calls):
+        """
+        Call several remote methods in a single request (and a single render)
+
+        Args:
+            calls <list(tuple)> - list of (method, params) pairs
+
+        Kwargs:
+            None
+
+        Return:
+            results <list> - the results in the order of the calls
+        """
+        requests = [self._request(m, p) for m, p in calls]
+        responses = dict((r['id'], r) for r in self._post(requests))
+        return [self._result(responses[r['id']]) for r in requests]
+
+    def image(self):
+        """
+        The currently rendered image as PNG bytes
+        """
+        return base64.b64decode(self.call('image'))
+
+    def __getattr__(self, method):
+        if method.startswith('_'):
+            raise AttributeError(method)
+        return lambda *args, **kwargs: self.call(method, *args, **kwargs)
@@ -0,0 +1,745 @@
+"""
+@author: phdenzel
+
+Columnar sidecar index (<gls.state>.zidx) holding per-model, per-lens summaries of a GLASS state,
+so models can be filtered and selected without loading the (heavy) state itself
+
+Usage:
+    python sidecar.py [--obj 0] [--H0 min,max] [-o model_selection.dat] gls.state
+"""
+import sys
+import os
+import re
+import ast
+import getopt
+import numbers
+import operator
+import hashlib
+import warnings
+import numpy as np
+
+
+EXT = '.zidx'
+VERSION = 1
+
+# operators and functions allowed in filter expressions (see ZIndex.select)
+_MAX_POWER_BITS = 4096  # size bound of exact integer powers
+_BINOPS = {ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul,
+           ast.Div: operator.truediv, ast.FloorDiv: operator.floordiv, ast.Mod: operator.mod,
+           ast.Pow: lambda a, b: _power(a, b), ast.BitAnd: operator.and_, ast.BitOr: operator.or_,
+           ast.BitXor: operator.xor}
+_UNARYOPS = {ast.USub: operator.neg, ast.UAdd: operator.pos, ast.Invert: operator.invert,
+             ast.Not: np.logical_not}
+_CMPOPS = {ast.Eq: operator.eq, ast.NotEq: operator.ne, ast.Lt: operator.lt,
+           ast.LtE: operator.le, ast.Gt: operator.gt, ast.GtE: operator.ge}
+_FUNCS = dict((f, getattr(np, f)) for f in ['abs', 'log', 'log10', 'sqrt', 'exp', 'isfinite',
+                                             'isnan', 'minimum', 'maximum', 'any', 'all'])
+
+# multipliers of the splitmix64 finalizer (fingerprint avalanche)
+_MIX = (np.uint64(0xbf58476d1ce4e5b9), np.uint64(0x94d049bb133111eb))
+
+
+def index_name(state_file):
+    """
+    File name of the sidecar index belonging to a state file
+    """
+    if os.path.isdir(state_file):  # columnar store (see store.py)
+        return os.path.join(state_file, 'index'+EXT)
+    return state_file + EXT
+
+
+def checksum(filename, blocksize=1 << 22):
+    """
+    SHA1 checksum of a file
+
+    Args:
+        filename <str> - path to the file
+
+    Kwargs:
+        blocksize <int> - number of bytes read at once
+
+    Return:
+        checksum <str> - hex digest of the file content
+    """
+    sha = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        block = f.read(blocksize)
+        while block:
+            sha.update(block)
+            block = f.read(blocksize)
+    return sha.hexdigest()
+
+
+def signature(filename):
+    """
+    Cheap file signature (size, modification time) used to skip checksumming unchanged files
+    """
+    stat = os.stat(filename)
+    return stat.st_size, stat.st_mtime
+
+
+def pad_stack(rows, dtype=np.float64):
+    """
+    Stack ragged rows into a 2D array, padded with NaNs
+
+    Args:
+        rows <list(array-like)> - rows of possibly different lengths
+
+    Kwargs:
+        dtype <type> - data type of the stack
+
+    Return:
+        stack <np.ndarray> - array of shape (len(rows), max row length)
+    """
+    rows = [np.ravel(np.asarray(r, dtype=dtype)) if r is not None else np.empty(0)
+            for r in rows]
+    width = max([len(r) for r in rows]) if rows else 0
+    stack = np.full((len(rows), width), np.nan, dtype=dtype)
+    for i, r in enumerate(rows):
+        stack[i, :len(r)] = r
+    return stack
+
+
+def einstein_radius(R, kappa_enc):
+    """
+    Einstein radii where the enclosed convergence drops to unity (linearly interpolated)
+
+    Args:
+        R <np.ndarray> - radii of shape (N_models, N_bins) or (N_bins,)
+        kappa_enc <np.ndarray> - enclosed convergence kappa(<R) of shape (N_models, N_bins)
+
+    Kwargs:
+        None
+
+    Return:
+        R_E <np.ndarray> - Einstein radii of shape (N_models,); NaN if kappa(<R) never crosses 1
+    """
+    kappa_enc = np.atleast_2d(kappa_enc)
+    R = np.broadcast_to(R, kappa_enc.shape)
+    above = kappa_enc >= 1
+    crossing = above[:, :-1] & ~above[:, 1:]
+    has_crossing = np.any(crossing, axis=1)
+    j = np.argmax(crossing, axis=1)
+    rows = np.arange(kappa_enc.shape[0])
+    k0, k1 = kappa_enc[rows, j], kappa_enc[rows, j+1]
+    r0, r1 = R[rows, j], R[rows, j+1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        R_E = r0 + (k0 - 1) * (r1 - r0) / (k0 - k1)
+    R_E[~has_crossing] = np.nan
+    return R_E
+
+
+def log_slope(R, profile):
+    """
+    Logarithmic slopes d ln(profile) / d ln(R) by least-squares fits in log-log space
+
+    Args:
+        R <np.ndarray> - radii of shape (N_models, N_bins) or (N_bins,)
+        profile <np.ndarray> - profiles, e.g. kappa(R), of shape (N_models, N_bins)
+
+    Kwargs:
+        None
+
+    Return:
+        slope <np.ndarray> - slopes of shape (N_models,); NaN with less than two positive bins
+    """
+    profile = np.atleast_2d(profile)
+    R = np.broadcast_to(R, profile.shape)
+    w = (R > 0) & (profile > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x = np.where(w, np.log(np.where(w, R, 1)), 0)
+        y = np.where(w, np.log(np.where(w, profile, 1)), 0)
+        n = w.sum(axis=1)
+        sx, sy = x.sum(axis=1), y.sum(axis=1)
+        slope = (n*(x*y).sum(axis=1) - sx*sy) / (n*(x*x).sum(axis=1) - sx**2)
+    slope[n < 2] = np.nan
+    return slope
+
+
+def mix64(h):
+    """
+    Avalanche of uint64 hashes (splitmix64 finalizer; the products wrap modulo 2**64)
+    """
+    h = h ^ (h >> np.uint64(30))
+    h = h * _MIX[0]
+    h = h ^ (h >> np.uint64(27))
+    h = h * _MIX[1]
+    return h ^ (h >> np.uint64(31))
+
+
+def fingerprints(env, tol=1e-5, chunk_size=4096):
+    """
+    Content fingerprints of the models: 64-bit hashes of the kappa maps of all lenses, quantized
+    to a tolerance, so identical models (e.g. after merging chains) share a fingerprint in any
+    state; each chunk of maps is hashed at once as a random linear form of the quantized pixels
+
+    Args:
+        env <glass.Environment object> - the glass state
+
+    Kwargs:
+        tol <float> - quantization step of the kappa values
+        chunk_size <int> - number of models hashed at once
+
+    Return:
+        fingerprints <np.ndarray> - uint64 fingerprints of shape (N_models,)
+    """
+    import ensemble  # (ensemble -> store -> sidecar)
+    N = len(env.models)
+    h = np.zeros(N, dtype=np.uint64)
+    N_obj = len(env.models[0]['obj,data']) if N else 0
+    for k in range(N_obj):
+        weights = None
+        for idcs, K in ensemble.iter_stack(env, 'kappa', k, chunk_size=chunk_size):
+            K = np.asarray(K, dtype=np.float64).reshape(len(idcs), -1)
+            if weights is None:  # fixed seed: fingerprints are comparable across states
+                weights = np.random.RandomState(k).randint(
+                    0, 2**63, size=K.shape[1], dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+            q = np.rint(K / tol).astype(np.int64).view(np.uint64)
+            lens_h = mix64((q * weights).sum(axis=1, dtype=np.uint64))
+            h[idcs] = mix64(h[idcs] ^ (lens_h + np.uint64(k)))
+    return h
+
+
+def duplicate_groups(fingerprints):
+    """
+    Groups of models with identical fingerprints (one sort of the fingerprints)
+
+    Args:
+        fingerprints <np.ndarray> - model fingerprints of shape (N_models,)
+
+    Kwargs:
+        None
+
+    Return:
+        groups <list(np.ndarray)> - ascending model indices of each group of duplicates
+    """
+    fingerprints = np.asarray(fingerprints)
+    order = np.argsort(fingerprints, kind='mergesort')
+    bounds = np.flatnonzero(np.diff(fingerprints[order]) != 0) + 1
+    starts = np.concatenate([[0], bounds])
+    ends = np.concatenate([bounds, [len(order)]])
+    duplicate = ends - starts > 1
+    return [order[a:b] for a, b in zip(starts[duplicate], ends[duplicate])]
+
+
+def kappa_slope(env, obj_index=0):
+    """
+    Logarithmic slopes of the kappa(R) profiles of all models of a lens
+
+    Args:
+        env <glass.Environment object> - the glass state
+
+    Kwargs:
+        obj_index <int> - index of the lens object
+
+    Return:
+        slope <np.ndarray> - slopes of shape (N_models,)
+    """
+    import ensemble  # (ensemble -> store -> sidecar)
+    profiles = ensemble.radial_profiles(env, obj_index)
+    return log_slope(profiles.R, profiles.stack('kappa(R)'))
+
+
+def summarize(env):
+    """
+    Gather the summary columns of all models in a GLASS state
+
+    Args:
+        env <glass.Environment object> - the glass state
+
+    Kwargs:
+        None
+
+    Return:
+        columns <dict(np.ndarray)> - summary columns; per-lens columns are keyed '<name>:<obj_index>'
+    """
+    models = env.models
+    columns = {}
+    columns['accepted'] = np.array([m.get('accepted', 2) for m in models], dtype=np.int8)
+    N_obj = len(models[0]['obj,data']) if models else 0
+    for k in range(N_obj):
+        datas = [m['obj,data'][k][1] for m in models]
+        columns['H0:{}'.format(k)] = np.array(
+            [d.get('H0', np.nan) if d else np.nan for d in datas], dtype=np.float64)
+        columns['time delays:{}'.format(k)] = pad_stack(
+            [np.concatenate([np.ravel(t) for t in d['time delays']])
+             if d and len(d.get('time delays', [])) else None for d in datas])
+        kappa = [np.asarray(d['kappa']) if d and 'kappa' in d else np.empty(0) for d in datas]
+        for stat, func in [('mean', np.mean), ('min', np.min),
+                           ('max', np.max), ('std', np.std)]:
+            columns['kappa_{}:{}'.format(stat, k)] = np.array(
+                [func(x) if x.size else np.nan for x in kappa], dtype=np.float64)
+        if datas and datas[0] and 'kappa(<R)' in datas[0] and 'R' in datas[0]:
+            R = pad_stack([d['R']['arcsec'] for d in datas])
+            kenc = pad_stack([d['kappa(<R)'] for d in datas])
+            columns['einstein_radius:{}'.format(k)] = einstein_radius(R, kenc)
+        elif datas and datas[0] and 'kappa' in datas[0]:
+            import ensemble  # (ensemble -> store -> sidecar)
+            profiles = ensemble.radial_profiles(env, k)
+            kenc = profiles.stack('kappa(<R)')
+            columns['einstein_radius:{}'.format(k)] = einstein_radius(
+                np.broadcast_to(profiles.R, kenc.shape), kenc)
+        else:
+            columns['einstein_radius:{}'.format(k)] = np.full(len(models), np.nan)
+        if datas and datas[0] and 'kappa' in datas[0]:
+            columns['kappa_slope:{}'.format(k)] = kappa_slope(env, k)
+        else:
+            columns['kappa_slope:{}'.format(k)] = np.full(len(models), np.nan)
+    if models and all([d and 'kappa' in d for _, d in models[0]['obj,data']]):
+        columns['fingerprint'] = fingerprints(env)
+    return columns
+
+
+class ZIndex(object):
+    """
+    Columnar summary index of a GLASS state
+    """
+    def __init__(self, columns, source=None):
+        """
+        Initialize with the summary columns
+
+        Args:
+            columns <dict(np.ndarray)> - summary columns (see summarize)
+
+        Kwargs:
+            source <dict> - provenance of the state file (name, size, mtime, sha1)
+
+        Return:
+            <ZIndex object> - standard initializer
+        """
+        self.columns = dict(columns)
+        self.source = dict(source) if source else {}
+        self.filename = None
+
+    def __str__(self):
+        return "{}({}, {} models x {} lenses)".format(
+            self.__class__.__name__, self.source.get('name', None),
+            self.N_models, self.N_objects)
+
+    def __repr__(self):
+        return self.__str__()
+
+    @classmethod
+    def build(cls, env, state_file=None):
+        """
+        Build the index of a loaded GLASS state
+
+        Args:
+            env <glass.Environment object> - the glass state
+
+        Kwargs:
+            state_file <str> - the state file the environment was loaded from
+
+        Return:
+            zidx <ZIndex object> - the index
+        """
+        source = {}
+        if state_file is not None and os.path.isfile(state_file):
+            size, mtime = signature(state_file)
+            source = {'name': os.path.basename(state_file), 'size': size,
+                      'mtime': mtime, 'sha1': checksum(state_file)}
+        return cls(summarize(env), source=source)
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Load an index file
+
+        Args:
+            filename <str> - path to the .zidx file
+
+        Kwargs:
+            None
+
+        Return:
+            zidx <ZIndex object> - the index
+        """
+        with np.load(filename) as npz:
+            columns = dict((k, npz[k]) for k in npz.files if not k.startswith('__'))
+            source = dict((k[len('__source_'):], npz[k].item())
+                          for k in npz.files if k.startswith('__source_'))
+        zidx = cls(columns, source=source)
+        zidx.filename = filename
+        return zidx
+
+    def save(self, filename):
+        """
+        Save the index as compressed .npz archive
+
+        Args:
+            filename <str> - path to the .zidx file
+
+        Kwargs/Return:
+            None
+        """
+        arrays = dict(self.columns)
+        arrays['__version'] = np.array(VERSION)
+        for k, v in self.source.items():
+            arrays['__source_'+k] = np.array(v)
+        # write through a file object so that numpy doesn't append '.npz'
+        with open(filename, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+        self.filename = filename
+
+    def update(self, **columns):
+        """
+        Add or replace columns (and write them through to the index file, if any)
+
+        Args/Return:
+            None
+
+        Kwargs:
+            **columns <np.ndarray> - columns of length N_models
+        """
+        self.columns.update(columns)
+        if self.filename is not None:
+            try:
+                self.save(self.filename)
+            except (IOError, OSError) as e:
+                warnings.warn("Could not update {}: {}".format(self.filename, e))
+
+    def valid_for(self, state_file):
+        """
+        Test whether the index belongs to the (unchanged) state file
+
+        Args:
+            state_file <str> - path to the state file
+
+        Kwargs:
+            None
+
+        Return:
+            valid <bool> - True if the state file matches the recorded source
+        """
+        if not self.source or not os.path.exists(state_file):
+            return False
+        size, mtime = signature(state_file)
+        if size != self.source.get('size'):
+            return False
+        if mtime == self.source.get('mtime'):
+            return True
+        return checksum(state_file) == self.source.get('sha1')
+
+    @property
+    def N_models(self):
+        return len(self.columns.get('accepted', []))
+
+    @property
+    def N_objects(self):
+        return len([k for k in self.columns if k.startswith('H0:')])
+
+    def column(self, name, obj_index=None):
+        """
+        Get a summary column
+
+        Args:
+            name <str> - column name, e.g. 'H0', 'accepted', 'einstein_radius', 'kappa_max'
+
+        Kwargs:
+            obj_index <int> - lens object index for per-lens columns
+
+        Return:
+            column <np.ndarray> - the column of length N_models
+        """
+        if obj_index is not None and '{}:{}'.format(name, obj_index) in self.columns:
+            return self.columns['{}:{}'.format(name, obj_index)]
+        return self.columns[name]
+
+    def names(self, obj_index=0):
+        """
+        Names of all columns available for a lens object
+        """
+        suffix = ':{}'.format(obj_index)
+        return sorted([k[:-len(suffix)] if k.endswith(suffix) else k
+                       for k in self.columns if ':' not in k or k.endswith(suffix)])
+
+    def fingerprints(self, env=None):
+        """
+        Content fingerprints of the models (see fingerprints); computed from the state and
+        added to the index if missing
+
+        Args:
+            None
+
+        Kwargs:
+            env <glass.Environment object> - the indexed glass state
+
+        Return:
+            fingerprints <np.ndarray> - uint64 fingerprints of shape (N_models,)
+        """
+        if 'fingerprint' not in self.columns:
+            if env is None:
+                raise KeyError("The index holds no fingerprints")
+            self.update(fingerprint=fingerprints(env))
+        return self.columns['fingerprint']
+
+    def H0_dist(self, obj_index=0, key='accepted'):
+        """
+        The Hubble rate distribution of the accepted models (cf. Zapp.H0_dist)
+
+        Args:
+            None
+
+        Kwargs:
+            obj_index <int> - lens object index
+            key <str> - model selector key
+
+        Return:
+            dist <np.ndarray> - distribution of the model's Hubble rate
+        """
+        H0 = self.column('H0', obj_index)
+        dist = H0[(self.column(key) == 1) & np.isfinite(H0)]
+        if dist.size:
+            return dist
+        return np.zeros(1)
+
+    def H0filter(self, H0_min, H0_max, obj_index=0):
+        """
+        Indices of the models lying within a range of Hubble rates (cf. Zapp.H0filter)
+
+        Args:
+            H0_min <float> - lower limit
+            H0_max <float> - upper limit
+
+        Kwargs:
+            obj_index <int> - lens object index
+
+        Return:
+            indices <np.ndarray> - model indices
+        """
+        H0 = self.column('H0', obj_index)
+        return np.flatnonzero((H0 >= H0_min) & (H0 <= H0_max))
+
+    def select(self, expression, obj_index=0):
+        """
+        Indices of the models satisfying a filter expression over the summary columns
+
+        Args:
+            expression <str> - numpy expression of the columns (non-word characters in the
+                               names replaced by '_'), e.g. '(H0 > 60) & (H0 < 80) & accepted';
+                               see evaluate for what is allowed
+
+        Kwargs:
+            obj_index <int> - lens object index for per-lens columns
+
+        Return:
+            indices <np.ndarray> - model indices
+
+        Raises:
+            ValueError - if the expression is invalid or not allowed
+        """
+        namespace = {}
+        for name in self.names(obj_index):
+            namespace[re.sub(r'\W', '_', name)] = self.column(name, obj_index)
+        mask = evaluate(expression, namespace)
+        mask = np.broadcast_to(np.asarray(mask, dtype=bool), (self.N_models,))
+        return np.flatnonzero(mask)
+
+
+def evaluate(expression, namespace):
+    """
+    Evaluate a filter expression over the columns by walking its syntax tree; only names of
+    the namespace, numbers, arithmetic, comparisons, logical operators, indexing with
+    constants, and a few numpy functions (e.g. abs, log10, isfinite, also as np.<func>)
+    are allowed
+
+    Args:
+        expression <str> - the filter expression, e.g. '(H0 > 60) & (H0 < 80) & accepted'
+        namespace <dict(np.ndarray)> - the columns
+
+    Kwargs:
+        None
+
+    Return:
+        value <np.ndarray> - the value of the expression
+
+    Raises:
+        ValueError - if the expression is invalid or uses anything else
+    """
+    try:
+        tree = ast.parse(expression.strip(), mode='eval')
+    except SyntaxError as e:
+        raise ValueError("Invalid filter expression {!r}: {}".format(expression, e))
+    return _evaluate(tree.body, namespace)
+
+
+def _constant(node):
+    if type(node).__name__ in ('Constant', 'NameConstant', 'Num'):
+        value = getattr(node, 'value', getattr(node, 'n', None))
+        if isinstance(value, (bool, int, float)):
+            return value
+    elif isinstance(node, ast.Name) and node.id in ('True', 'False'):  # py2
+        return node.id == 'True'
+    raise ValueError("Not allowed in filter expressions: {}".format(type(node).__name__))
+
+
+def _power(base, exponent):
+    """
+    Power of the filter expressions; exact integer powers are bounded in size, so that
+    e.g. 10**10**10 fails instead of hanging
+    """
+    if isinstance(base, numbers.Integral) and isinstance(exponent, numbers.Integral) \
+       and abs(int(exponent)) * max(abs(int(base)).bit_length(), 1) > _MAX_POWER_BITS:
+        raise ValueError("Power too large in filter expression: {}**{}".format(base, exponent))
+    return operator.pow(base, exponent)
+
+
+def _evaluate(node, namespace):
+    if isinstance(node, ast.BoolOp):
+        func = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+        values = [_evaluate(v, namespace) for v in node.values]
+        result = values[0]
+        for v in values[1:]:
+            result = func(result, v)
+        return result
+    if isinstance(node, ast.BinOp) and type(node.op) in _BINOPS:
+        return _BINOPS[type(node.op)](_evaluate(node.left, namespace),
+                                      _evaluate(node.right, namespace))
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARYOPS:
+        return _UNARYOPS[type(node.op)](_evaluate(node.operand, namespace))
+    if isinstance(node, ast.Compare) and all([type(op) in _CMPOPS for op in node.ops]):
+        left, result = _evaluate(node.left, namespace), True
+        for op, comparator in zip(node.ops, node.comparators):
+            right = _evaluate(comparator, namespace)
+            result = np.logical_and(result, _CMPOPS[type(op)](left, right))
+            left = right
+        return result
+    if isinstance(node, ast.Name) and node.id in namespace:
+        return namespace[node.id]
+    if isinstance(node, ast.Subscript):
+        return _evaluate(node.value, namespace)[_subscript(node.slice)]
+    if isinstance(node, ast.Call) and not getattr(node, 'starargs', None) \
+       and not getattr(node, 'kwargs', None):
+        func = node.func
+        if isinstance(func, ast.Attribute) and isinstance(func.value, ast.Name) \
+           and func.value.id == 'np':
+            func = func.attr
+        elif isinstance(func, ast.Name):
+            func = func.id
+        if func in _FUNCS and all([k.arg == 'axis' for k in node.keywords]):
+            args = [_evaluate(a, namespace) for a in node.args]
+            kwargs = dict((k.arg, _constant(k.value)) for k in node.keywords)
+            return _FUNCS[func](*args, **kwargs)
+        raise ValueError("Function not allowed in filter expressions: {}".format(
+            func if isinstance(func, str) else type(func).__name__))
+    if isinstance(node, ast.Name):
+        try:
+            return _constant(node)
+        except ValueError:
+            raise ValueError("Unknown column in filter expression: {}".format(node.id))
+    return _constant(node)
+
+
+def _subscript(node):
+    if type(node).__name__ == 'Index':  # py < 3.9
+        return _subscript(node.value)
+    if isinstance(node, ast.Slice):
+        return slice(*[None if n is None else int(_subscript(n))
+                       for n in (node.lower, node.upper, node.step)])
+    if isinstance(node, ast.Tuple) or type(node).__name__ == 'ExtSlice':
+        return tuple([_subscript(n) for n in getattr(node, 'elts', getattr(node, 'dims', []))])
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+        return -_subscript(node.operand)
+    if type(node).__name__ == 'Ellipsis' or getattr(node, 'value', None) is Ellipsis:
+        return Ellipsis
+    value = _constant(node)
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError("Only integer indices are allowed in filter expressions")
+    return value
+
+
+def load_index(state_file, verify=True):
+    """
+    Load the sidecar index of a state file without touching the state
+
+    Args:
+        state_file <str> - path to the state file
+
+    Kwargs:
+        verify <bool> - check that the index still matches the state file
+
+    Return:
+        zidx <ZIndex object> - the index; None if missing or stale
+    """
+    filename = index_name(state_file)
+    if not os.path.exists(filename):
+        return None
+    try:
+        zidx = ZIndex.load(filename)
+    except (IOError, OSError, ValueError, KeyError):
+        return None
+    if verify and os.path.isfile(state_file) and not zidx.valid_for(state_file):
+        return None
+    return zidx
+
+
+def index(env, state_file=None, rebuild=False):
+    """
+    Get the index of a loaded state; read from its sidecar file if valid, otherwise built
+    and written once next to the state file
+
+    Args:
+        env <glass.Environment object> - the glass state
+
+    Kwargs:
+        state_file <str> - the state file the environment was loaded from
+        rebuild <bool> - force rebuilding the index
+
+    Return:
+        zidx <ZIndex object> - the index
+    """
+    if state_file is None:
+        return ZIndex.build(env)
+    zidx = None if rebuild else load_index(state_file)
+    if zidx is None or zidx.N_models != len(env.models):
+        zidx = ZIndex.build(env, state_file)
+        try:
+            zidx.save(index_name(state_file))
+        except (IOError, OSError) as e:
+            warnings.warn("Could not write {}: {}".format(index_name(state_file), e))
+    return zidx
+
+
+def help():
+    print("Usage: sidecar.py [--obj index] [--H0 min,max] [-o output] <gls.state>")
+    sys.exit(2)
+
+
+if __name__ == "__main__":
+
+    try:
+        optlist, args = getopt.getopt(sys.argv[1:], 'ho:', ['help', 'obj=', 'H0=', 'output='])
+    except getopt.GetoptError:
+        help()
+    obj_index, H0_range, output = 0, None, None
+    for o, a in optlist:
+        if o in ('-h', '--help'):
+            help()
+        elif o == '--obj':
+            obj_index = int(a)
+        elif o == '--H0':
+            H0_range = tuple(float(h) for h in a.split(','))
+        elif o in ('-o', '--output'):
+            output = a
+    if len(args) != 1:
+        help()
+
+    state_file = args[0]
+    zidx = load_index(state_file)
+    if zidx is None:
+        print("No valid index for {}; build it with 'modelzapper.py --index {}'".format(
+            state_file, state_file))
+        sys.exit(1)
+    print(zidx)
+    dist = zidx.H0_dist(obj_index)
+    print("H0 (accepted): {:.2f} +/- {:.2f} km/s/Mpc  [{:.2f}, {:.2f}]".format(
+        np.mean(dist), np.std(dist), np.min(dist), np.max(dist)))
+    if H0_range is not None:
+        selection = zidx.H0filter(H0_range[0], H0_range[1], obj_index=obj_index)
+        print("{} models with {} <= H0 <= {}".format(len(selection), *H0_range))
+        if output:
+            fp = zidx.columns.get('fingerprint')
+            with open(output, "w") as f:
+                f.write("".join(["# ", os.path.basename(state_file), "\n"]))
+                f.write("\n".join([str(i) if fp is None else "{}\t{:016x}".format(i, fp[i])
+                                   for i in selection]))
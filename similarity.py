@@ -0,0 +1,334 @@
+"""
+@author: phdenzel
+
+Nearest-neighbour similarity index over the kappa maps of a GLASS ensemble
+
+The flattened per-model kappa vectors are reduced with a randomized PCA (fitted on a random
+sample of models), projected chunk by chunk, and put into a KD-tree. The index is built in
+a background thread and can already be queried (brute force) while it is being built.
+"""
+import threading
+import numpy as np
+from scipy.spatial import cKDTree
+
+import ensemble
+
+
+def randomized_pca(X, n_components, n_oversamples=10, n_iter=2, random_state=None):
+    """
+    Principal axes of a data matrix with a randomized SVD (Halko, Martinsson & Tropp 2011)
+
+    Args:
+        X <np.ndarray> - data matrix of shape (N_samples, N_features)
+        n_components <int> - number of principal axes
+
+    Kwargs:
+        n_oversamples <int> - additional random vectors for the range finder
+        n_iter <int> - number of power iterations
+        random_state <np.random.RandomState object> - random number generator
+
+    Return:
+        mean <np.ndarray> - the feature means of shape (N_features,)
+        components <np.ndarray> - principal axes of shape (n_components, N_features)
+    """
+    rs = random_state or np.random.RandomState(0)
+    mean = X.mean(axis=0)
+    Xc = X - mean
+    n_random = min(n_components + n_oversamples, min(Xc.shape))
+    Q = Xc.dot(rs.normal(size=(Xc.shape[1], n_random)))
+    Q, _ = np.linalg.qr(Q)
+    for _ in range(n_iter):
+        Q, _ = np.linalg.qr(Xc.T.dot(Q))
+        Q, _ = np.linalg.qr(Xc.dot(Q))
+    B = Q.T.dot(Xc)
+    _, _, Vt = np.linalg.svd(B, full_matrices=False)
+    return mean, Vt[:n_components]
+
+
+class SimilarityIndex(object):
+    """
+    Dimension-reduced KD-tree over the kappa maps of a lens
+    """
+    def __init__(self, env, obj_index=0, n_components=16, sample_size=2000,
+                 chunk_size=1024, seed=0):
+        """
+        Initialize the (not yet built) index
+
+        Args:
+            env <glass.Environment object> - the glass state
+
+        Kwargs:
+            obj_index <int> - index of the lens object
+            n_components <int> - dimension of the reduced space
+            sample_size <int> - number of models the PCA is fitted on
+            chunk_size <int> - number of models projected at once
+            seed <int> - seed of the random sampling
+
+        Return:
+            <SimilarityIndex object> - standard initializer
+        """
+        self.env = env
+        self.obj_index = obj_index
+        self.n_components = n_components
+        self.sample_size = sample_size
+        self.chunk_size = chunk_size
+        self.seed = seed
+        self.N = len(env.models)
+        self.mean = None
+        self.components = None
+        self.coords = None
+        self.n_done = 0
+        self.tree = None
+        self.thread = None
+        self.error = None
+
+    def __str__(self):
+        return "{}(lens {}, {}/{} models, dim {})".format(
+            self.__class__.__name__, self.obj_index, self.n_done, self.N, self.n_components)
+
+    def __repr__(self):
+        return self.__str__()
+
+    @property
+    def ready(self):
+        return self.tree is not None
+
+    @property
+    def progress(self):
+        return float(self.n_done) / max(self.N, 1)
+
+    def start(self):
+        """
+        Build the index in a background thread
+
+        Args/Kwargs:
+            None
+
+        Return:
+            self <SimilarityIndex object> - the index itself (for chaining)
+        """
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.build)
+            self.thread.daemon = True
+            self.thread.start()
+        return self
+
+    def build(self):
+        """
+        Fit the PCA, project all models chunk by chunk, and build the KD-tree
+
+        Args/Kwargs/Return:
+            None
+        """
+        try:
+            rs = np.random.RandomState(self.seed)
+            sample = np.sort(rs.choice(self.N, min(self.sample_size, self.N), replace=False))
+            X = ensemble.stack(self.env, 'kappa', self.obj_index, selection=sample)
+            mean, components = randomized_pca(
+                X.astype(np.float64), self.n_components, random_state=rs)
+            self.coords = np.empty((self.N, components.shape[0]), dtype=np.float32)
+            self.mean, self.components = mean, components
+            for idcs, chunk in ensemble.iter_stack(self.env, 'kappa', self.obj_index,
+                                                   chunk_size=self.chunk_size):
+                self.coords[idcs] = self.project(chunk)
+                self.n_done = idcs[-1] + 1
+            self.tree = cKDTree(self.coords)
+        except Exception as e:
+            self.error = e
+            raise
+
+    def project(self, kappa):
+        """
+        Project kappa vectors into the reduced space
+
+        Args:
+            kappa <np.ndarray> - kappa vectors of shape (N, N_pixels) or (N_pixels,)
+
+        Kwargs:
+            None
+
+        Return:
+            coords <np.ndarray> - reduced coordinates of shape (N, n_components)
+        """
+        return (np.atleast_2d(kappa) - self.mean).dot(self.components.T)
+
+    def query(self, index, k=10, threshold=None):
+        """
+        Find the models most similar to a model
+
+        Args:
+            index <int> - index of the reference model
+
+        Kwargs:
+            k <int> - maximal number of similar models
+            threshold <float> - maximal distance in the reduced space; default unlimited
+
+        Return:
+            indices <np.ndarray> - indices of the similar models, closest first
+            distances <np.ndarray> - their distances to the reference model
+        """
+        if self.components is None:
+            return np.empty(0, dtype=int), np.empty(0)
+        if index < self.n_done:
+            x = self.coords[index]
+        else:
+            kappa = self.env.models[index]['obj,data'][self.obj_index][1]['kappa']
+            x = self.project(kappa)[0]
+        bound = np.inf if threshold is None else threshold
+        if self.tree is not None:
+            d, idcs = self.tree.query(x, k=min(k+1, self.N), distance_upper_bound=bound)
+            d, idcs = np.atleast_1d(d), np.atleast_1d(idcs)
+            found = np.isfinite(d)
+            d, idcs = d[found], idcs[found]
+        else:  # brute force over the models projected so far
+            d = np.sqrt(np.sum((self.coords[:self.n_done] - x)**2, axis=1))
+            idcs = np.argsort(d)[:k+1]
+            idcs = idcs[d[idcs] <= bound]
+            d = d[idcs]
+        others = idcs != index
+        return idcs[others][:k], d[others][:k]
+
+
+class MiniBatchKMeans(object):
+    """
+    Streaming mini-batch k-means (Sculley 2010) over the kappa maps of a lens
+
+    Only one chunk of models and the cluster centers are held in memory at a time.
+    """
+    def __init__(self, env, obj_index=0, n_clusters=100, batch_size=1024, n_epochs=3, seed=0):
+        """
+        Initialize the (not yet fitted) clustering
+
+        Args:
+            env <glass.Environment object> - the glass state
+
+        Kwargs:
+            obj_index <int> - index of the lens object
+            n_clusters <int> - number of clusters
+            batch_size <int> - number of models per mini-batch
+            n_epochs <int> - number of passes over the ensemble
+            seed <int> - seed of the initial centers
+
+        Return:
+            <MiniBatchKMeans object> - standard initializer
+        """
+        self.env = env
+        self.obj_index = obj_index
+        self.N = len(env.models)
+        self.n_clusters = min(n_clusters, self.N)
+        self.batch_size = batch_size
+        self.n_epochs = n_epochs
+        self.seed = seed
+        self.centers = None
+        self.labels = None
+        self.medoids = None
+        self.n_done = 0
+        self.thread = None
+        self.error = None
+
+    def __str__(self):
+        return "{}(lens {}, {} clusters, {:.0%})".format(
+            self.__class__.__name__, self.obj_index, self.n_clusters, self.progress)
+
+    def __repr__(self):
+        return self.__str__()
+
+    @property
+    def ready(self):
+        return self.medoids is not None
+
+    @property
+    def progress(self):
+        return float(self.n_done) / max(self.N * (self.n_epochs + 1), 1)
+
+    def start(self):
+        """
+        Fit the clustering in a background thread
+
+        Args/Kwargs:
+            None
+
+        Return:
+            self <MiniBatchKMeans object> - the clustering itself (for chaining)
+        """
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.fit)
+            self.thread.daemon = True
+            self.thread.start()
+        return self
+
+    def _distances(self, X):
+        """
+        Squared distances of shape (N, n_clusters) between vectors and the cluster centers
+        """
+        cc = np.sum(self.centers**2, axis=1)
+        d = np.sum(X**2, axis=1)[:, None] - 2 * X.dot(self.centers.T) + cc[None, :]
+        return np.maximum(d, 0)
+
+    def fit(self):
+        """
+        Fit the cluster centers, then label all models and find the cluster medoids
+
+        Args/Kwargs/Return:
+            None
+        """
+        try:
+            rs = np.random.RandomState(self.seed)
+            init = np.sort(rs.choice(self.N, self.n_clusters, replace=False))
+            self.centers = ensemble.stack(self.env, 'kappa', self.obj_index,
+                                          selection=init).astype(np.float64)
+            counts = np.zeros(self.n_clusters)
+            for epoch in range(self.n_epochs):
+                order = rs.permutation(self.N)
+                for start in range(0, self.N, self.batch_size):
+                    batch = np.sort(order[start:start+self.batch_size])
+                    X = ensemble.stack(self.env, 'kappa', self.obj_index, selection=batch)
+                    labels = np.argmin(self._distances(X), axis=1)
+                    n = np.bincount(labels, minlength=self.n_clusters).astype(np.float64)
+                    sums = np.zeros_like(self.centers)
+                    np.add.at(sums, labels, X)
+                    counts += n
+                    hit = n > 0
+                    # per-sample learning rates 1/count, applied in batch
+                    self.centers[hit] += (sums[hit] - n[hit, None] * self.centers[hit]) \
+                        / counts[hit, None]
+                    self.n_done += len(batch)
+            labels = np.empty(self.N, dtype=int)
+            best = np.full(self.n_clusters, np.inf)
+            medoids = np.full(self.n_clusters, -1, dtype=int)
+            for idcs, X in ensemble.iter_stack(self.env, 'kappa', self.obj_index,
+                                               chunk_size=self.batch_size):
+                d = self._distances(X)
+                lbl = np.argmin(d, axis=1)
+                dmin = d[np.arange(len(idcs)), lbl]
+                labels[idcs] = lbl
+                for c in np.unique(lbl):
+                    w = np.flatnonzero(lbl == c)
+                    j = w[np.argmin(dmin[w])]
+                    if dmin[j] < best[c]:
+                        best[c] = dmin[j]
+                        medoids[c] = idcs[j]
+                self.n_done += len(idcs)
+            self.labels = labels
+            self.medoids = medoids
+        except Exception as e:
+            self.error = e
+            raise
+
+    def cluster(self, index):
+        """
+        Cluster label of a model
+        """
+        return self.labels[index]
+
+    def members(self, cluster):
+        """
+        Indices of all models in a cluster
+        """
+        return np.flatnonzero(self.labels == cluster)
+
+    def sizes(self):
+        """
+        Number of models in each cluster
+        """
+        return np.bincount(self.labels, minlength=self.n_clusters)
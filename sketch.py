@@ -0,0 +1,225 @@
+"""
+@author: phdenzel
+
+Streaming quantile sketches of the radial profiles (kappa(R), kappa(<R)) of an ensemble
+
+Each radial bin holds a fixed-grid histogram of the profile values (log-spaced for positive
+profiles), which is updated chunk by chunk in a single vectorized pass, merged by adding
+counts, and updated exactly when models are added to or removed from a selection. Error bands
+are read off the cumulative counts, so they cost O(N_R x N_bins) regardless of the number of
+models.
+"""
+import numpy as np
+
+import ensemble
+
+
+class QuantileSketch(object):
+    """
+    Mergeable histogram sketches of the value distributions in several (radial) bins
+    """
+    def __init__(self, lo, hi, n_bins=512, log=None):
+        """
+        Initialize an empty sketch
+
+        Args:
+            lo <np.ndarray> - lower value limits of each radial bin of shape (N_R,)
+            hi <np.ndarray> - upper value limits of each radial bin of shape (N_R,)
+
+        Kwargs:
+            n_bins <int> - number of value bins per radial bin
+            log <bool> - log-spaced value bins; default if all lower limits are positive
+
+        Return:
+            <QuantileSketch object> - standard initializer
+        """
+        lo, hi = np.asarray(lo, dtype=np.float64), np.asarray(hi, dtype=np.float64)
+        self.log = bool(np.all(lo > 0)) if log is None else log
+        if self.log:
+            lo, hi = np.log(lo), np.log(hi)
+        self.lo = lo
+        self.width = np.where(hi > lo, hi - lo, 1.) / n_bins
+        self.n_bins = n_bins
+        self.counts = np.zeros((len(lo), n_bins), dtype=np.int64)
+
+    def __str__(self):
+        return "{}({} models, {} radial bins)".format(
+            self.__class__.__name__, self.n, len(self.lo))
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __iadd__(self, other):
+        self.merge(other)
+        return self
+
+    @property
+    def n(self):
+        return int(self.counts[0].sum()) if len(self.counts) else 0
+
+    def _bins(self, values):
+        """
+        Flat (radial bin, value bin) indices of profiles of shape (N, N_R)
+        """
+        values = np.atleast_2d(np.asarray(values, dtype=np.float64))
+        if self.log:
+            values = np.log(np.maximum(values, np.exp(self.lo)))
+        b = np.floor((values - self.lo) / self.width).astype(np.int64)
+        b = np.clip(b, 0, self.n_bins-1)
+        return (b + self.n_bins * np.arange(len(self.lo))).ravel()
+
+    def add(self, values, weight=1):
+        """
+        Add profiles to the sketch
+
+        Args:
+            values <np.ndarray> - profiles of shape (N, N_R)
+
+        Kwargs:
+            weight <int> - count of each profile; -1 removes them
+
+        Return:
+            None
+        """
+        if len(values) == 0:
+            return
+        counts = np.bincount(self._bins(values), minlength=self.counts.size)
+        self.counts += weight * counts.reshape(self.counts.shape)
+
+    def remove(self, values):
+        """
+        Remove profiles (previously added) from the sketch
+        """
+        self.add(values, weight=-1)
+
+    def merge(self, other):
+        """
+        Merge another sketch with the same binning into this one
+        """
+        if self.counts.shape != other.counts.shape or not np.allclose(self.lo, other.lo):
+            raise ValueError("Sketches with different binning cannot be merged")
+        self.counts += other.counts
+
+    def quantiles(self, q):
+        """
+        Quantiles of the distribution in each radial bin
+
+        Args:
+            q <list(float)> - quantiles in [0, 1]
+
+        Kwargs:
+            None
+
+        Return:
+            values <np.ndarray> - quantile values of shape (len(q), N_R); NaN if empty
+        """
+        q = np.atleast_1d(q)
+        cum = np.cumsum(self.counts, axis=1)
+        total = cum[:, -1].astype(np.float64)
+        out = np.full((len(q), len(self.lo)), np.nan)
+        rows = np.arange(len(self.lo))
+        for j, qj in enumerate(q):
+            target = qj * total
+            idx = np.argmax(cum >= target[:, None], axis=1)
+            prev = np.where(idx > 0, cum[rows, idx-1], 0)
+            frac = (target - prev) / np.maximum(self.counts[rows, idx], 1)
+            out[j] = self.lo + (idx + frac) * self.width
+        if self.log:
+            out = np.exp(out)
+        out[:, total == 0] = np.nan
+        return out
+
+
+class ProfileSketch(object):
+    """
+    Quantile sketches of a per-model profile of a lens over the ensemble and over selections
+    """
+    QUANTILES = [0.025, 0.16, 0.5, 0.84, 0.975]
+
+    def __init__(self, env, key='kappa(R)', obj_index=0, n_bins=512, chunk_size=4096):
+        """
+        Sketch the profiles of all models in a streaming pass
+
+        Args:
+            env <glass.Environment object> - the glass state
+
+        Kwargs:
+            key <str> - 'kappa(R)' or 'kappa(<R)' (see ensemble.RadialProfiles)
+            obj_index <int> - index of the lens object
+            n_bins <int> - number of value bins per radial bin
+            chunk_size <int> - number of models sketched at once
+
+        Return:
+            <ProfileSketch object> - standard initializer
+        """
+        self.env = env
+        self.key = key
+        self.obj_index = obj_index
+        self.chunk_size = chunk_size
+        self.N = len(env.models)
+        self.profiles = ensemble.radial_profiles(env, obj_index)
+        self.R = self.profiles.R
+        P = self.profiles.stack(key)
+        self.lo, self.hi, self.n_bins = P.min(axis=0), P.max(axis=0), n_bins
+        self.ensemble = self.empty()
+        for start in range(0, self.N, chunk_size):
+            self.ensemble.add(P[start:start+chunk_size])
+        self.selections = {}
+
+    def __str__(self):
+        return "{}({}, lens {}, {} models)".format(
+            self.__class__.__name__, self.key, self.obj_index, self.N)
+
+    def __repr__(self):
+        return self.__str__()
+
+    def empty(self):
+        """
+        An empty sketch with the binning of the ensemble sketch
+        """
+        return QuantileSketch(self.lo, self.hi, n_bins=self.n_bins)
+
+    def sketch(self, selection, name='selection'):
+        """
+        Sketch of a model selection, updated incrementally from the previous selection of the
+        same name (only added and removed models are sketched)
+
+        Args:
+            selection <list(int)> - model indices
+
+        Kwargs:
+            name <str> - name of the tracked selection
+
+        Return:
+            sketch <QuantileSketch object> - the sketch of the selection
+        """
+        selection = set(selection)
+        if len(selection) == self.N:
+            return self.ensemble
+        if name not in self.selections:
+            self.selections[name] = (self.empty(), set())
+        sk, members = self.selections[name]
+        for diff, weight in [(selection - members, 1), (members - selection, -1)]:
+            diff = sorted(diff)
+            for start in range(0, len(diff), self.chunk_size):
+                sk.add(self.profiles.stack(self.key, diff[start:start+self.chunk_size]),
+                       weight=weight)
+        self.selections[name] = (sk, selection)
+        return sk
+
+    def bands(self, selection=None, name='selection'):
+        """
+        Error bands (2.5, 16, 50, 84, 97.5 percentiles) of the profile
+
+        Args:
+            None
+
+        Kwargs:
+            selection <list(int)> - model indices; default all
+            name <str> - name of the tracked selection
+
+        Return:
+            quantiles <np.ndarray> - band limits of shape (5, N_R)
+        """
+        sk = self.ensemble if selection is None else self.sketch(selection, name=name)
+        return sk.quantiles(self.QUANTILES)
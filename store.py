@@ -0,0 +1,441 @@
+"""
+@author: phdenzel
+
+Columnar, chunked, compressed store (<name>.zstore) for GLASS states
+
+The per-model arrays of each lens (kappa, ...) are stacked into (N_models x N_pixels) arrays,
+split into row chunks, and compressed; scalar quantities are kept as columns in the sidecar
+index. Loading a store only reads the model-less GLASS skeleton; models are decompressed
+chunk-wise on access, which gives random access to any model.
+
+Layout:
+    <name>.zstore/skeleton.state     - the GLASS state without models but with its ensemble
+                                       average (loadable by glass)
+    <name>.zstore/index.zidx         - summary columns (see sidecar.py)
+    <name>.zstore/meta.npz           - number of models, chunk size, stacked array keys
+    <name>.zstore/chunk#####.npz     - stacked arrays and solutions of a chunk of models
+    <name>.zstore/chunk#####.pkl     - remaining (non-stacked) model content of a chunk
+
+Usage:
+    python modelzapper.py --convert gls.state    # writes gls.zstore
+    python modelzapper.py gls.zstore
+"""
+import sys
+import os
+import copy
+import collections
+import numpy as np
+if sys.version_info.major < 3:
+    import cPickle as pickle
+else:
+    import pickle
+
+import sidecar
+
+
+EXT = '.zstore'
+SKELETON = 'skeleton.state'
+META = 'meta.npz'
+
+
+def is_store(name):
+    """
+    Test whether a path points to a columnar store
+    """
+    return os.path.isdir(name) and os.path.exists(os.path.join(name, META))
+
+
+def store_name(state_file):
+    """
+    Default store name of a state file
+    """
+    return os.path.splitext(state_file)[0] + EXT
+
+
+def stacked_keys(models, obj_index):
+    """
+    Keys of the per-model data arrays which have the same shape in all models
+
+    Args:
+        models <list(dict)> - glass models
+        obj_index <int> - index of the lens object
+
+    Kwargs:
+        None
+
+    Return:
+        keys <list(str)> - sorted keys of the stackable arrays
+    """
+    datas = [m['obj,data'][obj_index][1] for m in models]
+    if not datas or not datas[0]:
+        return []
+    keys = []
+    for key, val in datas[0].items():
+        if not isinstance(val, np.ndarray) or val.dtype == object:
+            continue
+        if all([d and isinstance(d.get(key), np.ndarray) and d[key].shape == val.shape
+                for d in datas]):
+            keys.append(key)
+    return sorted(keys)
+
+
+def _chunk_name(c, ext):
+    return 'chunk{:05d}{}'.format(c, ext)
+
+
+def convert(env, name=None, state_file=None, chunk_size=128, verbose=False):
+    """
+    Convert a GLASS state into a columnar store
+
+    Args:
+        env <glass.Environment object> - the glass state
+
+    Kwargs:
+        name <str> - path of the store; default derived from state_file
+        state_file <str> - the state file the environment was loaded from
+        chunk_size <int> - number of models per compressed chunk
+        verbose <bool> - verbose mode; print command line statements
+
+    Return:
+        name <str> - path of the store
+    """
+    if name is None:
+        name = store_name(state_file or 'gls.state')
+    if not os.path.exists(name):
+        os.makedirs(name)
+    models = env.models
+    N = len(models)
+    N_obj = len(models[0]['obj,data']) if models else 0
+    keys = [stacked_keys(models, k) for k in range(N_obj)]
+
+    # skeleton (shallow copy, so the loaded environment stays untouched) with the ensemble
+    # average, so it doesn't have to be recomputed from all chunks when the store is opened
+    if getattr(env, 'ensemble_average', None) is None:
+        env.make_ensemble_average()
+    save_skeleton(env, name)
+
+    # summary columns
+    sidecar.ZIndex.build(env).save(os.path.join(name, 'index'+sidecar.EXT))
+
+    for c, start in enumerate(range(0, N, chunk_size)):
+        stop = min(start+chunk_size, N)
+        arrays = {}
+        for k in range(N_obj):
+            for j, key in enumerate(keys[k]):
+                arrays['{}.{}'.format(k, j)] = np.stack(
+                    [models[i]['obj,data'][k][1][key] for i in range(start, stop)])
+        if len(env.solutions) == N:
+            arrays['solutions'] = np.stack([np.asarray(env.solutions[i])
+                                            for i in range(start, stop)])
+        with open(os.path.join(name, _chunk_name(c, '.npz')), 'wb') as f:
+            np.savez_compressed(f, **arrays)
+        rest = []
+        for i in range(start, stop):
+            rest_model = _strip(models[i], keys)
+            accepted = env.accepted_models[i] if i < len(env.accepted_models) else None
+            if accepted is models[i]:
+                rest_accepted = True
+            elif accepted is None:
+                rest_accepted = None
+            else:
+                rest_accepted = _strip(accepted, keys)
+            rest.append((rest_model, rest_accepted))
+        with open(os.path.join(name, _chunk_name(c, '.pkl')), 'wb') as f:
+            pickle.dump(rest, f, pickle.HIGHEST_PROTOCOL)
+        if verbose:
+            print("Converted models {}-{}/{}".format(start, stop, N))
+
+    meta = {'N_models': np.array(N), 'chunk_size': np.array(chunk_size),
+            'N_objects': np.array(N_obj),
+            'has_solutions': np.array(len(env.solutions) == N)}
+    for k in range(N_obj):
+        meta['keys:{}'.format(k)] = np.array(keys[k], dtype=str)
+    with open(os.path.join(name, META), 'wb') as f:
+        np.savez(f, **meta)
+    return name
+
+
+def save_skeleton(env, name):
+    """
+    Write the model-less GLASS skeleton of a state (incl. its ensemble average) into a store
+
+    Args:
+        env <glass.Environment object> - the glass state
+        name <str> - path of the store
+
+    Kwargs:
+        None
+
+    Return:
+        None
+    """
+    skeleton = copy.copy(env)
+    skeleton.models = []
+    skeleton.accepted_models = []
+    skeleton.solutions = []
+    skeleton.savestate(os.path.join(name, SKELETON))
+
+
+def _strip(model, keys):
+    """
+    Copy of a model without lens objects and stacked arrays
+    """
+    rest = dict((k, v) for k, v in model.items() if k != 'obj,data')
+    rest['obj,data'] = [dict((key, val) for key, val in data.items() if key not in keys[k])
+                        if data else data
+                        for k, (obj, data) in enumerate(model['obj,data'])]
+    return rest
+
+
+class ZStore(object):
+    """
+    Reader for a columnar store with an LRU cache of decompressed chunks
+    """
+    def __init__(self, name, cache_size=16):
+        """
+        Open a columnar store
+
+        Args:
+            name <str> - path to the store
+
+        Kwargs:
+            cache_size <int> - number of decompressed chunks kept in memory
+
+        Return:
+            <ZStore object> - standard initializer
+        """
+        self.name = name
+        self.cache_size = cache_size
+        self._chunks = collections.OrderedDict()
+        with np.load(os.path.join(name, META)) as meta:
+            self.N_models = int(meta['N_models'])
+            self.chunk_size = int(meta['chunk_size'])
+            self.N_objects = int(meta['N_objects'])
+            self.has_solutions = bool(meta['has_solutions'])
+            self.keys = [[str(k) for k in meta['keys:{}'.format(i)]]
+                         for i in range(self.N_objects)]
+        self.skeleton = None
+        self.index = sidecar.ZIndex.load(os.path.join(name, 'index'+sidecar.EXT))
+
+    def __str__(self):
+        return "{}({}, {} models)".format(self.__class__.__name__, self.name, self.N_models)
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __len__(self):
+        return self.N_models
+
+    def load_skeleton(self):
+        """
+        Load a fresh copy of the model-less GLASS skeleton state
+        """
+        return loadstate(os.path.join(self.name, SKELETON))
+
+    @property
+    def has_average(self):
+        """
+        Whether the skeleton carries the ensemble average of the models
+        """
+        return self.skeleton is not None \
+            and getattr(self.skeleton, 'ensemble_average', None) is not None
+
+    def chunk(self, c):
+        """
+        Decompress a chunk of models (cached)
+
+        Args:
+            c <int> - chunk index
+
+        Kwargs:
+            None
+
+        Return:
+            chunk <dict> - 'models', 'accepted_models', and 'solutions' of the chunk
+        """
+        if c in self._chunks:
+            self._chunks[c] = self._chunks.pop(c)  # move to end
+            return self._chunks[c]
+        with np.load(os.path.join(self.name, _chunk_name(c, '.npz'))) as npz:
+            arrays = dict((k, npz[k]) for k in npz.files)
+        with open(os.path.join(self.name, _chunk_name(c, '.pkl')), 'rb') as f:
+            rest = pickle.load(f)
+        objects = self.skeleton.objects if self.skeleton is not None else [None]*self.N_objects
+        models, accepted_models = [], []
+        for r, (rest_model, rest_accepted) in enumerate(rest):
+            model = self._assemble(rest_model, arrays, r, objects)
+            models.append(model)
+            if rest_accepted is True:
+                accepted_models.append(model)
+            elif rest_accepted is None:
+                accepted_models.append(None)
+            else:
+                accepted_models.append(self._assemble(rest_accepted, arrays, r, objects))
+        solutions = list(arrays['solutions']) if 'solutions' in arrays else []
+        chunk = {'models': models, 'accepted_models': accepted_models, 'solutions': solutions}
+        self._chunks[c] = chunk
+        while len(self._chunks) > self.cache_size:
+            self._chunks.popitem(last=False)
+        return chunk
+
+    def _assemble(self, rest, arrays, row, objects):
+        model = dict((k, v) for k, v in rest.items() if k != 'obj,data')
+        obj_data = []
+        for k, data in enumerate(rest['obj,data']):
+            if data:
+                data = dict(data)
+                for j, key in enumerate(self.keys[k]):
+                    data[key] = arrays['{}.{}'.format(k, j)][row]
+            obj_data.append((objects[k], data))
+        model['obj,data'] = obj_data
+        return model
+
+    def item(self, i, attr='models'):
+        """
+        Random access to a single model (or accepted model, or solution)
+
+        Args:
+            i <int> - model index
+
+        Kwargs:
+            attr <str> - 'models', 'accepted_models', or 'solutions'
+
+        Return:
+            item - the model dictionary (or solution)
+        """
+        if i < 0:
+            i += self.N_models
+        if not 0 <= i < self.N_models:
+            raise IndexError("model index out of range")
+        return self.chunk(i // self.chunk_size)[attr][i % self.chunk_size]
+
+    def stack(self, key='kappa', obj_index=0, selection=None):
+        """
+        Stacked (N_models x N_pixels) array of a per-model quantity without building models
+
+        Args:
+            None
+
+        Kwargs:
+            key <str> - data key of the stacked array
+            obj_index <int> - index of the lens object
+            selection <list(int)> - model indices; default all
+
+        Return:
+            stack <np.ndarray> - the stacked array
+        """
+        j = self.keys[obj_index].index(key)
+        member = '{}.{}'.format(obj_index, j)
+        rows = np.arange(self.N_models) if selection is None else np.asarray(selection)
+        out = None
+        for c in np.unique(rows // self.chunk_size):
+            with np.load(os.path.join(self.name, _chunk_name(c, '.npz'))) as npz:
+                arr = npz[member]
+            if out is None:
+                out = np.empty((len(rows),)+arr.shape[1:], dtype=arr.dtype)
+            w = np.flatnonzero(rows // self.chunk_size == c)
+            out[w] = arr[rows[w] % self.chunk_size]
+        return out
+
+    def to_env(self, selection=None):
+        """
+        Materialize a regular GLASS state (e.g. to be saved as .state)
+
+        Args:
+            None
+
+        Kwargs:
+            selection <list(int)> - model indices to be included; default all
+
+        Return:
+            env <glass.Environment object> - the glass state with all selected models loaded
+        """
+        env = self.load_skeleton()
+        reader = ZStore(self.name, cache_size=1)
+        reader.skeleton = env
+        indices = range(self.N_models) if selection is None else sorted(selection)
+        env.models = [reader.item(i) for i in indices]
+        env.accepted_models = [reader.item(i, 'accepted_models') for i in indices]
+        env.solutions = [reader.item(i, 'solutions') for i in indices] \
+            if self.has_solutions else []
+        return env
+
+
+class ChunkedSequence(object):
+    """
+    Read-only list-like view of the models (or accepted models, or solutions) in a store
+    """
+    def __init__(self, store, attr='models'):
+        self.store = store
+        self.attr = attr
+
+    def __len__(self):
+        return len(self.store)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.store.item(j, self.attr) for j in range(*i.indices(len(self)))]
+        return self.store.item(i, self.attr)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.store.item(i, self.attr)
+
+    def __repr__(self):
+        return "{}({}, {})".format(self.__class__.__name__, self.store.name, self.attr)
+
+
+class ModelView(object):
+    """
+    Lazy read-only list-like view of a selection of models (e.g. a subset of a ChunkedSequence);
+    models are only fetched when the view is iterated, in the order of the selection
+    """
+    def __init__(self, models, selection):
+        self.models = models
+        self.selection = list(selection)
+
+    def __len__(self):
+        return len(self.selection)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.models[j] for j in self.selection[i]]
+        return self.models[self.selection[i]]
+
+    def __iter__(self):
+        for i in self.selection:
+            yield self.models[i]
+
+    def __repr__(self):
+        return "{}({} of {})".format(self.__class__.__name__, len(self), len(self.models))
+
+
+def load(name, cache_size=16):
+    """
+    Load a columnar store as GLASS state whose models are read lazily
+
+    Args:
+        name <str> - path to the store
+
+    Kwargs:
+        cache_size <int> - number of decompressed chunks kept in memory
+
+    Return:
+        env <glass.Environment object> - the glass state with lazy model sequences
+    """
+    zs = ZStore(name, cache_size=cache_size)
+    env = zs.load_skeleton()
+    zs.skeleton = env
+    env.models = ChunkedSequence(zs, 'models')
+    env.accepted_models = ChunkedSequence(zs, 'accepted_models')
+    env.solutions = ChunkedSequence(zs, 'solutions') if zs.has_solutions else []
+    return env
+
+
+def get_store(env):
+    """
+    The store backing a GLASS state; None for regular states
+    """
+    if isinstance(env.models, ChunkedSequence):
+        return env.models.store
+    return None
@@ -0,0 +1,510 @@
+"""
+@author: phdenzel
+
+Additional Tk windows for the Zapp (panel grids, feature panels, model tables, ...)
+"""
+import sys
+import numpy as np
+from PIL import ImageTk
+from matplotlib.figure import Figure
+from matplotlib.colors import LogNorm
+from matplotlib.path import Path
+from matplotlib.widgets import RectangleSelector, LassoSelector
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+if sys.version_info.major < 3:
+    import Tkinter as tk
+elif sys.version_info.major == 3:
+    import tkinter as tk
+else:
+    raise ImportError("Could not import Tkinter")
+
+
+class PanelGrid(tk.Toplevel, object):
+    """
+    Window showing several images in a grid of titled panels
+    """
+    def __init__(self, master, titles, ncols=None, width=400, height=300, title='Zapp',
+                 on_close=None, **kwargs):
+        """
+        Initialize the panels
+
+        Args:
+            master <Tk object> - master root of the window
+            titles <list(str)> - titles of the panels
+
+        Kwargs:
+            ncols <int> - number of panel columns; default as square as possible
+            width <int> - initial width of a panel
+            height <int> - initial height of a panel
+            title <str> - window title
+            on_close <func> - called when the window is closed
+
+        Return:
+            <PanelGrid object> - standard initializer
+        """
+        tk.Toplevel.__init__(self, master, **kwargs)
+        self.title(title)
+        self.on_close = on_close
+        self.protocol('WM_DELETE_WINDOW', self.close)
+        n = len(titles)
+        if ncols is None:
+            ncols = int(n**.5 + .999)
+        self.ncols = max(ncols, 1)
+        self.labels = []
+        self.canvases = []
+        self._img_copy = {}
+        self._img_buffer = {}
+        for i, t in enumerate(titles):
+            row, col = 2*(i // self.ncols), i % self.ncols
+            label = tk.Label(self, text=t)
+            canvas = tk.Canvas(self, borderwidth=0, highlightthickness=0,
+                               width=width, height=height, bg='grey')
+            label.grid(row=row, column=col, sticky=tk.N)
+            canvas.grid(row=row+1, column=col, sticky=tk.NSEW, padx=5, pady=5)
+            canvas.bind("<Configure>", lambda event, i=i: self._on_resize(i))
+            self.rowconfigure(row+1, weight=1)
+            self.columnconfigure(col, weight=1)
+            self.labels.append(label)
+            self.canvases.append(canvas)
+
+    def __len__(self):
+        return len(self.canvases)
+
+    def set_title(self, i, text):
+        """
+        Change the title of a panel
+        """
+        self.labels[i].configure(text=text)
+
+    def set_image(self, i, image, text=None):
+        """
+        Project an image onto a panel
+
+        Args:
+            i <int> - panel index
+            image <PIL.Image object> - the image
+
+        Kwargs:
+            text <str> - overlay text in the top left corner
+
+        Return:
+            None
+        """
+        self._img_copy[i] = (image, text)
+        canvas = self.canvases[i]
+        w, h = max(canvas.winfo_width(), 1), max(canvas.winfo_height(), 1)
+        canvas.delete(tk.ALL)
+        if image is not None:
+            self._img_buffer[i] = ImageTk.PhotoImage(master=canvas, image=image.resize((w, h)))
+            canvas.create_image(0, 0, image=self._img_buffer[i], anchor=tk.NW)
+        if text:
+            canvas.create_text(10, 10, text=text, anchor=tk.NW, fill='SlateBlue4',
+                               font=("Arial", 14))
+
+    def _on_resize(self, i):
+        if i in self._img_copy:
+            self.set_image(i, *self._img_copy[i])
+
+    def close(self):
+        """
+        Close the window
+
+        Args/Kwargs/Return:
+            None
+        """
+        if self.on_close is not None:
+            self.on_close()
+        self.destroy()
+
+
+class FeaturePanel(tk.Toplevel, object):
+    """
+    Window plotting two per-model features of all models as binned densities, with rectangle
+    and lasso selection of models in feature space
+    """
+    def __init__(self, master, names, features, x=None, y=None, bins=200,
+                 title='Zapp - features', on_select=None, on_close=None, **kwargs):
+        """
+        Initialize the panel
+
+        Args:
+            master <Tk object> - master root of the window
+            names <list(str)> - names of the features
+            features <func> - returns the values of a feature of all models of shape (N_models,)
+
+        Kwargs:
+            x <str> - initial feature on the x-axis
+            y <str> - initial feature on the y-axis
+            bins <int> - number of density bins along each axis
+            title <str> - window title
+            on_select <func> - called with the selected model indices and the selection mode
+                               ('add', 'remove', or 'replace')
+            on_close <func> - called when the window is closed
+
+        Return:
+            <FeaturePanel object> - standard initializer
+        """
+        tk.Toplevel.__init__(self, master, **kwargs)
+        self.title(title)
+        self.on_select = on_select
+        self.on_close = on_close
+        self.protocol('WM_DELETE_WINDOW', self.close)
+        self.names = list(names)
+        self.features = features
+        self.bins = bins
+        self.current = None
+        self.selection = np.empty(0, dtype=int)
+        self.selector = None
+        self._overlay = None
+        # controls
+        self.x_var = tk.StringVar(self, x if x in self.names else self.names[0])
+        self.y_var = tk.StringVar(self, y if y in self.names else self.names[-1])
+        self.tool_var = tk.StringVar(self, 'lasso')
+        self.mode_var = tk.StringVar(self, 'add')
+        controls = tk.Frame(self)
+        tk.OptionMenu(controls, self.x_var, *self.names,
+                      command=lambda value: self.plot()).pack(side=tk.LEFT)
+        tk.Label(controls, text='vs').pack(side=tk.LEFT)
+        tk.OptionMenu(controls, self.y_var, *self.names,
+                      command=lambda value: self.plot()).pack(side=tk.LEFT)
+        for tool in ['rectangle', 'lasso']:
+            tk.Radiobutton(controls, text=tool, variable=self.tool_var, value=tool,
+                           command=self._on_tool).pack(side=tk.LEFT)
+        for mode in ['add', 'remove', 'replace']:
+            tk.Radiobutton(controls, text=mode, variable=self.mode_var,
+                           value=mode).pack(side=tk.LEFT)
+        controls.grid(row=0, column=0, sticky=tk.W)
+        # density plot
+        self.figure = Figure(figsize=(6, 5), dpi=100)
+        self.ax = self.figure.add_subplot(111)
+        self.canvas = FigureCanvasTkAgg(self.figure, master=self)
+        self.canvas.get_tk_widget().grid(row=1, column=0, sticky=tk.NSEW)
+        self.rowconfigure(1, weight=1)
+        self.columnconfigure(0, weight=1)
+        self.plot()
+
+    def plot(self):
+        """
+        Draw the density of all models in the plane of the chosen features
+
+        Args/Kwargs/Return:
+            None
+        """
+        x, y = self.features(self.x_var.get()), self.features(self.y_var.get())
+        self.valid = np.flatnonzero(np.isfinite(x) & np.isfinite(y))
+        self.x, self.y = x[self.valid], y[self.valid]
+        self.ax.clear()
+        self._overlay = None
+        self.edges = None
+        if len(self.valid):
+            H, xe, ye = np.histogram2d(self.x, self.y, bins=self.bins)
+            self.edges = (xe, ye)
+            self.extent = [xe[0], xe[-1], ye[0], ye[-1]]
+            self.ax.imshow(np.ma.masked_equal(H.T, 0), origin='lower', extent=self.extent,
+                           aspect='auto', interpolation='nearest', cmap='Greys', norm=LogNorm())
+        self.marker, = self.ax.plot([], [], 'x', color='#fe4365', ms=12, mew=2)
+        self.ax.set_xlabel(self.x_var.get())
+        self.ax.set_ylabel(self.y_var.get())
+        self.ax.set_title("{} models".format(len(self.valid)))
+        self._on_tool()
+        self.set_selection(self.selection)
+        self.set_current(self.current)
+
+    def set_selection(self, selection):
+        """
+        Overlay the density of the selected (tagged) models
+
+        Args:
+            selection <list(int)> - model indices
+
+        Kwargs/Return:
+            None
+        """
+        self.selection = np.unique(np.asarray(list(selection), dtype=int))
+        if self._overlay is not None:
+            self._overlay.remove()
+            self._overlay = None
+        selected = np.in1d(self.valid, self.selection, assume_unique=True)
+        if self.edges is not None and np.any(selected):
+            H, _, _ = np.histogram2d(self.x[selected], self.y[selected], bins=self.edges)
+            self._overlay = self.ax.imshow(
+                np.ma.masked_equal(H.T, 0), origin='lower', extent=self.extent, aspect='auto',
+                interpolation='nearest', cmap='winter', norm=LogNorm(), alpha=0.8)
+        self.canvas.draw_idle()
+
+    def set_current(self, index):
+        """
+        Highlight a model (the one currently displayed)
+
+        Args:
+            index <int> - model index
+
+        Kwargs/Return:
+            None
+        """
+        self.current = index
+        i = np.searchsorted(self.valid, index) if index is not None else len(self.valid)
+        if i < len(self.valid) and self.valid[i] == index:
+            self.marker.set_data([self.x[i]], [self.y[i]])
+        else:
+            self.marker.set_data([], [])
+        self.canvas.draw_idle()
+
+    def _on_tool(self):
+        if self.selector is not None:
+            self.selector.disconnect_events()
+        if self.tool_var.get() == 'rectangle':
+            self.selector = RectangleSelector(self.ax, self._on_rectangle, useblit=True,
+                                              button=[1])
+        else:
+            self.selector = LassoSelector(self.ax, onselect=self._on_lasso, useblit=True,
+                                          button=[1])
+
+    def _on_rectangle(self, press, release):
+        """
+        Select the models within the dragged rectangle
+        """
+        x0, x1 = sorted([press.xdata, release.xdata])
+        y0, y1 = sorted([press.ydata, release.ydata])
+        inside = (self.x >= x0) & (self.x <= x1) & (self.y >= y0) & (self.y <= y1)
+        self._select(self.valid[inside])
+
+    def _on_lasso(self, vertices):
+        """
+        Select the models within the lasso (point-in-polygon test within its bounding box)
+        """
+        vertices = np.asarray(vertices)
+        if len(vertices) < 3:
+            return
+        (x0, y0), (x1, y1) = vertices.min(axis=0), vertices.max(axis=0)
+        candidates = np.flatnonzero((self.x >= x0) & (self.x <= x1)
+                                    & (self.y >= y0) & (self.y <= y1))
+        points = np.column_stack([self.x[candidates], self.y[candidates]])
+        inside = Path(vertices).contains_points(points)
+        self._select(self.valid[candidates[inside]])
+
+    def _select(self, indices):
+        if self.on_select is not None:
+            self.on_select(indices, self.mode_var.get())
+
+    def close(self):
+        """
+        Close the window
+
+        Args/Kwargs/Return:
+            None
+        """
+        if self.selector is not None:
+            self.selector.disconnect_events()
+        if self.on_close is not None:
+            self.on_close()
+        self.destroy()
+
+
+class ModelTable(tk.Toplevel, object):
+    """
+    Virtualized table of per-model summary columns: only the visible rows exist as widgets,
+    which are refilled on scrolling; columns are sorted by cached NumPy argsorts
+    """
+    def __init__(self, master, names, columns, N, rows=30, width=12, title='Zapp - models',
+                 on_click=None, on_close=None, **kwargs):
+        """
+        Initialize the table
+
+        Args:
+            master <Tk object> - master root of the window
+            names <list(str)> - names of the columns
+            columns <func> - returns the values of a column for all models of shape (N_models,)
+            N <int> - number of models
+
+        Kwargs:
+            rows <int> - number of visible rows
+            width <int> - width of a column in characters
+            title <str> - window title
+            on_click <func> - called with the model index of a clicked row
+            on_close <func> - called when the window is closed
+
+        Return:
+            <ModelTable object> - standard initializer
+        """
+        tk.Toplevel.__init__(self, master, **kwargs)
+        self.title(title)
+        self.on_click = on_click
+        self.on_close = on_close
+        self.protocol('WM_DELETE_WINDOW', self.close)
+        self.names = list(names)
+        self.columns = columns
+        self.N = N
+        self.rows = rows
+        self.offset = 0
+        self.current = None
+        self.order = np.arange(N)
+        self.sort_key = None
+        self._values = {}
+        self._orders = {}
+        self.headers = []
+        for c, name in enumerate(self.names):
+            header = tk.Button(self, text=name, width=width, relief=tk.FLAT,
+                               command=lambda name=name: self.sort(name))
+            header.grid(row=0, column=c, sticky=tk.EW)
+            self.headers.append(header)
+        self.cells = []
+        for r in range(rows):
+            row = []
+            for c in range(len(self.names)):
+                cell = tk.Label(self, width=width, anchor=tk.E, font=("Courier", 11))
+                cell.grid(row=r+1, column=c, sticky=tk.EW)
+                cell.bind("<Button-1>", lambda event, r=r: self._on_click(r))
+                row.append(cell)
+            self.cells.append(row)
+        self.scrollbar = tk.Scrollbar(self, orient=tk.VERTICAL, command=self._on_scroll)
+        self.scrollbar.grid(row=1, column=len(self.names), rowspan=rows, sticky=tk.NS)
+        for sequence, step in [("<Button-4>", -3), ("<Button-5>", 3), ("<Up>", -1),
+                               ("<Down>", 1), ("<Prior>", -rows), ("<Next>", rows)]:
+            self.bind(sequence, lambda event, step=step: self.scroll(step))
+        self.bind("<MouseWheel>", lambda event: self.scroll(-3 if event.delta > 0 else 3))
+        self.draw()
+
+    def __len__(self):
+        return self.N
+
+    def values(self, name):
+        """
+        Values of a column (cached)
+        """
+        if name not in self._values:
+            self._values[name] = np.asarray(self.columns(name))
+        return self._values[name]
+
+    def refresh(self, names=None):
+        """
+        Discard the cached values and sort orders of columns (default all) and redraw
+
+        Args:
+            None
+
+        Kwargs:
+            names <list(str)> - names of the changed columns
+
+        Return:
+            None
+        """
+        names = self.names if names is None else names
+        for name in names:
+            self._values.pop(name, None)
+            self._orders.pop((name, False), None)
+            self._orders.pop((name, True), None)
+        if self.sort_key is not None and self.sort_key[0] in names:
+            self.order = self._order(*self.sort_key)
+        self.draw()
+
+    def _order(self, name, descending=False):
+        """
+        Cached argsort of a column (NaNs last in either direction)
+        """
+        key = (name, descending)
+        if key not in self._orders:
+            v = self.values(name).astype(np.float64)
+            self._orders[key] = np.argsort(-v if descending else v, kind='mergesort')
+        return self._orders[key]
+
+    def sort(self, name):
+        """
+        Sort the rows by a column (descending when sorted by the same column again)
+
+        Args:
+            name <str> - column name
+
+        Kwargs/Return:
+            None
+        """
+        descending = self.sort_key == (name, False)
+        self.sort_key = (name, descending)
+        self.order = self._order(name, descending)
+        for header, n in zip(self.headers, self.names):
+            header.configure(text=n + ((u' \u25bc' if descending else u' \u25b2')
+                                       if n == name else ''))
+        self.offset = 0
+        self.draw()
+
+    def scroll(self, step):
+        """
+        Scroll by a number of rows
+        """
+        self.offset = min(max(self.offset + step, 0), max(self.N - self.rows, 0))
+        self.draw()
+
+    def _on_scroll(self, action, value, unit=None):
+        if action == 'moveto':
+            self.offset = 0
+            self.scroll(int(float(value) * self.N))
+        elif unit == 'pages':
+            self.scroll(int(value) * self.rows)
+        else:
+            self.scroll(int(value))
+
+    def _on_click(self, r):
+        if self.offset + r < self.N and self.on_click is not None:
+            self.on_click(int(self.order[self.offset + r]))
+
+    @staticmethod
+    def format(value):
+        """
+        Cell text of a value
+        """
+        if isinstance(value, (bool, np.bool_)):
+            return u'\u2713' if value else ''
+        if isinstance(value, (int, np.integer)):
+            return str(value)
+        if np.isnan(value):
+            return '-'
+        return '{:.4g}'.format(value)
+
+    def draw(self):
+        """
+        Fill the visible rows
+
+        Args/Kwargs/Return:
+            None
+        """
+        visible = self.order[self.offset:self.offset+self.rows]
+        columns = [self.values(name)[visible] for name in self.names]
+        for r, row in enumerate(self.cells):
+            current = r < len(visible) and visible[r] == self.current
+            for c, cell in enumerate(row):
+                text = self.format(columns[c][r]) if r < len(visible) else ''
+                cell.configure(text=text, bg='SlateBlue1' if current else 'white smoke')
+        if self.N:
+            self.scrollbar.set(float(self.offset) / self.N,
+                               float(self.offset + len(visible)) / self.N)
+
+    def set_current(self, index):
+        """
+        Highlight a model (the one currently displayed), scrolling to it if not visible
+
+        Args:
+            index <int> - model index
+
+        Kwargs/Return:
+            None
+        """
+        self.current = index
+        visible = self.order[self.offset:self.offset+self.rows]
+        if index is not None and index not in visible:
+            position = np.flatnonzero(self.order == index)
+            if len(position):
+                self.offset = 0
+                self.scroll(position[0] - self.rows // 2)
+                return
+        self.draw()
+
+    def close(self):
+        """
+        Close the window
+
+        Args/Kwargs/Return:
+            None
+        """
+        if self.on_close is not None:
+            self.on_close()
+        self.destroy()